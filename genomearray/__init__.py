@@ -1,8 +1,38 @@
 # import core functionality on top level
 from core.genomereps import dnatoonehot, addChannels, genometoonehot, extractntonehot
-from core.slicing import regionfunc, regionslice, genomeslice, splitregions
-from core.pwm import getGenomeConvolution, getPositionWeightMatrix
-from core.saveload import loadarrays, mediandensitynormalization, countnormalization, loadarrays2d, regionsumnormalization2d
+from core.slicing import regionfunc, regionslice, genomeslice, splitregions, itersplitregions, windowslice
+from core.pwm import getGenomeConvolution, getPositionWeightMatrix, getBankConvolution, getMotifHits, getScoreThreshold
+from core.saveload import loadarrays, mediandensitynormalization, countnormalization, loadarrays2d, regionsumnormalization2d, CohortSizeFactors, savesizefactors, loadsizefactors
 from core.misc import concatregions, regionstomask, masktoregions, argoverlappingregions, subtractregion
+from core.ragged import RaggedArray, saveragged, loadragged
+from core.seqindex import MotifIndex, findmotif, savemotifindex, loadmotifindex
+from core.replicons import GenomeArray, savegenomearray, loadgenomearray
+from core.chunked import ChunkedArray, savechunked, ischunked
+from core.rle import RLETrack, saverle, loadrle
+from core.pyramid import SummaryPyramid, savepyramid, loadpyramid
+from core.trackio import writebedgraph, readbedgraph, writewig, readwig
+from core.budget import setmemorybudget, getmemorybudget, memorybudget, MemoryBudgetError
+from core.instrument import profiled, profiling, enableprofiling, disableprofiling, resetprofile, profilestats, profilereport, saveprofile
 
-import mapgen, ntmath, plot, regmath, signal, cutnn
\ No newline at end of file
+# submodules are imported on first attribute access (ga.mapgen.mapfragdensity, ...), so that only
+# the third-party packages actually used (pysam, matplotlib, scikit-learn, ...) are loaded
+import sys as _sys
+import types as _types
+import importlib as _importlib
+
+class _LazyModule(_types.ModuleType):
+    """ Placeholder for a submodule which imports it and replaces itself on first attribute access. """
+    def _load(self):
+        module = _importlib.import_module(self.__name__) # also sets the attribute on the package
+        setattr(_sys.modules[__name__], self.__name__.rsplit('.', 1)[1], module)
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+for _submodule in ['mapgen', 'ntmath', 'plot', 'regmath', 'signal', 'cutnn', 'synth']:
+    if __name__ + '.' + _submodule not in _sys.modules:
+        globals()[_submodule] = _LazyModule(__name__ + '.' + _submodule)
\ No newline at end of file
@@ -0,0 +1,73 @@
+import os
+import contextlib
+
+# memory budget (bytes) consulted by functions before large allocations, None for no budget
+_budget = {'bytes' : None}
+
+class MemoryBudgetError(MemoryError):
+    """ Raised when an allocation estimate exceeds the memory budget and no chunked path exists. """
+    def __init__(self, description, estimate, budget):
+        self.estimate = estimate
+        self.budget = budget
+        MemoryError.__init__(self, '%s needs an estimated %.1f MB, over the memory budget of %.1f MB.' %
+                             (description, estimate / 1024.**2, budget / 1024.**2))
+
+def _parsebytes(value):
+    # int bytes from an int or a string with an optional K, M or G suffix (e.g. '4G')
+    if value is None:
+        return None
+    value = str(value).strip().upper().rstrip('B')
+    multiplier = {'K' : 1024, 'M' : 1024**2, 'G' : 1024**3}.get(value[-1:], 1)
+    return int(float(value.rstrip('KMG')) * multiplier)
+
+def setmemorybudget(n_bytes):
+    """ Set the memory budget consulted before large allocations.
+
+        Functions with parameter-dependent footprints (ntmath.rollingslope, getGenomeConvolution,
+        the normalization functions and regionstomask) estimate their allocation and, when it
+        exceeds the budget, switch to a chunked path along the genome or raise MemoryBudgetError.
+        The budget can also be set with the GENOMEARRAY_MEMORY_BUDGET environment variable.
+
+        Parameters:
+        ----------
+        n_bytes : None, int or string
+            Budget in bytes, or a string such as '512M' or '4G'. None removes the budget.
+    """
+    _budget['bytes'] = _parsebytes(n_bytes)
+
+def getmemorybudget():
+    """ Returns the memory budget in bytes, or None if no budget is set. """
+    return _budget['bytes']
+
+@contextlib.contextmanager
+def memorybudget(n_bytes):
+    """ Context manager setting the memory budget (see setmemorybudget) inside it. """
+    previous = _budget['bytes']
+    setmemorybudget(n_bytes)
+    try:
+        yield
+    finally:
+        _budget['bytes'] = previous
+
+def withinbudget(estimate):
+    """ True if an allocation of estimate bytes fits the memory budget (or no budget is set). """
+    return _budget['bytes'] is None or estimate <= _budget['bytes']
+
+def requirebudget(estimate, description):
+    """ Raises MemoryBudgetError if an allocation of estimate bytes does not fit the budget. """
+    if not withinbudget(estimate):
+        raise MemoryBudgetError(description, estimate, _budget['bytes'])
+
+def budgetchunklen(bytes_per_position, halo=0, fixed_bytes=0, description='chunk'):
+    """ Largest number of genome positions per chunk whose allocation (bytes_per_position for each
+        position of the chunk and its halo, plus fixed_bytes) fits the budget. Raises
+        MemoryBudgetError if not even one position fits. """
+    if _budget['bytes'] is None:
+        return None
+    chunk_len = (_budget['bytes'] - fixed_bytes) // bytes_per_position - halo
+    if chunk_len < 1:
+        raise MemoryBudgetError(description, fixed_bytes + bytes_per_position * (halo + 1), _budget['bytes'])
+    return int(chunk_len)
+
+if os.environ.get('GENOMEARRAY_MEMORY_BUDGET', '') != '':
+    setmemorybudget(os.environ['GENOMEARRAY_MEMORY_BUDGET'])
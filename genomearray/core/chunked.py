@@ -0,0 +1,247 @@
+import os
+import json
+import zlib
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from instrument import profiled
+
+# codecs: (compress(bytes, level), decompress(bytes)); lz4 is optional
+def _lz4codec():
+    try:
+        import lz4.frame
+    except ImportError:
+        raise ImportError("codec 'lz4' requires the lz4 package, use codec='zlib' otherwise.")
+    return (lambda data, level: lz4.frame.compress(data, compression_level=level), lz4.frame.decompress)
+
+def _getcodec(codec):
+    if codec == 'zlib':
+        return zlib.compress, zlib.decompress
+    elif codec == 'lz4':
+        return _lz4codec()
+    raise ValueError("codec must be 'zlib' or 'lz4'.")
+
+def _shufflebytes(chunk):
+    # group the n-th byte of every element together, long runs of equal high bytes compress far better
+    return np.ascontiguousarray(chunk).view(np.uint8).reshape(-1, chunk.dtype.itemsize).T.tobytes()
+
+def _unshufflebytes(data, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.copy().view(dtype).reshape(-1)
+
+def _chunkbounds(length, chunk_len):
+    starts = np.arange(0, length, chunk_len)
+    return zip(starts, np.minimum(starts + chunk_len, length))
+
+@profiled()
+def savechunked(path, input_array, chunk_len=65536, codec='zlib', level=1, shuffle=True, workers=1):
+    """ Save a genome-shaped array as a chunked, compressed store.
+
+        The genome is split into chunks of chunk_len nt (both strands and all channels of a chunk
+        are stored together), each chunk is compressed independently and written back to back in
+        data.bin, with the byte offset of each chunk in index.npy and the array shape, dtype and
+        codec in meta.json. Any region can then be read by decompressing only the chunks it overlaps,
+        see ChunkedArray.
+
+        Parameters:
+        ----------
+        path : path to store directory (string)
+            Created if it does not exist.
+
+        input_array : numpy array, shape (2, len genome, ...)
+            Array to store, e.g. a fragment density.
+
+        chunk_len : int, 65536 (default)
+            Genome nt per chunk. Smaller chunks make random region reads cheaper, larger chunks
+            compress better.
+
+        codec : 'zlib' (default) or 'lz4'
+            Compression codec. lz4 is faster but requires the lz4 package.
+
+        level : int, 1 (default)
+            Compression level passed to the codec.
+
+        shuffle : True (default) or False
+            If True, the bytes of each element are grouped (byte-shuffled) before compression,
+            which greatly improves the ratio for counts and smooth tracks.
+
+        workers : int, 1 (default)
+            Threads compressing chunks.
+    """
+    input_array = np.asarray(input_array)
+    compress, decompress = _getcodec(codec)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    def compresschunk(bounds):
+        chunk = np.ascontiguousarray(input_array[:, bounds[0]:bounds[1]])
+        return compress(_shufflebytes(chunk) if shuffle else chunk.tobytes(), level)
+    bounds = list(_chunkbounds(input_array.shape[1], chunk_len))
+    if workers > 1:
+        pool = ThreadPool(workers)
+        compressed = pool.imap(compresschunk, bounds) # in order
+    else:
+        compressed = (compresschunk(b) for b in bounds)
+    offsets = [0]
+    with open(os.path.join(path, 'data.bin'), 'wb') as f:
+        for data in compressed:
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    if workers > 1:
+        pool.close()
+        pool.join()
+    np.save(os.path.join(path, 'index.npy'), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'shape' : list(input_array.shape), 'dtype' : input_array.dtype.str, 'chunk_len' : chunk_len,
+                   'codec' : codec, 'shuffle' : shuffle}, f)
+
+def ischunked(path):
+    """ True if path is a store written by savechunked. """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json')) and \
+           os.path.exists(os.path.join(path, 'index.npy'))
+
+class ChunkedArray():
+    """ Read-only genome-shaped array backed by a store written with savechunked.
+
+        Indexing with [strand, left:right] (as done by regionfunc, regionslice and plot.RegionPlot)
+        decompresses only the chunks overlapping the slice. Recently used chunks are kept in a small
+        cache so that neighbouring regions do not decompress the same chunk twice. np.asarray (or
+        read) loads the whole array, decompressing chunks on several threads. The thread pool is
+        created on the first read needing it and kept until close (also called on deletion and at
+        the end of a with block).
+
+        Parameters:
+        ----------
+        path : path to store directory (string)
+
+        cache_chunks : int, 32 (default)
+            Number of decompressed chunks kept in memory.
+
+        workers : int, 4 (default)
+            Threads decompressing chunks for reads spanning several chunks.
+
+    """
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk(self, chunk_i, use_cache=True):
+        # decompressed chunk chunk_i, shape (2, chunk length, ...), from the cache if possible
+        if not use_cache:
+            return self._decompresschunk(chunk_i)
+        with self._lock:
+            if chunk_i in self._cache:
+                self._cache[chunk_i] = self._cache.pop(chunk_i) # mark as most recently used
+                return self._cache[chunk_i]
+        chunk = self._decompresschunk(chunk_i)
+        with self._lock:
+            self._cache[chunk_i] = chunk
+            while len(self._cache) > self.cache_chunks:
+                self._cache.popitem(last=False)
+        return chunk
+
+    def _decompresschunk(self, chunk_i):
+        data = self._decompress(self._data[self._index[chunk_i]:self._index[chunk_i+1]].tobytes())
+        if self.meta['shuffle']:
+            chunk = _unshufflebytes(data, self.dtype)
+        else:
+            chunk = np.frombuffer(data, dtype=self.dtype)
+        chunk_len = min(self.chunk_len, self.shape[1] - chunk_i*self.chunk_len)
+        return chunk.reshape((self.shape[0], chunk_len) + tuple(self.shape[2:]))
+
+    def read(self, left=0, right=None, workers=None):
+        """ Read genome positions left to right (inclusive) of both strands as a numpy array. """
+        right = self.shape[1] - 1 if right is None else min(right, self.shape[1] - 1)
+        left = max(0, left)
+        out = np.empty((self.shape[0], max(0, right - left + 1)) + tuple(self.shape[2:]), dtype=self.dtype)
+        if right < left:
+            return out
+        chunk_ids = range(left // self.chunk_len, right // self.chunk_len + 1)
+        use_cache = len(chunk_ids) <= self.cache_chunks # large reads would only flush the cache
+        def fill(chunk_i):
+            chunk_left = chunk_i * self.chunk_len
+            chunk = self._chunk(chunk_i, use_cache)
+            a, b = max(left, chunk_left), min(right + 1, chunk_left + chunk.shape[1])
+            out[:, a-left:b-left] = chunk[:, a-chunk_left:b-chunk_left]
+        workers = self.workers if workers is None else workers
+        with self._lock:
+            uncached = [i for i in chunk_ids if not use_cache or i not in self._cache]
+        if workers > 1 and len(uncached) > 1: # decompress on threads, cached chunks are only copied
+            self._getpool(workers).map(fill, uncached)
+            chunk_ids = [i for i in chunk_ids if i not in set(uncached)]
+        for chunk_i in chunk_ids:
+            fill(chunk_i)
+        return out
+
+    def _getpool(self, workers):
+        # thread pool of this array, created on first use (or with a new number of workers)
+        with self._lock:
+            if self._pool is None or self._pool_workers != workers:
+                if self._pool is not None:
+                    self._pool.close()
+                self._pool, self._pool_workers = ThreadPool(workers), workers
+            return self._pool
+
+    def close(self):
+        """ Stop the decompression threads (reading again restarts them). """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, '_pool', None) is not None:
+            self.close()
+
+    def __getitem__(self, key):
+        # supports [strand], [strand, left:right], [strand, position], [strand, positions] and [:, ...]
+        if not isinstance(key, tuple):
+            key = (key,)
+        strand_key = key[0]
+        position_key = key[1] if len(key) > 1 else slice(None)
+        if isinstance(position_key, slice) and position_key.indices(self.shape[1])[2] == 1:
+            start, stop, step = position_key.indices(self.shape[1])
+            data = self.read(start, stop - 1)
+        else: # read the span of the requested positions, then index it
+            if isinstance(position_key, slice):
+                positions = np.arange(*position_key.indices(self.shape[1]))
+            else:
+                positions = np.asarray(position_key)
+                positions = np.where(positions < 0, positions + self.shape[1], positions)
+            left = int(np.min(positions)) if positions.size > 0 else 0
+            right = int(np.max(positions)) if positions.size > 0 else -1
+            data = self.read(left, right)[:, positions - left]
+        return data[(strand_key,) + tuple(key[2:])]
+
+    def __array__(self, dtype=None):
+        out = self.read()
+        return out if dtype is None else out.astype(dtype)
+
+    def __init__(self, path, cache_chunks=32, workers=4):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(str(self.meta['dtype']))
+        self.chunk_len = self.meta['chunk_len']
+        self.cache_chunks = cache_chunks
+        self.workers = workers
+        self._decompress = _getcodec(self.meta['codec'])[1]
+        self._index = np.load(os.path.join(path, 'index.npy'))
+        if self._index[-1] > 0:
+            self._data = np.memmap(os.path.join(path, 'data.bin'), dtype=np.uint8, mode='r')
+        else: # empty array, mmap cannot map an empty file
+            self._data = np.empty(0, dtype=np.uint8)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool, self._pool_workers = None, None
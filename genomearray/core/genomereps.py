@@ -1,4 +1,6 @@
 import numpy as np
+import genomearray as ga
+from instrument import profiled
 
 def dnatoonehot(string,dtype=np.uint8):
     """ A,T,G,C 
@@ -26,13 +28,24 @@ def addChannels(genome_representation, additional_arrays):
     concatenated_representation = np.concatenate([genome_representation,np.reshape(additional_data_arrays[:,:,:],(additional_data_arrays.shape[1],additional_data_arrays.shape[0],-1))])
     return concatenated_representation
 
+@profiled(items=lambda onehot: onehot.shape[1])
 def genometoonehot(genbank_file):
     genome_fwd = dnatoonehot(str(genbank_file.seq))
     genome_rev = np.flip(dnatoonehot(str(genbank_file.seq.reverse_complement())),0)
     genome_onehot = np.asarray([genome_fwd, genome_rev])
     return genome_onehot
 
-def extractntonehot(onehot_genome, positions, five, three):
+@profiled(items='positions')
+def extractntonehot(onehot_genome, positions, five, three, ragged=False, dense=False):
+    if dense: # all windows have the same width, gather them as a single (n, five+three, 4) array
+        return ga.windowslice(positions, onehot_genome, five, three, wrt='5_to_3')
+    if ragged: # gather all windows in a single pass, 5' -> 3' on both strands
+        positions = np.asarray(positions)
+        strand, pos = positions[:,0], positions[:,1]
+        regions = np.asarray([strand,
+                              np.where(strand == 0, pos-five, pos-three+1),
+                              np.where(strand == 0, pos+three-1, pos+five)]).T
+        return ga.regionslice(regions, onehot_genome, wrt='5_to_3', ragged=True)
     extracted_nt = []
     for s,pos in positions:
         if s == 0:
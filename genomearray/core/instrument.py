@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import atexit
+import contextlib
+import threading
+import functools
+import inspect
+import numpy as np
+try:
+    import tracemalloc # python 3.4+
+except ImportError:
+    tracemalloc = None
+try:
+    import resource # unix only
+except ImportError:
+    resource = None
+
+# profiling state, shared by all decorated functions. when disabled, a decorated function costs a
+# single dictionary lookup on top of the plain call.
+_state = {'enabled' : False, 'track_memory' : True, 'started_tracemalloc' : False, 'memory_source' : None,
+          'stats' : {}, 'events' : [], 'max_events' : 100000, 'start_time' : None}
+_lock = threading.Lock()
+_local = threading.local() # per-thread stack of open calls, for nested peak memory
+
+def _memorynow():
+    # (baseline, peak) bytes: current and peak traced allocation if tracemalloc is tracing, otherwise
+    # the process peak RSS for both, so that peak - baseline at the start of a call is its growth
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()
+    if resource is not None:
+        # ru_maxrss is reported in kB on linux and bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return peak_rss, peak_rss
+    return 0, 0
+
+def _itemcounter(func, items):
+    # build a function (args, kwargs, result) -> number of items processed, or None
+    if items is None:
+        return None
+    if callable(items):
+        return lambda args, kwargs, result: items(result)
+    arg_names = getattr(inspect, 'getfullargspec', inspect.getargspec)(func).args
+    arg_i = arg_names.index(items) if items in arg_names else None
+    def countitems(args, kwargs, result):
+        if items in kwargs:
+            value = kwargs[items]
+        elif arg_i is not None and arg_i < len(args):
+            value = args[arg_i]
+        else:
+            return None
+        return None if value is None else int(np.shape(value)[0])
+    return countitems
+
+def _record(name, start, seconds, n_items, peak_bytes):
+    with _lock:
+        stats = _state['stats'].setdefault(name, {'calls' : 0, 'total_time' : 0., 'max_time' : 0.,
+                                                  'items' : 0, 'peak_bytes' : 0})
+        stats['calls'] += 1
+        stats['total_time'] += seconds
+        stats['max_time'] = max(stats['max_time'], seconds)
+        stats['items'] += n_items or 0
+        stats['peak_bytes'] = max(stats['peak_bytes'], peak_bytes)
+        if len(_state['events']) < _state['max_events']:
+            _state['events'].append({'name' : name, 'start' : start - _state['start_time'], 'seconds' : seconds,
+                                     'items' : n_items, 'peak_bytes' : peak_bytes,
+                                     'thread' : threading.current_thread().name})
+
+def profiled(items=None, name=None):
+    """ Decorator registering a function with the profiler.
+
+        While profiling is enabled (see enableprofiling, profiling and the GENOMEARRAY_PROFILE
+        environment variable), each call records its wall time, the number of items it processed
+        and the peak memory allocated during the call. Without tracemalloc (python 2), memory is
+        instead the growth of the process RSS high-water mark, which is 0 for any call staying below
+        an earlier peak. Times of nested profiled calls are included in the time of the calling
+        function.
+
+        Parameters:
+        ----------
+        items : None (default), string or callable
+            Items processed per call. A string names an argument whose length is counted (e.g.
+            'regions' or 'positions'); a callable is given the return value and returns the count.
+
+        name : None (default) or string
+            Name in reports. If None, the public module path and function name, e.g.
+            'core.slicing.regionfunc'.
+    """
+    def decorate(func):
+        module_path = [p for p in func.__module__.split('.') if not p.startswith('_') and p != 'genomearray']
+        func_name = name or '.'.join(module_path + [func.__name__])
+        countitems = _itemcounter(func, items)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            if not hasattr(_local, 'stack'):
+                _local.stack = []
+            track_memory = _state['track_memory']
+            if track_memory:
+                if tracemalloc is not None and hasattr(tracemalloc, 'reset_peak') and tracemalloc.is_tracing():
+                    tracemalloc.reset_peak() # python 3.9+; peaks of finished inner calls are kept on the stack
+                memory_start = _memorynow()
+            frame = [0] # highest absolute peak reached by inner profiled calls
+            _local.stack.append(frame)
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                seconds = time.time() - start
+                _local.stack.pop()
+                peak_bytes = 0
+                if track_memory:
+                    absolute_peak = max(_memorynow()[1], frame[0])
+                    if len(_local.stack) > 0:
+                        _local.stack[-1][0] = max(_local.stack[-1][0], absolute_peak)
+                    # allocated bytes above the start of the call (tracemalloc) or growth of peak RSS
+                    peak_bytes = max(0, absolute_peak - memory_start[0])
+            n_items = None
+            if countitems is not None:
+                try:
+                    n_items = countitems(args, kwargs, result)
+                except Exception:
+                    n_items = None
+            _record(func_name, start, seconds, n_items, peak_bytes)
+            return result
+        wrapper.profiled_name = func_name
+        return wrapper
+    return decorate
+
+def enableprofiling(track_memory=True, max_events=100000):
+    """ Start recording calls of profiled functions.
+
+        Parameters:
+        ----------
+        track_memory : True (default) or False
+            Record peak allocation of each call. Uses tracemalloc where available (started if it is
+            not already tracing), otherwise the growth of the process RSS high-water mark.
+
+        max_events : int, 100000 (default)
+            Maximum number of individual calls kept for the JSON trace. Aggregated statistics are
+            always kept.
+    """
+    if _state['start_time'] is None:
+        _state['start_time'] = time.time()
+    _state['track_memory'] = track_memory
+    _state['max_events'] = max_events
+    if track_memory and tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state['started_tracemalloc'] = True
+    if track_memory:
+        _state['memory_source'] = ('tracemalloc' if tracemalloc is not None else
+                                   'rss_high_water_growth' if resource is not None else None)
+    _state['enabled'] = True
+
+def disableprofiling():
+    """ Stop recording calls, recorded statistics are kept until resetprofile. """
+    _state['enabled'] = False
+    if _state['started_tracemalloc']:
+        tracemalloc.stop()
+        _state['started_tracemalloc'] = False
+
+def resetprofile():
+    """ Clear all recorded statistics and events. """
+    with _lock:
+        _state['stats'] = {}
+        _state['events'] = []
+        _state['start_time'] = time.time()
+
+@contextlib.contextmanager
+def profiling(track_memory=True, reset=True):
+    """ Context manager profiling the calls made inside it, e.g.
+
+            with ga.profiling():
+                ga.cutnn.feat.buildbinaryfeatures(...)
+            print(ga.profilereport())
+
+        Parameters:
+        ----------
+        track_memory : True (default) or False
+            See enableprofiling.
+
+        reset : True (default) or False
+            If True, statistics recorded before entering are cleared.
+    """
+    was_enabled = _state['enabled']
+    if reset:
+        resetprofile()
+    enableprofiling(track_memory=track_memory)
+    try:
+        yield
+    finally:
+        if not was_enabled:
+            disableprofiling()
+
+def profilestats():
+    """ Returns a copy of the aggregated statistics, {name : {calls, total_time, max_time, items, peak_bytes}}. """
+    with _lock:
+        return dict((name, dict(stats)) for name, stats in _state['stats'].items())
+
+def profilereport(sort_by='total_time'):
+    """ Formats aggregated statistics as a table sorted (descending) by sort_by.
+
+        Parameters:
+        ----------
+        sort_by : 'total_time' (default), 'calls', 'max_time', 'items' or 'peak_bytes'
+
+        Returns:
+        ----------
+        report : string
+    """
+    stats = profilestats()
+    # without tracemalloc, peak_bytes only measures growth of the RSS high-water mark
+    memory_header = 'RSS grow MB' if _state['memory_source'] == 'rss_high_water_growth' else 'peak MB'
+    lines = ['%-44s %8s %12s %12s %12s %12s %11s' % ('function', 'calls', 'total s', 'per call s',
+                                                   'items', 'items / s', memory_header)]
+    for name in sorted(stats, key=lambda n: stats[n][sort_by], reverse=True):
+        s = stats[name]
+        lines.append('%-44s %8i %12.4f %12.6f %12i %12.1f %11.1f' % (name, s['calls'], s['total_time'],
+                     s['total_time'] / s['calls'], s['items'], s['items'] / max(s['total_time'], 1e-9),
+                     s['peak_bytes'] / 1024.**2))
+    return '\n'.join(lines)
+
+def saveprofile(path):
+    """ Writes aggregated statistics and the per-call event trace to a JSON file. """
+    with _lock:
+        trace = {'stats' : _state['stats'], 'events' : _state['events'], 'memory_source' : _state['memory_source']}
+        with open(path, 'w') as f:
+            json.dump(trace, f, indent=1)
+
+def _profileatexit(destination):
+    if destination.lower() in ('1', 'true', 'yes', 'on'):
+        sys.stderr.write(profilereport() + '\n')
+    else:
+        saveprofile(destination)
+
+# GENOMEARRAY_PROFILE=1 prints a report at exit, any other value is used as the JSON trace path
+if os.environ.get('GENOMEARRAY_PROFILE', '') not in ('', '0'):
+    enableprofiling()
+    atexit.register(_profileatexit, os.environ['GENOMEARRAY_PROFILE'])
@@ -1,5 +1,8 @@
 import numpy as np
+from instrument import profiled
+from budget import requirebudget
 
+@profiled(items='in_regions')
 def concatregions(in_regions):
     """ Combines overlapping regions in a list of input regions into single regions.
 
@@ -40,6 +43,7 @@ def concatregions(in_regions):
                 out_regions.append(next_value)
     return np.asarray(out_regions)
 
+@profiled(items='in_regions')
 def regionstomask(in_regions, genome_len):
     """ Makes a genome-shaped (2, genome_len) True / False mask based on in_regions.
 
@@ -60,11 +64,13 @@ def regionstomask(in_regions, genome_len):
         out_mask : numpy array, shape (2, genome_len)
             A mask of shape (2, genome_len) with positions included in in_regions as True.
     """
-    out_mask = np.zeros((2,genome_len)).astype(bool)
+    requirebudget(2*genome_len, 'regionstomask mask (use RLETrack.fromregions for a run-length mask)')
+    out_mask = np.zeros((2,genome_len), dtype=bool) # allocated directly, not through a float64 array
     for region in in_regions:
         out_mask[region[0],region[1]:region[2]+1] = True
     return out_mask
 
+@profiled()
 def masktoregions(in_mask):
     """ Finds contiguous True regions on a genome-shaped mask.
 
@@ -1,6 +1,9 @@
 import numpy as np
-from scipy.signal import convolve
+from numpy.lib.stride_tricks import as_strided
+from instrument import profiled
+from budget import withinbudget, budgetchunklen
 
+@profiled(items=lambda scores: scores.shape[-1])
 def getGenomeConvolution(genome_representation, pwm):
     """ Returns the convolution of a position weight matrix (shape is (pwm_position, nt_positions))
         across genome representation in a 5'-> 3' direction.
@@ -21,13 +24,243 @@ def getGenomeConvolution(genome_representation, pwm):
         out : numpy array
             Returns zero-padded numpy array of same shape as genome representation.
         """
-    score_fwd = np.reshape(convolve(np.flip(np.flip(pwm.T,0),1),genome_representation[0],mode='valid'),-1)
+    from scipy.signal import convolve # imported on use, scipy is slow to import
+    kernel = np.flip(np.flip(pwm.T,0),1)
+    def validconvolve(strand_representation):
+        # valid convolution, in chunks along the genome (with a halo of the pwm length) if the
+        # float64 copies made by convolve exceed the memory budget
+        halo = kernel.shape[0] - 1
+        bytes_per_position = 4*8*strand_representation.shape[-1] # input copy, fft buffers and output
+        if withinbudget(bytes_per_position*strand_representation.shape[0]):
+            return np.reshape(convolve(kernel,strand_representation,mode='valid'),-1)
+        chunk_len = budgetchunklen(bytes_per_position, halo=halo, description='getGenomeConvolution chunk')
+        n_valid = max(0, strand_representation.shape[0] - halo)
+        return np.concatenate([np.reshape(convolve(kernel,strand_representation[left:min(n_valid,left+chunk_len)+halo],mode='valid'),-1)
+                               for left in range(0, n_valid, chunk_len)] + [np.zeros(0)])
+    score_fwd = validconvolve(genome_representation[0])
     score_fwd = np.r_[score_fwd, np.zeros(genome_representation.shape[1] - score_fwd.shape[0]).astype(int)]
-    score_rev = np.reshape(convolve(np.flip(np.flip(pwm.T,0),1),np.flip(genome_representation[1],0),mode='valid'),-1)
+    score_rev = validconvolve(np.flip(genome_representation[1],0))
     score_rev = np.flip(np.r_[score_rev, np.zeros(genome_representation.shape[1] - score_rev.shape[0])],0)
     out = np.asarray([score_fwd, score_rev])
     return out
 
+@profiled(items=lambda scores: scores.shape[-1])
+def getBankConvolution(genome_representation, pwms, chunk_size=100000, out=None):
+    """ Scores a bank of position weight matrices across both strands of the genome in one pass.
+
+        Equivalent to calling getGenomeConvolution for each PWM, but all PWMs are scored together
+        as a single matrix product on a sliding-window view of each genome chunk, so the genome is
+        read once per strand regardless of the number of motifs. Scores are stored at the same
+        positions as getGenomeConvolution (5' end of the motif), positions where a motif would run
+        off the end of the genome are 0.
+
+        Parameters:
+        ----------
+        genome_representation : numpy array, shape (2, len genome, n channels)
+            Genome representation, e.g. from genometoonehot.
+
+        pwms : list of numpy arrays, each shape (n channels, motif length)
+            Position weight matrices (rows = <A,T,G,C>, columns = position), as returned by
+            getPositionWeightMatrix. Motif lengths may differ. Windows using a base scored -inf
+            (zero frequency) score -inf.
+
+        chunk_size : int, 100000 (default)
+            Number of genome positions scored per matrix product. Bounds temporary memory to
+            roughly chunk_size * max motif length * n channels floats.
+
+        out : None (default) or numpy array, shape (n pwms, 2, len genome)
+            Array to write scores into, e.g. np.lib.format.open_memmap for on-disk output. If None,
+            a float32 array is allocated.
+
+        Returns:
+        ----------
+        out : numpy array, shape (n pwms, 2, len genome)
+            Score of each PWM on each strand at each position.
+        """
+    genome_len = genome_representation.shape[1]
+    bank, forbidden, motif_lens = _stackpwms(pwms, genome_representation.shape[2])
+    if out is None:
+        out = np.zeros((len(pwms), 2, genome_len), dtype=np.float32)
+    # the second strand is scored 5' -> 3' on its reversed view, written back through a reversed view
+    for strand_data, strand_out in [(genome_representation[0], out[:,0,:]),
+                                    (genome_representation[1][::-1], out[:,1,::-1])]:
+        for left in range(0, genome_len, chunk_size):
+            right = min(left + chunk_size, genome_len)
+            strand_out[:,left:right] = _scorechunk(strand_data, bank, forbidden, max(motif_lens), left, right).T
+        for k, motif_len in enumerate(motif_lens): # motif runs off the end of the genome
+            strand_out[k,genome_len-motif_len+1:] = 0
+    return out
+
+def _stackpwms(pwms, n_channels):
+    # stack PWMs into one (max_len * n_channels, n pwms) matrix, shorter motifs are zero-padded at the 3' end.
+    # -inf scores (zero frequency bases) are split off into a mask of forbidden bases, None if there are
+    # none, as 0 * -inf in the matrix product would make every window NaN
+    motif_lens = [pwm.shape[1] for pwm in pwms]
+    bank = np.zeros((max(motif_lens)*n_channels, len(pwms)), dtype=np.float32)
+    for k, pwm in enumerate(pwms):
+        bank[:pwm.shape[1]*n_channels, k] = np.asarray(pwm).T.reshape(-1)
+    forbidden = np.isneginf(bank)
+    if not np.any(forbidden):
+        return bank, None, motif_lens
+    bank[forbidden] = 0
+    return bank, forbidden.astype(np.float32), motif_lens
+
+def _scorechunk(strand_data, bank, forbidden, max_len, left, right):
+    # scores of positions left:right (5' -> 3' strand coordinates), shape (right - left, n pwms)
+    n_channels = strand_data.shape[1]
+    chunk = np.zeros((right - left + max_len - 1, n_channels), dtype=np.float32)
+    chunk_data = strand_data[left:right+max_len-1] # overlap by the motif length into the next chunk
+    chunk[:chunk_data.shape[0]] = chunk_data
+    windows = as_strided(chunk, shape=(right - left, max_len*n_channels),
+                         strides=(chunk.strides[0], chunk.strides[1]))
+    scores = np.dot(windows, bank)
+    if forbidden is not None: # windows using a forbidden base score -inf
+        scores[np.dot(windows, forbidden) > 0] = -np.inf
+    return scores
+
+@profiled()
+def getMotifHits(genome_representation, pwms, threshold=None, top_k=None, pvalue=None,
+                 background_freq_array=None, chunk_size=100000):
+    """ Streams PWM scores across the genome and keeps only hits above a threshold or the top k.
+
+        The genome is scored chunk by chunk as in getBankConvolution, so memory use is fixed by
+        chunk_size and the number of hits kept rather than by genome length. Hit positions follow
+        the getGenomeConvolution convention (5' end of the motif on its strand).
+
+        Parameters:
+        ----------
+        genome_representation : numpy array, shape (2, len genome, n channels)
+            Genome representation, e.g. from genometoonehot.
+
+        pwms : numpy array, shape (n channels, motif length), or list of such arrays
+            Position weight matrices (rows = <A,T,G,C>, columns = position).
+
+        threshold : None (default), float or array-like of float (one per PWM)
+            Minimum score (inclusive) for a hit.
+
+        top_k : None (default) or int
+            If given, only the top_k highest scoring hits of each PWM are kept (after threshold).
+
+        pvalue : None (default) or float
+            If given, the threshold of each PWM is set to the score with this probability of
+            being met or exceeded under the background model, see getScoreThreshold.
+
+        background_freq_array : None (default) or array-like, shape (n channels,)
+            Background base frequencies for pvalue thresholds. If None, bases are equiprobable.
+
+        chunk_size : int, 100000 (default)
+            Number of genome positions scored at a time.
+
+        Returns:
+        ----------
+        positions : numpy array, shape (n hits, 2)
+            Strand and position of each hit, sorted by strand and position (or by decreasing score
+            if top_k is given).
+
+        scores : numpy array, shape (n hits,)
+            Score of each hit.
+
+        If a list of PWMs is given, a list of (positions, scores) tuples is returned, one per PWM.
+        """
+    single_pwm = isinstance(pwms, np.ndarray) and pwms.ndim == 2
+    if single_pwm:
+        pwms = [pwms]
+    genome_len = genome_representation.shape[1]
+    bank, forbidden, motif_lens = _stackpwms(pwms, genome_representation.shape[2])
+    if pvalue is not None:
+        threshold = [getScoreThreshold(pwm, pvalue, background_freq_array) for pwm in pwms]
+    if threshold is None:
+        threshold = -np.inf
+    thresholds = np.zeros(len(pwms)) + threshold
+    hit_positions = [[] for pwm in pwms]
+    hit_scores = [[] for pwm in pwms]
+    for strand, strand_data in [(0, genome_representation[0]), (1, genome_representation[1][::-1])]:
+        for left in range(0, genome_len, chunk_size):
+            right = min(left + chunk_size, genome_len)
+            chunk_scores = _scorechunk(strand_data, bank, forbidden, max(motif_lens), left, right)
+            local_pos = np.arange(left, right)
+            for k, motif_len in enumerate(motif_lens):
+                hit_i = np.where((chunk_scores[:,k] >= thresholds[k]) & (local_pos <= genome_len - motif_len))[0]
+                if top_k is not None and hit_i.shape[0] > top_k: # only the top k of a chunk can enter the top k
+                    hit_i = hit_i[np.argpartition(-chunk_scores[hit_i,k], top_k-1)[:top_k]]
+                genome_pos = local_pos[hit_i] if strand == 0 else genome_len - 1 - local_pos[hit_i]
+                hit_positions[k].append(np.asarray([np.zeros(hit_i.shape[0], dtype=int)+strand, genome_pos]).T)
+                hit_scores[k].append(chunk_scores[hit_i,k])
+                if top_k is not None: # merge with the running top k, bounding memory
+                    hit_positions[k], hit_scores[k] = _topk(hit_positions[k], hit_scores[k], top_k)
+    hits = []
+    for positions, scores in zip(hit_positions, hit_scores):
+        positions, scores = np.concatenate(positions, 0).astype(int), np.concatenate(scores, 0)
+        if top_k is not None:
+            order = np.argsort(-scores, kind='mergesort')
+        else:
+            order = np.lexsort((positions[:,1], positions[:,0]))
+        hits.append((positions[order], scores[order]))
+    if single_pwm:
+        return hits[0]
+    return hits
+
+def _topk(positions_list, scores_list, top_k):
+    positions, scores = np.concatenate(positions_list, 0), np.concatenate(scores_list, 0)
+    if scores.shape[0] > top_k:
+        keep_i = np.argpartition(-scores, top_k-1)[:top_k]
+        positions, scores = positions[keep_i], scores[keep_i]
+    return [positions], [scores]
+
+@profiled()
+def getScoreThreshold(pwm, pvalue, background_freq_array=None, resolution=0.001):
+    """ Returns the lowest PWM score which is met or exceeded with probability <= pvalue.
+
+        The exact score distribution of random sequence under the background model is computed
+        by dynamic programming over PWM columns, with column scores rounded to resolution.
+
+        Parameters:
+        ----------
+        pwm : numpy array, shape (n channels, motif length)
+            Position weight matrix as returned by getPositionWeightMatrix. -inf scores (bases with
+            zero frequency) are allowed.
+
+        pvalue : float
+            Probability of a random sequence scoring at or above the returned threshold.
+
+        background_freq_array : None (default) or array-like, shape (n channels,)
+            Background base frequencies. If None, bases are equiprobable.
+
+        resolution : float, 0.001 (default)
+            Score discretization step.
+
+        Returns:
+        ----------
+        threshold : float
+            Score threshold, np.inf if no score is rare enough.
+        """
+    pwm = np.asarray(pwm, dtype=float)
+    if background_freq_array is None:
+        background = np.zeros(pwm.shape[0]) + 1. / pwm.shape[0]
+    else:
+        background = np.asarray(background_freq_array, dtype=float).reshape(-1)
+    if np.any(np.isnan(pwm) | (pwm == np.inf)):
+        raise ValueError('pwm scores must be finite or -inf.')
+    # -inf scores (zero frequency bases of getPositionWeightMatrix) can never reach a threshold, their
+    # probability is left out of the distribution rather than discretized
+    possible = np.isfinite(pwm)
+    if not np.all(np.any(possible, axis=0)):
+        return np.inf # a column with no possible base, no sequence has a finite score
+    int_scores = np.round(np.where(possible, pwm, 0) / resolution).astype(np.int64)
+    distribution, min_score = np.ones(1), 0 # probability of each integer score, starting at min_score
+    for column, column_possible in zip(int_scores.T, possible.T):
+        column, column_background = column[column_possible], background[column_possible]
+        column_distribution = np.zeros(column.max() - column.min() + 1)
+        np.add.at(column_distribution, column - column.min(), column_background)
+        distribution = np.convolve(distribution, column_distribution)
+        min_score += column.min()
+    tail = np.cumsum(distribution[::-1])[::-1] # probability of scoring >= each score
+    passing = np.where(tail <= pvalue)[0]
+    if passing.shape[0] == 0:
+        return np.inf
+    return (passing[0] + min_score) * resolution
+
+@profiled()
 def getPositionWeightMatrix(freq_array, background_freq_array):
     """Generates a position weight matrix scoring table (rows = <A,T,G,C>, columns = position) using
        a given base frequency array and a background base frequency array."""
@@ -0,0 +1,131 @@
+import numpy as np
+from instrument import profiled
+
+_STATS = ('sum', 'count', 'min', 'max')
+
+def _binreduce(stats, ratio):
+    # combine every ratio neighbouring bins of a level (padded at the genome end) into one bin
+    n_bins = -(-stats['sum'].shape[1] // ratio)
+    pad = n_bins*ratio - stats['sum'].shape[1]
+    combined = {}
+    for stat, fill_value, reduce_function in [('sum', 0, np.add), ('count', 0, np.add),
+                                              ('min', np.nan, np.fmin), ('max', np.nan, np.fmax)]:
+        padded = np.concatenate([stats[stat], np.full((2, pad), fill_value, dtype=stats[stat].dtype)], 1)
+        combined[stat] = reduce_function.reduce(padded.reshape(2, n_bins, ratio), axis=2) # fmin / fmax skip NaN
+    return combined
+
+class SummaryPyramid():
+    """ Precomputed binned summaries of a genome-shaped (2, len genome) track at several resolutions.
+
+        Each level bins both strands into bins of factor nt (bin i covers [i*factor, (i+1)*factor)),
+        holding the NaN-ignoring sum, number of non-NaN positions, min and max of each bin; the
+        mean is sum / count. Levels are built from each other, so building all levels costs about
+        one pass over the track. Queries over large windows (e.g. zoomed-out plots, see
+        plot.RegionPlot.plotLine) then read a few thousand bins instead of every nucleotide.
+
+        Parameters:
+        ----------
+        levels : dict
+            {factor (int) : {'sum', 'count', 'min', 'max' : numpy array, shape (2, n bins)}}
+
+        genome_len : int
+            Length of the summarized track.
+
+    """
+    @classmethod
+    def fromarray(cls, input_array, factors=(10, 100, 1000, 10000), block_len=10000000):
+        """ Build a pyramid from a genome-shaped array (or memory-mapped / ChunkedArray track),
+            reading block_len nt at a time for the finest level. """
+        factors = sorted(factors)
+        genome_len = input_array.shape[1]
+        block_len = max(factors[0], block_len // factors[0] * factors[0]) # blocks hold whole bins
+        blocks = []
+        for left in range(0, genome_len, block_len):
+            values = np.asarray(input_array[:, left:left+block_len], dtype=np.float64)
+            is_nan = np.isnan(values)
+            blocks.append(_binreduce({'sum' : np.where(is_nan, 0, values), 'count' : (~is_nan).astype(np.int64),
+                                      'min' : values, 'max' : values}, factors[0]))
+        levels = {factors[0] : dict((stat, np.concatenate([b[stat] for b in blocks], 1)) for stat in _STATS)}
+        for previous, factor in zip(factors[:-1], factors[1:]):
+            if factor % previous == 0:
+                levels[factor] = _binreduce(levels[previous], factor // previous)
+            else: # not a multiple of the previous level, built from the track
+                levels[factor] = cls.fromarray(input_array, factors=(factor,), block_len=block_len).levels[factor]
+        return cls(levels, genome_len)
+
+    @property
+    def factors(self):
+        return sorted(self.levels)
+
+    def level(self, stat, factor):
+        """ Binned statistic ('sum', 'count', 'min', 'max' or 'mean') of a level, shape (2, n bins). """
+        level = self.levels[factor]
+        if stat == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return level['sum'] / level['count']
+        return level[stat]
+
+    def factorfor(self, width, min_bins):
+        """ Coarsest factor giving at least min_bins bins across width nt, None if even the finest
+            level has fewer (use the full resolution track instead). """
+        usable = [f for f in self.factors if width / float(f) >= min_bins]
+        return max(usable) if len(usable) > 0 else None
+
+    @profiled()
+    def query(self, strand, left, right, stat='mean', factor=None, min_bins=None):
+        """ Binned summary of [strand, left, right] (inclusive) at one level.
+
+            Parameters:
+            ----------
+            strand, left, right : int
+                Window to summarize; every bin overlapping it is returned.
+
+            stat : 'mean' (default), 'sum', 'count', 'min' or 'max'
+
+            factor : None (default) or int
+                Level to read. If None, chosen with factorfor(right - left + 1, min_bins), or the
+                coarsest level if min_bins is also None.
+
+            min_bins : None (default) or int
+                Minimum number of bins across the window, e.g. the pixel width of a plot.
+
+            Returns:
+            ----------
+            bin_starts : numpy array of int
+                Genome position of the first nt of each bin.
+
+            values : numpy array
+                Binned statistic of each bin.
+
+            factor : int
+                Level used.
+        """
+        if factor is None:
+            factor = self.factors[-1] if min_bins is None else self.factorfor(right - left + 1, min_bins)
+            if factor is None:
+                raise ValueError('window is too small for any level to give %i bins.' % min_bins)
+        first, last = max(0, left) // factor, min(self.genome_len - 1, right) // factor
+        values = self.level(stat, factor)[strand, first:last+1]
+        return np.arange(first, last + 1) * factor, values, factor
+
+    def __init__(self, levels, genome_len):
+        self.levels = levels
+        self.genome_len = int(genome_len)
+
+@profiled()
+def savepyramid(path, pyramid):
+    """ Save a SummaryPyramid to a .npz file, conventionally next to its track (e.g. sample.npy and
+        sample.pyramid.npz). """
+    arrays = {'genome_len' : pyramid.genome_len, 'factors' : np.asarray(pyramid.factors)}
+    for factor in pyramid.factors:
+        for stat in _STATS:
+            arrays['%s_%i' % (stat, factor)] = pyramid.levels[factor][stat]
+    np.savez(path, **arrays)
+
+@profiled()
+def loadpyramid(path):
+    """ Load a SummaryPyramid saved with savepyramid. """
+    archive = np.load(path)
+    levels = dict((int(factor), dict((stat, archive['%s_%i' % (stat, factor)]) for stat in _STATS))
+                  for factor in archive['factors'])
+    return SummaryPyramid(levels, int(archive['genome_len']))
@@ -0,0 +1,217 @@
+import os
+import numpy as np
+from instrument import profiled
+
+class RaggedArray():
+    """ Variable-length segments stored as one contiguous values buffer plus an offsets array.
+
+        Segment i occupies values[offsets[i]:offsets[i+1]]. Segments are stored in genome (left ->
+        right) orientation; if strands are provided and wrt is '5_to_3', segments on the second
+        strand are viewed right -> left so that indexing returns 5' -> 3' slices without copying.
+
+        Parameters:
+        ----------
+        values : numpy array, shape (total length, ...)
+            Contiguous buffer holding all segments back to back.
+
+        offsets : array-like of int, shape (n segments + 1,)
+            Start of each segment in values, followed by the total length of values.
+
+        strands : None (default) or array-like of int, shape (n segments,)
+            Strand (0 or 1) of each segment. Required for strand-aware views.
+
+        wrt : 'genome' (default) or '5_to_3'
+            Orientation in which segments are viewed. genome orientation is always left -> right,
+            regardless of strand. 5_to_3 reverses the view of second strand segments.
+
+    """
+    @classmethod
+    def fromlist(cls, arrays):
+        """ Pack a list of arrays (or scalars such as np.nan) into a RaggedArray, preserving order. """
+        arrays = [np.atleast_1d(np.asarray(a)) for a in arrays]
+        lengths = np.asarray([a.shape[0] for a in arrays], dtype=np.int64)
+        offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+        nonempty = [a for a in arrays if a.shape[0] > 0]
+        if len(nonempty) == 0:
+            values = np.empty(0)
+        else:
+            values = np.concatenate(nonempty, axis=0)
+        return cls(values, offsets)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def flipped(self):
+        """ Boolean array, True for segments which are viewed in reverse (right -> left). """
+        if (self.strands is None) or (self.wrt == 'genome'):
+            return np.zeros(len(self), dtype=bool)
+        return self.strands == 1
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, i):
+        # returns a view of a single segment, reversed if on the second strand and 5' -> 3'
+        if i < 0:
+            i += len(self)
+        segment = self.values[self.offsets[i]:self.offsets[i+1]]
+        if self.flipped[i]:
+            return segment[::-1]
+        return segment
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def tolist(self):
+        """ Return a list of per-segment views (the output form of regionslice). """
+        return list(self)
+
+    def take(self, indices):
+        """ Return a new RaggedArray holding the segments at indices, in the given order. """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts, lengths = self.offsets[:-1][indices], self.lengths[indices]
+        offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+        gather_i = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        strands = None if self.strands is None else self.strands[indices]
+        return RaggedArray(self.values[gather_i], offsets, strands=strands, wrt=self.wrt)
+
+    def reduce(self, ufunc, empty_value=np.nan):
+        """ Vectorized per-segment reduction with a numpy ufunc (e.g. np.add, np.maximum).
+
+            Empty segments are assigned empty_value. Reductions run on the stored buffer and so
+            should be insensitive to segment orientation.
+        """
+        lengths = self.lengths
+        nonempty = lengths > 0
+        out_shape = (len(self),) + self.values.shape[1:]
+        if not np.any(nonempty):
+            return np.full(out_shape, empty_value, dtype=float)
+        reduced = ufunc.reduceat(self.values, self.offsets[:-1][nonempty], axis=0)
+        if np.all(nonempty):
+            return reduced
+        out = np.full(out_shape, empty_value, dtype=np.result_type(reduced, float))
+        out[nonempty] = reduced
+        return out
+
+    def sum(self):
+        return self.reduce(np.add, empty_value=0)
+
+    def mean(self):
+        lengths = self.lengths.reshape((-1,) + (1,) * (self.values.ndim - 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.reduce(np.add).astype(float) / lengths
+
+    def min(self):
+        return self.reduce(np.minimum)
+
+    def max(self):
+        return self.reduce(np.maximum)
+
+    def todense(self, width, fill_value=0, align='5_prime'):
+        """ Pad / truncate all segments to a single width and return them as a dense array.
+
+            Parameters:
+            ----------
+            width : int
+                Length of the output second axis. Longer segments are truncated, shorter ones are
+                padded with fill_value.
+
+            fill_value : scalar, 0 (default)
+                Value used for padding. Integer buffers are promoted to float if the fill value
+                cannot be represented (e.g. np.nan).
+
+            align : '5_prime' (default) or '3_prime'
+                End of the (viewed) segment which is kept in place. '5_prime' keeps the first
+                element at index 0 and pads / truncates at the end; '3_prime' does the reverse.
+
+            Returns:
+            ----------
+            out : numpy array, shape (n segments, width, ...)
+        """
+        lengths = self.lengths.reshape(-1, 1)
+        j = np.arange(width).reshape(1, -1)
+        if align == '5_prime':
+            view_i = np.broadcast_to(j, (len(self), width))
+        elif align == '3_prime':
+            view_i = j - (width - lengths)
+        else:
+            raise ValueError("align must be '5_prime' or '3_prime'.")
+        valid = (view_i >= 0) & (view_i < lengths)
+        starts, ends = self.offsets[:-1].reshape(-1, 1), self.offsets[1:].reshape(-1, 1)
+        source_i = np.where(self.flipped.reshape(-1, 1), ends - 1 - view_i, starts + view_i)
+        if np.can_cast(np.min_scalar_type(fill_value), self.values.dtype):
+            dtype = self.values.dtype
+        else:
+            dtype = np.float64
+        out = np.full((len(self), width) + self.values.shape[1:], fill_value, dtype=dtype)
+        if self.values.shape[0] > 0:
+            out[valid] = self.values[source_i[valid]]
+        return out
+
+    def __init__(self, values, offsets, strands=None, wrt='genome'):
+        if wrt not in ('genome', '5_to_3'):
+            raise ValueError("Unhandled wrt {'genome' or '5_to_3'} value.")
+        self.values = values
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.strands = None if strands is None else np.asarray(strands, dtype=np.int8)
+        self.wrt = wrt
+        if self.offsets[-1] != self.values.shape[0]:
+            raise ValueError('final offset must equal the length of values.')
+
+@profiled()
+def saveragged(path, ragged_array):
+    """ Save a RaggedArray to a single .npz file or to a directory of .npy files.
+
+        If path ends with .npz, all buffers are stored in one (uncompressed) archive. Otherwise
+        path is used as a directory holding values.npy, offsets.npy, strands.npy and wrt.npy,
+        which can be loaded back as memory maps with loadragged.
+
+        Parameters:
+        ----------
+        path : path to .npz file or directory (string)
+
+        ragged_array : RaggedArray
+            Container to save.
+    """
+    arrays = {'values' : ragged_array.values,
+              'offsets' : ragged_array.offsets,
+              'wrt' : np.asarray(ragged_array.wrt)}
+    if ragged_array.strands is not None:
+        arrays['strands'] = ragged_array.strands
+    if path.endswith('.npz'):
+        np.savez(path, **arrays)
+    else:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+@profiled()
+def loadragged(path, mmap_mode=None):
+    """ Load a RaggedArray saved with saveragged.
+
+        Parameters:
+        ----------
+        path : path to .npz file or directory (string)
+
+        mmap_mode : None (default) or np.load mmap_mode ('r', 'r+', 'c')
+            Only used for directory stores; values are memory-mapped rather than read.
+
+        Returns:
+        ----------
+        out : RaggedArray
+    """
+    if path.endswith('.npz'):
+        archive = np.load(path)
+        arrays = dict((name, archive[name]) for name in archive.files)
+    else:
+        arrays = {}
+        for name in ['values', 'offsets', 'strands', 'wrt']:
+            array_path = os.path.join(path, name + '.npy')
+            if os.path.exists(array_path):
+                arrays[name] = np.load(array_path, mmap_mode=mmap_mode if name == 'values' else None)
+    return RaggedArray(arrays['values'], arrays['offsets'],
+                       strands=arrays.get('strands'), wrt=str(arrays['wrt']))
@@ -0,0 +1,217 @@
+import os
+import numpy as np
+import genomearray as ga
+from instrument import profiled
+
+class GenomeArray():
+    """ All replicons (chromosomes, plasmids) of a sample in one contiguous genome-shaped buffer.
+
+        Replicon i occupies values[:, offsets[i]:offsets[i+1]]. Regions are given per replicon as
+        [replicon, strand, left, right] (inclusive) and positions as [replicon, strand, position];
+        they are translated to global coordinates of the buffer so that region and signal
+        operations run once over all replicons instead of looping over a nested list of arrays.
+        Regions are never allowed to span a replicon boundary.
+
+        Parameters:
+        ----------
+        values : numpy array, shape (2, total length, ...)
+            Contiguous buffer holding all replicons back to back.
+
+        offsets : array-like of int, shape (n replicons + 1,)
+            Start of each replicon in values, followed by the total length.
+
+        names : None (default) or list of strings, length n replicons
+            Replicon names (e.g. bam reference names). Defaults to 'replicon0', 'replicon1', ...
+
+    """
+    @classmethod
+    def fromlist(cls, arrays, names=None):
+        """ Concatenate a list of genome-shaped arrays (one per replicon, as in loadarrays2d). """
+        lengths = [np.shape(a)[1] for a in arrays]
+        return cls(np.concatenate(arrays, axis=1), np.r_[0, np.cumsum(lengths)], names=names)
+
+    @classmethod
+    def fromlengths(cls, lengths, names=None, dtype=np.float64, fill_value=0):
+        """ Allocate a GenomeArray of fill_value for replicons of the given lengths. """
+        return cls(np.full((2, int(np.sum(lengths))), fill_value, dtype=dtype), np.r_[0, np.cumsum(lengths)],
+                   names=names)
+
+    @classmethod
+    def frombam(cls, path_to_bam, min_mapq=2, dtype=np.uint32):
+        """ Fragment density (see mapgen.mapfragdensity) of every reference of a bam file, mapped
+            directly into one buffer. """
+        import pysam # imported on use, only needed for bam files
+        bam = pysam.Samfile(path_to_bam, 'rb')
+        genome_array = cls.fromlengths(bam.lengths, names=list(bam.references), dtype=dtype)
+        bam.close()
+        for replicon_i in range(len(genome_array)):
+            ga.mapgen.mapfragdensity(path_to_bam, min_mapq=min_mapq, refseq_index=replicon_i,
+                                     out=genome_array.replicon(replicon_i))
+        return genome_array
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def repliconindex(self, replicon):
+        """ Index of a replicon given by index or name. """
+        if not isinstance(replicon, (int, np.integer)):
+            return self.names.index(replicon)
+        return int(replicon)
+
+    def replicon(self, replicon, input_array=None):
+        """ View (2, replicon length, ...) of one replicon, of values or of input_array. """
+        replicon_i = self.repliconindex(replicon)
+        input_array = self.values if input_array is None else input_array
+        return input_array[:, self.offsets[replicon_i]:self.offsets[replicon_i+1]]
+
+    def tolist(self, input_array=None):
+        """ List of per-replicon views, of values or of a global array of the same layout. """
+        return [self.replicon(i, input_array) for i in range(len(self))]
+
+    def toglobal(self, regions):
+        """ Translate [replicon, strand, left, right] regions (or [replicon, strand, position]
+            positions) to global [strand, left, right] (or [strand, position]) coordinates.
+
+            Raises ValueError if any coordinate falls outside of its replicon.
+        """
+        regions = np.asarray(regions, dtype=np.int64).reshape(-1, np.shape(regions)[-1])
+        replicon_i = regions[:,0]
+        if np.any((replicon_i < 0) | (replicon_i >= len(self))):
+            raise ValueError('replicon index out of range.')
+        coordinates = regions[:,2:]
+        if np.any((coordinates < 0) | (coordinates >= self.lengths[replicon_i].reshape(-1,1))):
+            raise ValueError('regions must lie within their replicon.')
+        out = regions[:,1:].copy()
+        out[:,1:] += self.offsets[replicon_i].reshape(-1,1)
+        return out
+
+    def tolocal(self, regions):
+        """ Translate global [strand, left, right] regions (or [strand, position] positions) to
+            [replicon, strand, left, right] (or [replicon, strand, position]).
+
+            Raises ValueError if a region spans a replicon boundary.
+        """
+        regions = np.asarray(regions, dtype=np.int64).reshape(-1, np.shape(regions)[-1])
+        coordinates = regions[:,1:]
+        if np.any((coordinates < 0) | (coordinates >= self.offsets[-1])):
+            raise ValueError('regions must lie within the genome array.')
+        replicon_i = np.searchsorted(self.offsets, coordinates[:,0], 'right') - 1
+        if np.any(np.searchsorted(self.offsets, coordinates[:,-1], 'right') - 1 != replicon_i):
+            raise ValueError('regions must not span replicon boundaries.')
+        return np.c_[replicon_i, regions[:,0], coordinates - self.offsets[replicon_i].reshape(-1,1)]
+
+    def _extendedregions(self, regions, addl_nt, wrt):
+        # global regions extended by addl_nt as in regionfunc, clipped to the edges of each replicon
+        regions = np.asarray(regions, dtype=np.int64)
+        self.toglobal(regions) # raises if a region lies outside of its replicon
+        if regions.shape[1] == 3: # [replicon, strand, position]
+            regions = np.c_[regions, regions[:,2]]
+        strand = regions[:,1]
+        flip = (strand == 1) & (wrt == '5_to_3') # left and right definitions are swapped
+        lengths = self.lengths[regions[:,0]]
+        left = np.maximum(0, regions[:,2] - np.where(flip, addl_nt[1], addl_nt[0]))
+        right = np.minimum(lengths - 1, regions[:,3] + np.where(flip, addl_nt[0], addl_nt[1]))
+        return self.toglobal(np.asarray([regions[:,0], strand, np.minimum(left, lengths - 1),
+                                         np.maximum(right, 0)]).T)
+
+    @profiled(items='regions', name='core.replicons.GenomeArray.regionfunc')
+    def regionfunc(self, input_function, regions, input_array=None, addl_nt=(0,0), wrt='5_to_3', ragged=False):
+        """ regionfunc across [replicon, strand, left, right] regions (or [replicon, strand,
+            position] positions) of values or of a global array of the same layout.
+
+            addl_nt extensions are clipped at the edges of each region's replicon, so slices never
+            include data of a neighbouring replicon. See genomearray.regionfunc for parameters.
+        """
+        input_array = self.values if input_array is None else input_array
+        global_regions = self._extendedregions(regions, addl_nt, wrt)
+        return ga.regionfunc(input_function, global_regions, input_array, wrt=wrt, ragged=ragged)
+
+    @profiled(items='regions', name='core.replicons.GenomeArray.regionslice')
+    def regionslice(self, regions, input_array=None, addl_nt=(0,0), wrt='5_to_3', ragged=False):
+        """ regionslice across per-replicon regions, see GenomeArray.regionfunc. """
+        input_array = self.values if input_array is None else input_array
+        global_regions = self._extendedregions(regions, addl_nt, wrt)
+        return ga.regionslice(global_regions, input_array, wrt=wrt, ragged=ragged)
+
+    def guardboundaries(self, input_array, halo, fill_value=np.nan):
+        """ Set positions within halo nt of an internal replicon boundary to fill_value.
+
+            Use on the output of windowed operations (e.g. ntmath.rollingslope or smoothing) run
+            over the whole buffer, whose values near a boundary mix data of two replicons. The
+            array is modified in place and returned, unless its dtype cannot hold fill_value, in
+            which case a float64 copy is modified.
+        """
+        if not np.can_cast(np.min_scalar_type(fill_value), input_array.dtype):
+            input_array = input_array.astype(np.float64)
+        for boundary in self.offsets[1:-1]:
+            input_array[:, max(0, boundary - halo):boundary + halo] = fill_value
+        return input_array
+
+    def __init__(self, values, offsets, names=None):
+        self.values = values
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if self.offsets[-1] != self.values.shape[1]:
+            raise ValueError('final offset must equal the length of values.')
+        if names is None:
+            names = ['replicon%i' % i for i in range(self.offsets.shape[0] - 1)]
+        if len(names) != self.offsets.shape[0] - 1:
+            raise ValueError('one name is required per replicon.')
+        self.names = list(names)
+
+@profiled()
+def savegenomearray(path, genome_array):
+    """ Save a GenomeArray to a single .npz file or to a directory of .npy files.
+
+        If path ends with .npz, all buffers are stored in one (uncompressed) archive. Otherwise
+        path is used as a directory holding values.npy, offsets.npy and names.npy, which can be
+        loaded back with values memory-mapped by loadgenomearray.
+
+        Parameters:
+        ----------
+        path : path to .npz file or directory (string)
+
+        genome_array : GenomeArray
+            Container to save.
+    """
+    arrays = {'values' : genome_array.values,
+              'offsets' : genome_array.offsets,
+              'names' : np.asarray(genome_array.names)}
+    if path.endswith('.npz'):
+        np.savez(path, **arrays)
+    else:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+@profiled()
+def loadgenomearray(path, mmap_mode=None):
+    """ Load a GenomeArray saved with savegenomearray.
+
+        Parameters:
+        ----------
+        path : path to .npz file or directory (string)
+
+        mmap_mode : None (default) or np.load mmap_mode ('r', 'r+', 'c')
+            Only used for directory stores; values are memory-mapped rather than read.
+
+        Returns:
+        ----------
+        out : GenomeArray
+    """
+    if path.endswith('.npz'):
+        archive = np.load(path)
+        arrays = dict((name, archive[name]) for name in archive.files)
+    else:
+        arrays = {}
+        for name in ['values', 'offsets', 'names']:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode if name == 'values' else None)
+    return GenomeArray(arrays['values'], arrays['offsets'], names=[str(n) for n in arrays['names']])
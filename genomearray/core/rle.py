@@ -0,0 +1,264 @@
+import numpy as np
+from instrument import profiled
+
+class RLETrack():
+    """ Run-length encoded genome-shaped (2, len genome) track.
+
+        Both strands are stored as one sequence of runs over flattened coordinates (strand *
+        genome_len + position); run i covers [ends[i-1], ends[i]) and holds values[i]. Runs never
+        cross the strand boundary. Memory use and the cost of region sums, arithmetic and region
+        extraction scale with the number of runs rather than genome length, which suits sparse
+        counts, boolean masks and mostly-NaN prediction maps. NaN runs are handled as runs of equal
+        values.
+
+        Parameters:
+        ----------
+        ends : array-like of int, shape (n runs,)
+            Exclusive flattened end of each run, increasing, with genome_len and 2 * genome_len
+            among them.
+
+        values : numpy array, shape (n runs,)
+            Value of each run.
+
+        genome_len : int
+            Length of the genome.
+
+    """
+    @classmethod
+    def fromdense(cls, input_array):
+        """ Encode a dense (2, genome_len) array. """
+        input_array = np.asarray(input_array)
+        genome_len = input_array.shape[1]
+        flat = input_array.reshape(-1)
+        same = flat[1:] == flat[:-1]
+        if flat.dtype.kind == 'f': # NaN == NaN for run purposes
+            same |= np.isnan(flat[1:]) & np.isnan(flat[:-1])
+        same[genome_len-1] = False # runs never cross strands
+        ends = np.r_[np.nonzero(~same)[0] + 1, flat.shape[0]].astype(np.int64)
+        return cls(ends, flat[ends - 1], genome_len)
+
+    @classmethod
+    def fromregions(cls, regions, genome_len):
+        """ Boolean track which is True across regions (as regionstomask, without a dense mask). """
+        regions = np.asarray(regions, dtype=np.int64).reshape(-1,3)
+        # flattened half-open intervals, sorted and merged where they overlap or touch
+        starts = regions[:,0]*genome_len + regions[:,1]
+        stops = regions[:,0]*genome_len + regions[:,2] + 1
+        order = np.argsort(starts, kind='mergesort')
+        starts, stops = starts[order], stops[order]
+        if starts.shape[0] > 0:
+            stops = np.maximum.accumulate(stops)
+            new_interval = np.r_[True, starts[1:] > stops[:-1]]
+            starts, stops = starts[new_interval], stops[np.r_[new_interval[1:], True]]
+        # alternate False / True runs, then add strand breaks and drop empty runs
+        ends = np.r_[np.asarray([starts, stops]).T.reshape(-1), 2*genome_len]
+        values = np.r_[np.tile([False, True], len(starts)), False]
+        return cls._compacted(ends, values, genome_len)
+
+    @classmethod
+    def _compacted(cls, ends, values, genome_len):
+        # insert strand breaks, drop empty runs and merge neighbouring runs of equal value
+        ends = np.asarray(ends, dtype=np.int64)
+        break_run = np.searchsorted(ends, genome_len, 'left')
+        if break_run >= ends.shape[0] or ends[break_run] != genome_len:
+            ends = np.insert(ends, break_run, genome_len)
+            values = np.insert(values, break_run, values[min(break_run, values.shape[0]-1)])
+        keep = np.r_[True, ends[1:] > ends[:-1]] & (ends > 0)
+        ends, values = ends[keep], values[keep]
+        same = values[1:] == values[:-1]
+        if values.dtype.kind == 'f':
+            same |= np.isnan(values[1:]) & np.isnan(values[:-1])
+        same &= ends[:-1] != genome_len
+        last_of_run = np.r_[~same, True]
+        return cls(ends[last_of_run], values[last_of_run], genome_len)
+
+    @property
+    def shape(self):
+        return (2, self.genome_len)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def starts(self):
+        return np.r_[0, self.ends[:-1]]
+
+    @property
+    def nruns(self):
+        return self.ends.shape[0]
+
+    def todense(self):
+        """ Decode to a dense (2, genome_len) array. """
+        return np.repeat(self.values, np.diff(np.r_[0, self.ends])).reshape(2, self.genome_len)
+
+    def _cumulative(self, flat_positions, values):
+        # integral of values over flattened positions [0, x) for each x
+        run_lengths = np.diff(np.r_[0, self.ends])
+        cumulative = np.r_[0, np.cumsum(values * run_lengths)]
+        run_i = np.searchsorted(self.ends, flat_positions, 'right')
+        run_i_clipped = np.minimum(run_i, self.nruns - 1)
+        partial = np.where(run_i < self.nruns, values[run_i_clipped] * (flat_positions - self.starts[run_i_clipped]), 0)
+        return cumulative[run_i] + partial
+
+    def _regionintegrals(self, regions, values):
+        regions = np.asarray(regions, dtype=np.int64).reshape(-1, np.shape(regions)[-1])
+        if regions.shape[1] == 2:
+            regions = np.c_[regions, regions[:,1]]
+        left = np.maximum(0, regions[:,1])
+        right = np.minimum(self.genome_len - 1, regions[:,2])
+        right = np.maximum(right, left - 1) # empty regions integrate to 0
+        offset = regions[:,0]*self.genome_len
+        return (self._cumulative(offset + right + 1, values) - self._cumulative(offset + left, values)), right - left + 1
+
+    def _floatintegrals(self, regions):
+        # sums of finite values, lengths and numbers of NaN, +inf and -inf positions of each region;
+        # NaN and infinite runs are kept out of the cumulative sum (where a single infinite run would
+        # make every later region infinite or NaN) and counted instead
+        values = self.values.astype(np.float64)
+        finite_runs = np.isfinite(values)
+        sums, lengths = self._regionintegrals(regions, np.where(finite_runs, values, 0))
+        counts = []
+        for runs in [np.isnan(values), values == np.inf, values == -np.inf]:
+            counts.append(self._regionintegrals(regions, runs.astype(np.float64))[0] if np.any(runs)
+                          else np.zeros(lengths.shape[0]))
+        return sums, lengths, counts
+
+    @staticmethod
+    def _setinfinite(out, n_posinf, n_neginf):
+        # regions overlapping infinite runs are +inf or -inf, or NaN if they overlap both (inf - inf)
+        out[n_posinf > 0] = np.inf
+        out[n_neginf > 0] = -np.inf
+        out[(n_posinf > 0) & (n_neginf > 0)] = np.nan
+        return out
+
+    @profiled(items='regions')
+    def regionsum(self, regions, skipna=False):
+        """ Sum of values across [strand, left, right] (inclusive) regions, one per region.
+
+            Regions are clipped to the genome. If skipna is False, regions overlapping a NaN run sum
+            to NaN (as np.sum), otherwise NaNs are ignored (as np.nansum). Regions overlapping
+            infinite runs sum to +inf or -inf (NaN if both), other regions are unaffected by them.
+        """
+        if self.values.dtype.kind in 'biu': # exact integer sums
+            return self._regionintegrals(regions, self.values.astype(np.int64))[0]
+        sums, lengths, (n_nan, n_posinf, n_neginf) = self._floatintegrals(regions)
+        sums = self._setinfinite(sums, n_posinf, n_neginf)
+        if not skipna:
+            sums[n_nan > 0] = np.nan
+        return sums
+
+    @profiled(items='regions')
+    def regionmean(self, regions, skipna=False):
+        """ Mean of values across regions, see regionsum. With skipna, the mean of non-NaN values. """
+        sums, lengths, (n_nan, n_posinf, n_neginf) = self._floatintegrals(regions)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if skipna:
+                means = sums / (lengths - n_nan)
+            else:
+                means = sums / lengths.astype(np.float64)
+        means = self._setinfinite(means, n_posinf, n_neginf)
+        if not skipna:
+            means[n_nan > 0] = np.nan
+        return means
+
+    def toregions(self, value=None):
+        """ Regions [strand, left, right] (inclusive) of contiguous runs which are True (nonzero,
+            not NaN), or equal to value if given; the output of masktoregions on the dense track. """
+        if value is None:
+            selected = (self.values != 0) & ~np.isnan(self.values.astype(np.float64))
+        else:
+            selected = self.values == value
+        starts, ends = self.starts[selected], self.ends[selected]
+        if starts.shape[0] == 0:
+            return np.empty((0,3), dtype=int)
+        # neighbouring selected runs (possible with value=None) are merged, but not across strands
+        merge = np.r_[False, (starts[1:] == ends[:-1]) & (starts[1:] % self.genome_len != 0)]
+        first = ~merge
+        last = np.r_[first[1:], True]
+        strand = starts[first] // self.genome_len
+        return np.asarray([strand, starts[first] - strand*self.genome_len,
+                           ends[last] - 1 - strand*self.genome_len]).T.astype(int)
+
+    def _binary(self, other, ufunc):
+        # elementwise ufunc(self, other) over the union of both run boundaries
+        if isinstance(other, RLETrack):
+            if other.genome_len != self.genome_len:
+                raise ValueError('RLETracks must have the same genome length.')
+            ends = np.union1d(self.ends, other.ends)
+            other_values = other.values[np.searchsorted(other.ends, ends - 1, 'right')]
+        else:
+            ends = self.ends
+            other_values = other
+        self_values = self.values[np.searchsorted(self.ends, ends - 1, 'right')]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return RLETrack._compacted(ends, ufunc(self_values, other_values), self.genome_len)
+
+    def apply(self, ufunc):
+        """ Elementwise unary function (e.g. np.log2, np.isnan), evaluated once per run. """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return RLETrack._compacted(self.ends, ufunc(self.values), self.genome_len)
+
+    def __add__(self, other):
+        return self._binary(other, np.add)
+
+    def __radd__(self, other):
+        return self._binary(other, np.add)
+
+    def __sub__(self, other):
+        return self._binary(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self._binary(other, lambda a, b: np.subtract(b, a))
+
+    def __mul__(self, other):
+        return self._binary(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self._binary(other, np.multiply)
+
+    def __truediv__(self, other):
+        return self._binary(other, np.true_divide)
+
+    __div__ = __truediv__
+
+    def __neg__(self):
+        return self.apply(np.negative)
+
+    def __gt__(self, other):
+        return self._binary(other, np.greater)
+
+    def __ge__(self, other):
+        return self._binary(other, np.greater_equal)
+
+    def __lt__(self, other):
+        return self._binary(other, np.less)
+
+    def __le__(self, other):
+        return self._binary(other, np.less_equal)
+
+    def __and__(self, other):
+        return self._binary(other, np.logical_and)
+
+    def __or__(self, other):
+        return self._binary(other, np.logical_or)
+
+    def __init__(self, ends, values, genome_len):
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.values = np.asarray(values)
+        self.genome_len = int(genome_len)
+        if self.ends.shape != self.values.shape:
+            raise ValueError('ends and values must have the same shape.')
+        if self.ends.shape[0] == 0 or self.ends[-1] != 2*self.genome_len:
+            raise ValueError('final run must end at 2 * genome_len.')
+
+@profiled()
+def saverle(path, rle_track):
+    """ Save an RLETrack to a .npz file. """
+    np.savez(path, ends=rle_track.ends, values=rle_track.values, genome_len=rle_track.genome_len)
+
+@profiled()
+def loadrle(path):
+    """ Load an RLETrack saved with saverle. """
+    archive = np.load(path)
+    return RLETrack(archive['ends'], archive['values'], int(archive['genome_len']))
@@ -1,9 +1,77 @@
-import pysam
+import io
 import numpy as np
 import genomearray as ga
-from scipy.stats import gmean
+from multiprocessing.pool import ThreadPool
+from instrument import profiled
+from chunked import ChunkedArray, ischunked
+from collections import OrderedDict
+from budget import withinbudget, requirebudget
 
-def loadarrays(array_paths, normalization=None, **kwargs):
+def _gmean(values, axis=0):
+    # geometric mean (as scipy.stats.gmean), kept local so importing genomearray does not load scipy.stats
+    return np.exp(np.mean(np.log(values), axis=axis))
+
+def _loadarray(path):
+    # .npy file or chunked store (see savechunked)
+    if ischunked(path):
+        with ChunkedArray(path) as chunked_array:
+            return chunked_array.read()
+    return np.load(path)
+
+def _arrayinfo(path):
+    # (shape, dtype, byte offset of the data or None) without reading the data
+    if ischunked(path):
+        chunked_array = ChunkedArray(path)
+        return chunked_array.shape, chunked_array.dtype, None
+    try:
+        header = np.load(path, mmap_mode='r')
+    except ValueError: # e.g. object arrays, which cannot be memory-mapped
+        header = np.load(path)
+        return header.shape, header.dtype, None
+    return header.shape, header.dtype, header.offset if header.flags.c_contiguous else None
+
+def _readinto(path, out, offset):
+    # read an array file into the preallocated (C-contiguous) out; file reads release the GIL
+    if offset is None:
+        out[...] = _loadarray(path)
+        return
+    with io.open(path, 'rb') as f:
+        f.seek(offset)
+        if f.readinto(out) != out.nbytes:
+            raise IOError('%s is shorter than its header describes.' % path)
+
+def _threadmap(function, items, workers):
+    # map function over items on a pool of threads (serially if workers <= 1)
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def _dividesamples(sample_arrays, size_factors, add_one, log2):
+    # log2((sample + add_one) / size factor) (without log2 if log2 is False) of every sample. Within the
+    # memory budget as a single expression; otherwise one float64 output is filled sample by sample
+    # in place, avoiding the full-size temporaries of the expression
+    output_bytes = 8*np.size(sample_arrays)
+    if withinbudget(3*output_bytes):
+        normalized = ((sample_arrays + 1) if add_one else sample_arrays) / size_factors.reshape(-1,1,1)
+        return np.log2(normalized) if log2 else normalized
+    requirebudget(output_bytes, 'normalized sample array')
+    normalized = np.empty(np.shape(sample_arrays), dtype=np.float64)
+    for i, factor in enumerate(size_factors):
+        normalized[i] = sample_arrays[i]
+        if add_one:
+            normalized[i] += 1
+        normalized[i] /= factor
+        if log2:
+            np.log2(normalized[i], out=normalized[i])
+    return normalized
+
+@profiled(items='array_paths')
+def loadarrays(array_paths, normalization=None, workers=4, **kwargs):
     """ Load arrays (.npy files) and conduct normalization across the datasets.
 
         Arrays are loaded with np.load, normalization functions can be provided using the
@@ -12,11 +80,16 @@ def loadarrays(array_paths, normalization=None, **kwargs):
         Parameters:
         ----------
         array_paths : list of file paths to arrays to load
-            Loads each of the array paths in turn using np.load.
+            Loads each of the array paths in turn using np.load, or as a whole ChunkedArray if the
+            path is a chunked store written by savechunked.
 
         normalization : None (default) or a function to normalize arrays on loading
             Function for normalizing a list of arrays. 
 
+        workers : int, 4 (default)
+            Threads reading files concurrently. If all arrays have the same shape and dtype, each
+            file is read straight into its slice of a preallocated (n arrays, ...) output.
+
         **kwargs : additional kwargs
             Passed to normalization function (if present) as kwargs.
 
@@ -25,7 +98,12 @@ def loadarrays(array_paths, normalization=None, **kwargs):
         out : array of normalized datasets
             
     """
-    loaded_arrays = np.asarray([np.load(path) for path in array_paths])
+    infos = _threadmap(_arrayinfo, list(array_paths), workers)
+    if len(infos) > 0 and all(info[:2] == infos[0][:2] for info in infos):
+        loaded_arrays = np.empty((len(infos),) + tuple(infos[0][0]), dtype=infos[0][1])
+        _threadmap(lambda i: _readinto(array_paths[i], loaded_arrays[i], infos[i][2]), range(len(infos)), workers)
+    else: # arrays of different shapes are loaded as before
+        loaded_arrays = np.asarray(_threadmap(_loadarray, list(array_paths), workers))
     if normalization is None:
         return loaded_arrays
     else:
@@ -35,59 +113,60 @@ def _mediansizefactors(samples, gene_regions):
     # axis 0 = samples; axis 1 = gene_sums
     sample_sums = np.asarray([ga.regionfunc(np.sum, gene_regions, s) for s in samples])+1
     # generate a reference sample to normalize to
-    reference_sample = gmean(np.asarray(sample_sums), axis=0)
+    reference_sample = _gmean(np.asarray(sample_sums), axis=0)
     # divide sample genes by reference samples
     gene_ratios = sample_sums / reference_sample.reshape(1,-1)
     size_factors = np.nanmedian(gene_ratios, axis=1)
     return size_factors
 
+@profiled(items='sample_arrays')
 def countnormalization(sample_arrays, paths_to_bams = None, log2 = None):
+    import pysam # imported on use, only needed for bam files
     # calculate size factors from raw reads mapped to bam files
     counts = []
     for path in paths_to_bams:
         counts.append(pysam.Samfile(path, 'rb').mapped)
     counts = np.asarray(counts)
-    size_factors = counts / gmean(counts)
+    size_factors = counts / _gmean(counts)
     # now normalize the arrays
-    normalized_sample_arrays = (sample_arrays + 1) / size_factors.reshape(-1,1,1)
-    if log2:
-        return np.log2(normalized_sample_arrays)
-    elif log2 == False:
-        return normalized_sample_arrays
-    raise ValueError('log2 must be set to True or False.')
+    if log2 is None:
+        raise ValueError('log2 must be set to True or False.')
+    return _dividesamples(sample_arrays, size_factors, True, log2)
 
+@profiled(items='sample_arrays')
 def regionsumnormalization(sample_arrays, regions = None, log2 = None):
     sample_sums = []
     for counts in sample_arrays:
         sample_sums.append(np.sum(ga.regionfunc(np.sum, regions, counts)))
-    size_factors = np.asarray(sample_sums) / gmean(sample_sums,axis=0)
-    if log2:
-        return (sample_arrays + 1) / size_factors.reshape(-1,1,1)
-    elif log2 == False:
-        return sample_arrays / size_factors.reshape(-1,1,1)
-    raise ValueError('log2 must be set to True or False')
+    size_factors = np.asarray(sample_sums) / _gmean(sample_sums,axis=0)
+    if log2 is None:
+        raise ValueError('log2 must be set to True or False')
+    return _dividesamples(sample_arrays, size_factors, bool(log2), False)
 
+@profiled(items='sample_arrays')
 def mediandensitynormalization(sample_arrays, regions = None, log2 = None):
     size_factors = _mediansizefactors(sample_arrays, regions)
-    normalized_sample_arrays = (sample_arrays + 1) / size_factors.reshape(-1,1,1)
-    if log2:
-        return np.log2(normalized_sample_arrays)
-    elif log2 == False:
-        return normalized_sample_arrays
-    raise ValueError('log2 must be set to True or False.')
-
-def loadarrays2d(array_paths, normalization=None, **kwargs):
-    all_loaded_arrays = []
-    for sample_arrays in array_paths:
-        sample_loaded_arrays = []
-        for single_array in sample_arrays:
-            sample_loaded_arrays.append(np.load(single_array))
-        all_loaded_arrays.append(sample_loaded_arrays)
+    if log2 is None:
+        raise ValueError('log2 must be set to True or False.')
+    return _dividesamples(sample_arrays, size_factors, True, log2)
+
+@profiled(items='array_paths')
+def loadarrays2d(array_paths, normalization=None, workers=4, **kwargs):
+    # all (sample, replicon) files are read concurrently, each into its own preallocated array
+    file_indexes = [(i, j) for i, sample_arrays in enumerate(array_paths) for j in range(len(sample_arrays))]
+    infos = _threadmap(lambda ij: _arrayinfo(array_paths[ij[0]][ij[1]]), file_indexes, workers)
+    all_loaded_arrays = [[] for _ in array_paths]
+    for (i, j), info in zip(file_indexes, infos):
+        all_loaded_arrays[i].append(np.empty(info[0], dtype=info[1]))
+    _threadmap(lambda k: _readinto(array_paths[file_indexes[k][0]][file_indexes[k][1]],
+                                   all_loaded_arrays[file_indexes[k][0]][file_indexes[k][1]], infos[k][2]),
+               range(len(file_indexes)), workers)
     if normalization is None:
         return all_loaded_arrays
     else:
         return normalization(all_loaded_arrays, **kwargs)
     
+@profiled(items='sample_arrays2d')
 def regionsumnormalization2d(sample_arrays2d, multi_regions = None, log2 = None):
     sample_sums = []
     for sample_arrays in sample_arrays2d:
@@ -95,11 +174,119 @@ def regionsumnormalization2d(sample_arrays2d, multi_regions = None, log2 = None)
         for sample_counts, regions in zip(sample_arrays, multi_regions):
             genome_sums.append(np.sum(np.asarray(ga.regionfunc(np.sum, regions, sample_counts))))
         sample_sums.append(np.sum(genome_sums))
-    size_factors = np.asarray(sample_sums) / gmean(sample_sums,axis=0)
+    size_factors = np.asarray(sample_sums) / _gmean(sample_sums,axis=0)
     if log2:
         return [[np.log2((sample_counts+1)/factor) for sample_counts in sample]
                  for sample, factor in zip(sample_arrays2d,size_factors)]
     elif log2 == False:
         return [[(sample_counts)/factor for sample_counts in sample]
                  for sample, factor in zip(sample_arrays2d,size_factors)]
-    raise ValueError('log2 must be set to True or False')
\ No newline at end of file
+    raise ValueError('log2 must be set to True or False')
+
+class CohortSizeFactors():
+    """ Cached per-sample statistics of a cohort, from which size factors are updated as samples
+        are added, replaced (e.g. after addfragdensity) or removed.
+
+        countnormalization, regionsumnormalization and mediandensitynormalization recompute the
+        statistics of every sample on each call. Here each sample's statistic (mapped reads, summed
+        region counts or per-region counts + 1) is computed once when the sample is added, and the
+        geometric mean across samples is kept as a running sum of logs; adding one sample therefore
+        costs one sample's mapping statistics, independent of cohort size. Size factors match those
+        of the corresponding normalization function run over the same samples.
+
+        Parameters:
+        ----------
+        method : 'median' (default), 'regionsum' or 'count'
+            'median' as mediandensitynormalization, 'regionsum' as regionsumnormalization and
+            'count' (mapped reads of the bam files) as countnormalization.
+
+        regions : None (default) or numpy array, shape (n regions, 3)
+            [strand, left, right] regions summed per sample, required for 'median' and 'regionsum'.
+
+    """
+    def _statistic(self, sample_array=None, paths_to_bams=None):
+        if self.method == 'count':
+            import pysam # imported on use, only needed for bam files
+            return np.float64(np.sum([pysam.Samfile(path, 'rb').mapped for path in paths_to_bams]))
+        region_sums = np.asarray(ga.regionfunc(np.sum, self.regions, sample_array), dtype=np.float64)
+        if self.method == 'median':
+            return region_sums + 1
+        return np.sum(region_sums)
+
+    def addsample(self, name, sample_array=None, paths_to_bams=None):
+        """ Add (or replace, if name is already present) one sample.
+
+            Parameters:
+            ----------
+            name : string
+                Sample name.
+
+            sample_array : numpy array, shape (2, len genome)
+                Fragment density of the sample, required for 'median' and 'regionsum'.
+
+            paths_to_bams : list of paths to bam files
+                All bam files of the sample (e.g. original and top-up runs), required for 'count'.
+        """
+        statistic = self._statistic(sample_array, paths_to_bams)
+        if name in self.statistics:
+            self.removesample(name)
+        self.statistics[name] = statistic
+        self._log_sum = self._log_sum + np.log(statistic)
+
+    def removesample(self, name):
+        """ Remove one sample from the cohort. """
+        self._log_sum = self._log_sum - np.log(self.statistics.pop(name))
+
+    @property
+    def names(self):
+        return list(self.statistics.keys())
+
+    def sizefactors(self, names=None):
+        """ Size factors (numpy array) of the given samples, or of all samples in order added. """
+        names = self.names if names is None else names
+        reference = np.exp(self._log_sum / len(self.statistics))
+        if self.method == 'median':
+            return np.asarray([np.nanmedian(self.statistics[n] / reference) for n in names])
+        return np.asarray([self.statistics[n] / reference for n in names])
+
+    def normalize(self, sample_array, name, log2=None):
+        """ Normalize the array of one sample as the corresponding normalization function does. """
+        size_factor = self.sizefactors([name])[0]
+        if log2 is None:
+            raise ValueError('log2 must be set to True or False.')
+        if self.method == 'regionsum': # as regionsumnormalization
+            return (sample_array + 1) / size_factor if log2 else sample_array / size_factor
+        normalized_array = (sample_array + 1) / size_factor
+        return np.log2(normalized_array) if log2 else normalized_array
+
+    def __len__(self):
+        return len(self.statistics)
+
+    def __init__(self, method='median', regions=None):
+        if method not in ('median', 'regionsum', 'count'):
+            raise ValueError("method must be 'median', 'regionsum' or 'count'.")
+        if method != 'count' and regions is None:
+            raise ValueError("regions are required for method '%s'." % method)
+        self.method = method
+        self.regions = regions
+        self.statistics = OrderedDict()
+        self._log_sum = 0.
+
+@profiled()
+def savesizefactors(path, size_factors):
+    """ Save a CohortSizeFactors to a .npz file. """
+    names = size_factors.names
+    np.savez(path, method=size_factors.method, names=np.asarray(names),
+             regions=np.asarray([]) if size_factors.regions is None else size_factors.regions,
+             statistics=np.asarray([size_factors.statistics[n] for n in names]))
+
+@profiled()
+def loadsizefactors(path):
+    """ Load a CohortSizeFactors saved with savesizefactors. """
+    archive = np.load(path)
+    method = str(archive['method'])
+    size_factors = CohortSizeFactors(method, None if method == 'count' else archive['regions'])
+    for name, statistic in zip(archive['names'], archive['statistics']):
+        size_factors.statistics[str(name)] = statistic
+        size_factors._log_sum = size_factors._log_sum + np.log(statistic)
+    return size_factors
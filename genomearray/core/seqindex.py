@@ -0,0 +1,148 @@
+import itertools
+import numpy as np
+from instrument import profiled
+
+# nucleotide codes follow the one-hot channel order (A,T,G,C), so complement(code) == code ^ 1
+_NT_CODES = np.zeros(256, dtype=np.int8) - 1
+for _code, _nt in enumerate('ATGC'):
+    _NT_CODES[ord(_nt)] = _code
+    _NT_CODES[ord(_nt.lower())] = _code
+
+_IUPAC = {'A' : 'A', 'T' : 'T', 'G' : 'G', 'C' : 'C', 'U' : 'T',
+          'R' : 'AG', 'Y' : 'CT', 'S' : 'GC', 'W' : 'AT', 'K' : 'GT', 'M' : 'AC',
+          'B' : 'CGT', 'D' : 'AGT', 'H' : 'ACT', 'V' : 'ACG', 'N' : 'ATGC'}
+
+def encodesequence(sequence):
+    """ Converts a DNA string to an int8 array of nucleotide codes A,T,G,C -> 0,1,2,3 (other -> -1). """
+    return _NT_CODES[np.frombuffer(str(sequence).encode('ascii'), dtype=np.uint8)]
+
+def kmercodes(nt_codes, k):
+    """ Integer code (2 bits per nt, 5' nt most significant) of the k-mer starting at each position.
+
+        Positions where the k-mer would run off the end of the sequence or contains an unknown
+        nucleotide are assigned -1.
+    """
+    seq_len = nt_codes.shape[0]
+    codes = np.zeros(seq_len, dtype=np.int64)
+    valid = np.zeros(seq_len, dtype=bool)
+    n_kmers = max(0, seq_len - k + 1)
+    valid[:n_kmers] = True
+    for j in range(k): # shift in one nt per pass
+        shifted = nt_codes[j:j+n_kmers]
+        codes[:n_kmers] = (codes[:n_kmers] << 2) | np.maximum(shifted, 0)
+        valid[:n_kmers] &= shifted >= 0
+    codes[~valid] = -1
+    return codes
+
+class MotifIndex():
+    """ Hashed k-mer occurrence index of a genome for repeated motif searches.
+
+        Positions of every k-mer of the forward strand are stored grouped by k-mer code (and in
+        genomic order within each code), so occurrences of a motif in any window are found by
+        binary search rather than by scanning sequence. Second strand hits are found through the
+        reverse complement of the motif. Build once per genome, then save with savemotifindex and
+        query with findmotif.
+
+        Parameters:
+        ----------
+        genome : Bio SeqRecord (or any object with a .seq attribute) or DNA string
+            Genome to index.
+
+        k : int, 8 (default)
+            Length of indexed k-mers. Motifs shorter than k are searched by scanning the window.
+
+    """
+    def __init__(self, genome, k=8):
+        sequence = genome.seq if hasattr(genome, 'seq') else genome
+        self.k = k
+        self.nt_codes = encodesequence(sequence)
+        codes = kmercodes(self.nt_codes, k)
+        order = np.argsort(codes, kind='mergesort') # stable, positions stay sorted within each code
+        order = order[codes[order] >= 0]
+        self.sorted_codes = codes[order]
+        self.positions = order.astype(np.int64)
+
+@profiled()
+def savemotifindex(path, motif_index):
+    """ Save a MotifIndex to a .npz file. """
+    np.savez(path, k=motif_index.k, nt_codes=motif_index.nt_codes,
+             sorted_codes=motif_index.sorted_codes, positions=motif_index.positions)
+
+@profiled()
+def loadmotifindex(path):
+    """ Load a MotifIndex saved with savemotifindex. """
+    archive = np.load(path)
+    motif_index = MotifIndex('', k=int(archive['k'])) # empty index, filled from the archive
+    motif_index.nt_codes = archive['nt_codes']
+    motif_index.sorted_codes = archive['sorted_codes']
+    motif_index.positions = archive['positions']
+    return motif_index
+
+def _allowedcodes(motif):
+    try:
+        return [np.asarray([_NT_CODES[ord(nt)] for nt in _IUPAC[c]]) for c in motif.upper()]
+    except KeyError:
+        raise ValueError('Unexpected IUPAC character in motif %s.' % motif)
+
+def _findforward(motif_index, allowed, lo, hi, max_expansions=4096):
+    # starts i in [lo, hi] where the forward sequence matches allowed nucleotides at every motif position
+    motif_len, k = len(allowed), motif_index.k
+    n_expansions = np.prod([len(a) for a in allowed[:k]])
+    if motif_len >= k and n_expansions <= max_expansions:
+        # look up candidates by the motif's leading k-mer(s), then verify the remaining positions
+        candidates = []
+        for prefix in itertools.product(*allowed[:k]):
+            code = 0
+            for nt in prefix:
+                code = (code << 2) | int(nt)
+            a = np.searchsorted(motif_index.sorted_codes, code, 'left')
+            b = np.searchsorted(motif_index.sorted_codes, code, 'right')
+            code_positions = motif_index.positions[a:b]
+            candidates.append(code_positions[np.searchsorted(code_positions, lo, 'left'):
+                                             np.searchsorted(code_positions, hi, 'right')])
+        candidates = np.sort(np.concatenate(candidates))
+        first_unchecked = k
+    else:
+        candidates = np.arange(lo, hi+1)
+        first_unchecked = 0
+    for j in range(first_unchecked, motif_len):
+        candidates = candidates[np.in1d(motif_index.nt_codes[candidates+j], allowed[j])]
+    return candidates
+
+@profiled(items=lambda hits: hits.shape[0])
+def findmotif(motif_index, motif, left=None, right=None):
+    """ Finds all occurrences of a motif on both strands within a window of the genome.
+
+        Parameters:
+        ----------
+        motif_index : MotifIndex
+            Index of the genome to search.
+
+        motif : string
+            Motif in the 5' -> 3' direction, IUPAC degenerate nucleotide codes are accepted.
+
+        left : None (default) or int
+            Left genomic position of the window (inclusive). If None, start of the genome.
+
+        right : None (default) or int
+            Right genomic position of the window (inclusive). If None, end of the genome.
+
+        Returns:
+        ----------
+        positions : numpy array, shape (n hits, 2)
+            Strand and 5' position of each occurrence which lies entirely inside the window, sorted
+            by strand then position. Overlapping occurrences are all reported.
+    """
+    genome_len = motif_index.nt_codes.shape[0]
+    left = 0 if left is None else max(0, left)
+    right = genome_len - 1 if right is None else min(genome_len - 1, right)
+    allowed = _allowedcodes(motif)
+    # second strand occurrences are forward occurrences of the reverse complement
+    allowed_rc = [a ^ 1 for a in allowed[::-1]]
+    lo, hi = left, right - len(allowed) + 1
+    if hi < lo:
+        return np.empty((0,2), dtype=int)
+    fwd_starts = _findforward(motif_index, allowed, lo, hi)
+    rev_starts = _findforward(motif_index, allowed_rc, lo, hi)
+    return np.r_[np.asarray([np.zeros(fwd_starts.shape[0]), fwd_starts]).T,
+                 np.asarray([np.ones(rev_starts.shape[0]), rev_starts + len(allowed) - 1]).T].astype(int)
@@ -1,4 +1,10 @@
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from ragged import RaggedArray
+from instrument import profiled
 
 def genomeslice(input_array, strand, left, right, wrt = '5_to_3'):
     """Return 5' -> 3' slice of genome array based on inclusive coordinantes."""
@@ -11,7 +17,8 @@ def genomeslice(input_array, strand, left, right, wrt = '5_to_3'):
     else:
         raise ValueError("Unhandled strand {0 or 1} or wrt {'genome' or '5_to_3'} value.")
 
-def regionslice(regions, input_array, addl_nt = (0,0), wrt='5_to_3'):
+@profiled(items='regions')
+def regionslice(regions, input_array, addl_nt = (0,0), wrt='5_to_3', ragged=False, workers=1, chunk_size=None, pool='thread'):
     """ Returns the slice of given regions on input_array, + / - addl_nt.
 
         For each region in regions array, get the slice across the inclusive coordiniates on the 
@@ -39,17 +46,50 @@ def regionslice(regions, input_array, addl_nt = (0,0), wrt='5_to_3'):
             is always left -> right, regardless of strand. 5_to_3 reverses the direction if the
             slice is on the second strand to maintain 5' -> 3' orientation.
 
+        ragged : False (default) or True
+            If True, slices are gathered in a single vectorized pass and returned as a RaggedArray
+            (one contiguous buffer plus offsets) instead of a list of arrays.
+
+        workers, chunk_size, pool : see regionfunc
+            Parallel execution of the slicing loop; not used by the vectorized ragged path.
+
         Returns:
         ----------
-        out : list of same length as regions
+        out : list of same length as regions (or RaggedArray if ragged is True)
             Slices of input_array defined by regions with additional accoutrements defined by
             addl_nt and wrt.
 
         """
+    if ragged and isinstance(input_array, np.ndarray):
+        return _raggedslice(regions, input_array, addl_nt, wrt)
     # handle as special case of genomearray.regionfunc where the function returns the input
-    return regionfunc(lambda x: x, regions, input_array, addl_nt = addl_nt, wrt = wrt)
+    return regionfunc(_identity, regions, input_array, addl_nt = addl_nt, wrt = wrt, ragged = ragged,
+                      workers = workers, chunk_size = chunk_size, pool = pool)
 
-def regionfunc(input_function, regions, input_array, addl_nt = (0,0), wrt = '5_to_3'):
+def _identity(x):
+    return x
+
+def _raggedslice(regions, input_array, addl_nt, wrt):
+    # vectorized equivalent of regionslice, edges are handled as in regionfunc
+    if wrt not in ('genome', '5_to_3'):
+        raise ValueError("Unhandled wrt {'genome' or '5_to_3'} value.")
+    regions = np.asarray(regions).astype(np.int64)
+    if regions.shape[1] == 2:
+        regions = np.asarray([regions[:,0],regions[:,1],regions[:,1]]).T
+    strands = regions[:,0]
+    flipped = (strands == 1) & (wrt == '5_to_3') # left and right definitions are swapped on these regions
+    lefts  = np.maximum(0, regions[:,1] - np.where(flipped, addl_nt[1], addl_nt[0]))
+    rights = np.minimum(input_array.shape[1] - 1, regions[:,2] + np.where(flipped, addl_nt[0], addl_nt[1]))
+    lengths = np.maximum(0, rights - lefts + 1)
+    offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+    # position of every gathered value on the genome axis, segments laid out back to back
+    genome_i = np.repeat(lefts - offsets[:-1], lengths) + np.arange(offsets[-1])
+    values = input_array[np.repeat(strands, lengths), genome_i]
+    return RaggedArray(values, offsets, strands=strands, wrt=wrt)
+
+@profiled(items='regions')
+def regionfunc(input_function, regions, input_array, addl_nt = (0,0), wrt = '5_to_3', ragged = False,
+               workers = 1, chunk_size = None, pool = 'thread'):
     """ Return the output of a function across the given regions on input_array, + / - addl_nt.
 
         For each region in regions array, run the input_function across the inclusive coordiniates
@@ -80,9 +120,26 @@ def regionfunc(input_function, regions, input_array, addl_nt = (0,0), wrt = '5_t
             is always left -> right, regardless of strand. 5_to_3 reverses the direction if the
             slice is on the second strand to maintain 5' -> 3' orientation.
 
+        ragged : False (default) or True
+            If True, outputs of input_function are packed into a RaggedArray (one contiguous buffer
+            plus offsets) rather than returned as a list.
+
+        workers : 1 (default) or int
+            If > 1, regions are split into chunks which are evaluated in parallel. Output order,
+            edge handling and NaN on exception are the same as in the serial loop.
+
+        chunk_size : None (default) or int
+            Regions per chunk. If None, regions are split into about 4 chunks per worker.
+
+        pool : 'thread' (default) or 'process'
+            Threads suit functions which release the GIL (most numpy / scipy routines). Processes
+            suit pure python functions; they are forked from this process, so input_array (and
+            input_function) are shared with the workers without copying or pickling, and only
+            outputs (which must be picklable) are sent back.
+
         Returns:
         ----------
-        out : list of same length as regions
+        out : list of same length as regions (or RaggedArray if ragged is True)
             Output of input_function across regions defined by regions with additional accoutrements
             defined by addl_nt and wrt.
 
@@ -90,6 +147,15 @@ def regionfunc(input_function, regions, input_array, addl_nt = (0,0), wrt = '5_t
     # check if it only has one position term, duplicate it if it does
     if regions.shape[1] == 2:
         regions = np.asarray([regions[:,0],regions[:,1],regions[:,1]]).T
+    if workers > 1 and len(regions) > 1:
+        out = _parallelregionfunc(input_function, regions, input_array, addl_nt, wrt, workers, chunk_size, pool)
+    else:
+        out = _regionfuncloop(input_function, regions, input_array, addl_nt, wrt)
+    if ragged:
+        return RaggedArray.fromlist(out)
+    return out
+
+def _regionfuncloop(input_function, regions, input_array, addl_nt, wrt):
     out = []
     for reg in regions:
         strand, left, right = reg
@@ -108,20 +174,155 @@ def regionfunc(input_function, regions, input_array, addl_nt = (0,0), wrt = '5_t
             out.append(np.nan) # if function raises an exception, add np.nan to the list
     return out
 
-def _splitregion(region_len, window_len, stride):
-    n_steps = (region_len - window_len) / stride + 1
-    lefts = np.asarray([i*stride for i in range(n_steps)])
-    rights = lefts+window_len-1
-    remainder = region_len - rights[-1] - 1
-    return lefts + remainder/2, rights + remainder/2
+# arguments of running process-pool regionfunc calls, inherited by forked workers instead of pickled
+_shared_calls = {}
+_call_ids = itertools.count()
+
+def _sharedchunk(task):
+    call_id, start, stop = task
+    input_function, regions, input_array, addl_nt, wrt = _shared_calls[call_id]
+    return _regionfuncloop(input_function, regions[start:stop], input_array, addl_nt, wrt)
+
+def _parallelregionfunc(input_function, regions, input_array, addl_nt, wrt, workers, chunk_size, pool):
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(regions) // (4*workers)))
+    starts = range(0, len(regions), chunk_size)
+    if pool == 'thread':
+        thread_pool = ThreadPool(min(workers, len(starts)))
+        try:
+            chunks = thread_pool.map(lambda start: _regionfuncloop(input_function, regions[start:start+chunk_size],
+                                                                   input_array, addl_nt, wrt), starts)
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+    elif pool == 'process':
+        call_id = next(_call_ids)
+        _shared_calls[call_id] = (input_function, regions, input_array, addl_nt, wrt)
+        try:
+            process_pool = multiprocessing.Pool(min(workers, len(starts)))
+            try:
+                chunks = process_pool.map(_sharedchunk, [(call_id, start, start + chunk_size) for start in starts], chunksize=1)
+            finally:
+                process_pool.close()
+                process_pool.join()
+        finally:
+            del _shared_calls[call_id]
+    else:
+        raise ValueError("pool must be 'thread' or 'process'.")
+    return [value for chunk in chunks for value in chunk]
+
+@profiled(items='positions')
+def windowslice(positions, input_array, five, three, wrt = '5_to_3', complement = False, fill_value = 0):
+    """ Returns fixed-width windows around positions as a single (n positions, five + three, ...) array.
+
+        Windows are defined as in extractntonehot: five nt 5' of the position (including the
+        position itself) and three nt 3' of it. Windows are gathered from a sliding-window view of
+        input_array with fancy indexing rather than position by position. Positions too close to
+        the edges of the genome are padded with fill_value. If all windows fall inside the genome,
+        lie on a single strand and are evenly spaced (e.g. tiling a region with a fixed step), a
+        read-only strided view of input_array is returned instead of a copy.
+
+        Parameters:
+        ----------
+        positions : array-like, shape (n positions, 2)
+            The first column is the strand (0 or 1), the second column the genomic position.
+
+        input_array : numpy array, shape (2, len genome, ...)
+            The genome-shaped data from which to gather, e.g. a one-hot genome or a signal track.
+
+        five : int
+            Window length 5' of position, position included.
 
+        three : int
+            Window length 3' of position.
+
+        wrt : '5_to_3' (default) or 'genome'
+            The orientation of windows on the second strand. genome orientation is always
+            left -> right, 5_to_3 reverses second strand windows.
+
+        complement : False (default) or True
+            If True, one-hot channels (A,T,G,C order, last axis) of second strand windows are
+            swapped to their complements.
+
+        fill_value : scalar, 0 (default)
+            Value of window positions beyond the genome edges.
+
+        Returns:
+        ----------
+        out : numpy array, shape (n positions, five + three, ...)
+            Windows in the requested orientation.
+    """
+    if wrt not in ('genome', '5_to_3'):
+        raise ValueError("Unhandled wrt {'genome' or '5_to_3'} value.")
+    positions = np.asarray(positions).astype(np.int64).reshape(-1,2)
+    strands, pos = positions[:,0], positions[:,1]
+    width, genome_len = five + three, input_array.shape[1]
+    lefts = np.where(strands == 0, pos - five, pos - three + 1) # left-most genomic position of each window
+    flipped = (strands == 1) & (wrt == '5_to_3')
+    in_bounds = (lefts >= 0) & (lefts + width <= genome_len)
+    # zero-copy case: evenly spaced, in bounds windows on a single strand
+    steps = np.diff(lefts)
+    if (positions.shape[0] > 0 and np.all(in_bounds) and np.all(strands == strands[0]) and
+            np.all(steps == steps[:1]) and not (complement and strands[0] == 1)):
+        base = input_array[strands[0]]
+        starts = lefts
+        if flipped[0]: # work on the reversed strand so windows read 5' -> 3'
+            base = base[::-1]
+            starts = genome_len - lefts - width
+        step = starts[1] - starts[0] if starts.shape[0] > 1 else 0
+        return as_strided(base[starts[0]:], shape = (positions.shape[0], width) + base.shape[1:],
+                          strides = (step*base.strides[0],) + base.strides, writeable = False)
+    if np.can_cast(np.min_scalar_type(fill_value), input_array.dtype):
+        dtype = input_array.dtype
+    else:
+        dtype = np.float64
+    out = np.empty((positions.shape[0], width) + input_array.shape[2:], dtype = dtype)
+    if genome_len >= width:
+        windows = as_strided(input_array, shape = (2, genome_len - width + 1, width) + input_array.shape[2:],
+                             strides = input_array.strides[:2] + input_array.strides[1:])
+        out[in_bounds] = windows[strands[in_bounds], lefts[in_bounds]]
+    else:
+        in_bounds[:] = False
+    if not np.all(in_bounds): # windows overhanging the genome edges are gathered position by position
+        genome_i = lefts[~in_bounds].reshape(-1,1) + np.arange(width)
+        edge_windows = input_array[strands[~in_bounds].reshape(-1,1), np.clip(genome_i, 0, genome_len-1)].astype(dtype)
+        edge_windows[(genome_i < 0) | (genome_i >= genome_len)] = fill_value
+        out[~in_bounds] = edge_windows
+    out[flipped] = out[flipped,::-1]
+    if complement:
+        out[strands == 1] = out[strands == 1][...,[1,0,3,2]] # A <-> T, G <-> C
+    return out
+
+def _windowlayout(region_array, window_len, stride):
+    # per region (of those fitting at least one window): strand, left of the first window (the
+    # remainder of the region split between both sides, left side rounded down) and the index of
+    # its first window among all windows
+    regions = np.asarray(region_array, dtype=np.int64).reshape(-1,3)
+    lengths = regions[:,2] - regions[:,1] + 1
+    regions, lengths = regions[lengths >= window_len], lengths[lengths >= window_len]
+    n_windows = (lengths - window_len) // stride + 1
+    remainders = lengths - ((n_windows - 1)*stride + window_len)
+    first_window = np.r_[0, np.cumsum(n_windows)].astype(np.int64)
+    return regions[:,0], regions[:,1] + remainders // 2, first_window
+
+def _windowblock(layout, start, stop, window_len, stride):
+    # windows start to stop (exclusive) of a layout as [strand, left, right] regions
+    strands, first_lefts, first_window = layout
+    window_i = np.arange(start, stop, dtype=np.int64)
+    region_i = np.searchsorted(first_window, window_i, 'right') - 1
+    lefts = first_lefts[region_i] + (window_i - first_window[region_i])*stride
+    return np.asarray([strands[region_i], lefts, lefts + window_len - 1]).T.reshape(-1,3)
+
+@profiled(items='region_array')
 def splitregions(region_array, window_len, stride):
     """ Split regions into sub-regions with a given window length and stride.
 
         Provided a list of regions [strand, left, right] (inclusive), steps across each region with
         steps of length stride and divides it into sub-regions of a given window length. If there is
         a remainder after splitting (an additional complete window can't fit), it will be split on
-        the left and right sides of the input region.
+        the left and right sides of the input region. Window counts and offsets of all regions are
+        computed at once, so the cost is linear in the number of windows; see itersplitregions to
+        produce windows in bounded blocks.
         
         Parameters:
         ----------
@@ -142,12 +343,26 @@ def splitregions(region_array, window_len, stride):
             List of regions as above region_array, but the subdivided according to window_length and
             stride.
     """
-    region_output = np.empty((0,3), dtype=np.int)
-    for region in region_array:
-        strand, left, right = region
-        region_length = right - left + 1
-        if region_length >= window_len:
-            new_lefts, new_rights = _splitregion(region_length, window_len, stride)
-            new_regions = np.asarray([np.zeros(len(new_lefts))+strand, new_lefts+left, new_rights+left], dtype=np.uint32).T
-            region_output = np.r_[region_output, new_regions]
-    return region_output
\ No newline at end of file
+    layout = _windowlayout(region_array, window_len, stride)
+    return _windowblock(layout, 0, layout[2][-1], window_len, stride)
+
+def itersplitregions(region_array, window_len, stride, block_size=1000000):
+    """ Generator yielding the windows of splitregions in blocks of at most block_size windows.
+
+        Blocks concatenate to the output of splitregions, but only one block is held in memory at a
+        time, e.g. to stream windows of a whole genome into regionfunc or feature builders.
+
+        Parameters:
+        ----------
+        region_array, window_len, stride : see splitregions
+
+        block_size : int, 1000000 (default)
+            Maximum number of windows per block.
+
+        Returns:
+        ----------
+        blocks : generator of numpy arrays, shape (<= block_size, 3)
+    """
+    layout = _windowlayout(region_array, window_len, stride)
+    for start in range(0, layout[2][-1], block_size):
+        yield _windowblock(layout, start, min(layout[2][-1], start + block_size), window_len, stride)
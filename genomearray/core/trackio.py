@@ -0,0 +1,278 @@
+import re
+import gzip
+import numpy as np
+from instrument import profiled
+
+# text tracks are built as byte matrices (one column per record, so that each character position is a
+# contiguous row) and flattened record by record through a validity mask, so that formatting millions
+# of records needs no python-level loop over records
+
+def _open(path, mode):
+    # gzip is used if the path ends with .gz
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b', compresslevel=6)
+    return open(path, mode + 'b', 1 << 20)
+
+def _constcolumn(text, n_rows):
+    text = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    return (np.broadcast_to(text.reshape(-1,1), (text.shape[0], n_rows)),
+            np.broadcast_to(np.ones((1,1), dtype=bool), (text.shape[0], n_rows)))
+
+def _intcolumn(integers, min_width=1):
+    # decimal digits of non-negative integers, right-aligned in a fixed width; leading zeros invalid
+    integers = np.asarray(integers, dtype=np.int64)
+    max_integer = int(np.max(integers)) if integers.shape[0] > 0 else 0
+    width = max(min_width, len(str(max_integer)))
+    if width < 10: # 32 bit division is about twice as fast
+        integers = integers.astype(np.int32)
+    # digit k is valid if the integer has at least width - k digits
+    valid = integers >= (10**np.arange(width - 1, -1, -1)).astype(integers.dtype).reshape(-1,1)
+    valid[-1] = True
+    digits = np.empty((width, integers.shape[0]), dtype=np.uint8)
+    for k in range(width - 1, -1, -1):
+        integers, digits[k] = np.divmod(integers, 10)
+    digits += np.uint8(ord('0'))
+    return digits, valid
+
+def _checkdecimal(values, decimals):
+    # values (NaN already left out) must be finite and fit int64 once scaled to fixed point
+    if not np.all(np.abs(values) < 2.**62 / 10**decimals):
+        raise ValueError('values to write must be finite and smaller than %g in magnitude with %i decimals.' %
+                         (2.**62 / 10**decimals, decimals))
+
+def _decimalcolumns(values, decimals):
+    # fixed-point decimal text of values rounded to decimals, trailing zeros (and point) removed, as a
+    # list of (bytes, valid) columns; values must pass _checkdecimal
+    scaled = np.round(np.abs(values) * 10**decimals).astype(np.int64)
+    sign = (values < 0) & (scaled != 0)
+    columns = [(np.full((1, values.shape[0]), ord('-'), dtype=np.uint8), sign.reshape(1,-1))]
+    if decimals > 0 and np.any(scaled % 10**decimals):
+        # digits of the integer and fraction parts in one pass, split before the last decimals digits
+        digits, valid = _intcolumn(scaled, min_width=decimals + 1)
+        valid[-decimals-1] = True # units digit
+        # leading zeros of the fraction are kept, trailing zeros are not
+        fraction_valid = np.logical_or.accumulate(digits[:-decimals-1:-1] != ord('0'), axis=0)[::-1]
+        columns += [(digits[:-decimals], valid[:-decimals]),
+                    (np.full((1, values.shape[0]), ord('.'), dtype=np.uint8), fraction_valid[:1]),
+                    (digits[-decimals:], fraction_valid)]
+    else: # integer values, no fraction is written
+        columns.append(_intcolumn(scaled // 10**decimals))
+    return columns
+
+def _joincolumns(columns):
+    # stack (bytes, valid) columns and keep only valid bytes, record by record
+    text_bytes = np.ascontiguousarray(np.concatenate([c[0] for c in columns], 0).T)
+    return text_bytes[np.ascontiguousarray(np.concatenate([c[1] for c in columns], 0).T)].tobytes()
+
+def _runs(values):
+    # start, exclusive end and value of each run of equal values (NaN runs included)
+    change = values[1:] != values[:-1]
+    change &= ~(np.isnan(values[1:]) & np.isnan(values[:-1]))
+    ends = np.r_[np.nonzero(change)[0] + 1, values.shape[0]]
+    return np.r_[0, ends[:-1]], ends, values[ends - 1]
+
+@profiled()
+def writebedgraph(paths, input_array, chrom, decimals=4, skip_zeros=True, negative_minus=False,
+                  track_names=None, block_size=1000000):
+    """ Writes a genome-shaped array as a pair of strand-split bedGraph files.
+
+        Values are rounded to decimals, then runs of identical values are collapsed into single
+        records with vectorized change-point detection. NaN runs (and zero runs if skip_zeros) are
+        left out; infinite values, or values too large for decimals, raise ValueError. Records are formatted as byte blocks of block_size records and written with a
+        large buffer; paths ending with .gz are gzip compressed.
+
+        Parameters:
+        ----------
+        paths : tuple of two paths (strings)
+            Output bedGraph files of the first (+) and second (-) strand.
+
+        input_array : numpy array, shape (2, len genome)
+            Track to write, e.g. the output of mapfragdensity or rollingslope.
+
+        chrom : string
+            Chromosome (reference sequence) name written in every record.
+
+        decimals : int, 4 (default)
+            Decimal places kept in values.
+
+        skip_zeros : True (default) or False
+            If True, runs of zeros are not written (bedGraph readers treat gaps as no data).
+
+        negative_minus : False (default) or True
+            If True, second strand values are written negated, as used to display both strands on
+            one axis.
+
+        track_names : None (default) or tuple of two strings
+            If given, a track definition line is written at the top of each file.
+
+        block_size : int, 1000000 (default)
+            Records formatted per block.
+    """
+    for strand in [0,1]:
+        values = np.round(np.asarray(input_array[strand], dtype=np.float64), decimals)
+        if strand == 1 and negative_minus:
+            values = -values
+        starts, ends, run_values = _runs(values)
+        keep = ~np.isnan(run_values)
+        if skip_zeros:
+            keep &= run_values != 0
+        starts, ends, run_values = starts[keep], ends[keep], run_values[keep]
+        _checkdecimal(run_values, decimals)
+        with _open(paths[strand], 'w') as f:
+            if track_names is not None:
+                f.write(('track type=bedGraph name="%s"\n' % track_names[strand]).encode('ascii'))
+            for a in range(0, starts.shape[0], block_size):
+                b = min(starts.shape[0], a + block_size)
+                if np.array_equal(starts[a+1:b], ends[a:b-1]): # adjacent records, each end is the next start
+                    bounds = _intcolumn(np.r_[starts[a:b], ends[b-1]])
+                    start_column, end_column = (bounds[0][:,:-1], bounds[1][:,:-1]), (bounds[0][:,1:], bounds[1][:,1:])
+                else:
+                    start_column, end_column = _intcolumn(starts[a:b]), _intcolumn(ends[a:b])
+                f.write(_joincolumns([_constcolumn(chrom + '\t', b - a), start_column, _constcolumn('\t', b - a),
+                                      end_column, _constcolumn('\t', b - a)] +
+                                     _decimalcolumns(run_values[a:b], decimals) + [_constcolumn('\n', b - a)]))
+
+def _readtext(path):
+    # file text without its leading track, browser and comment lines
+    with _open(path, 'r') as f:
+        text = f.read()
+    text = text if isinstance(text, str) else text.decode('ascii') # bytes on python 3
+    while text.startswith(('track', 'browser', '#')):
+        text = text[text.find('\n') + 1:] if '\n' in text else ''
+    return text
+
+def _parsebedgraph(text, chrom):
+    # (starts, ends, values) of the records of chrom, parsed in bulk by numpy
+    if chrom is None:
+        chrom = text.split('\t', 1)[0]
+    n_lines = text.count('\n') + (0 if text.endswith('\n') or len(text) == 0 else 1)
+    prefix = chrom + '\t'
+    if text.startswith(prefix) and text.count('\n' + prefix) + 1 == n_lines: # single chromosome file
+        records = text[len(prefix):].replace('\n' + prefix, '\n')
+    else:
+        records = '\n'.join(re.findall(r'(?m)^%s\t([^\n]*)' % re.escape(chrom), text))
+    records = np.fromstring(records, sep=' ').reshape(-1,3)
+    return records[:,0].astype(np.int64), records[:,1].astype(np.int64), records[:,2]
+
+def _fillruns(out, starts, ends, values):
+    # out[start:end] = value for every run, in one vectorized assignment
+    lengths = ends - starts
+    positions = np.arange(np.sum(lengths)) + np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    out[positions] = np.repeat(values, lengths)
+
+@profiled()
+def readbedgraph(paths, genome_len=None, chrom=None, negative_minus=False, fill_value=0, dtype=np.float64):
+    """ Reads a pair of strand-split bedGraph files into a genome-shaped array.
+
+        Parameters:
+        ----------
+        paths : tuple of two paths (strings)
+            bedGraph files of the first (+) and second (-) strand, optionally gzip compressed (.gz).
+
+        genome_len : None (default) or int
+            Length of the output. If None, the largest record end of either file.
+
+        chrom : None (default) or string
+            Chromosome whose records are read. If None, the chromosome of the first record.
+
+        negative_minus : False (default) or True
+            If True, second strand values are negated back (see writebedgraph).
+
+        fill_value : scalar, 0 (default)
+            Value of positions not covered by any record.
+
+        dtype : numpy data type, np.float64 (default)
+
+        Returns:
+        ----------
+        out : numpy array, shape (2, genome_len)
+    """
+    records = [_parsebedgraph(_readtext(path), chrom) for path in paths]
+    if genome_len is None:
+        genome_len = max([int(np.max(r[1])) if r[1].shape[0] > 0 else 0 for r in records])
+    out = np.full((2, genome_len), fill_value, dtype=dtype)
+    for strand, (starts, ends, values) in enumerate(records):
+        if strand == 1 and negative_minus:
+            values = -values
+        _fillruns(out[strand], starts, np.minimum(ends, genome_len), values)
+    return out
+
+@profiled()
+def writewig(paths, input_array, chrom, decimals=4):
+    """ Writes a genome-shaped array as a pair of strand-split fixedStep WIG files.
+
+        Each contiguous stretch of non-NaN positions is written as one fixedStep block (step 1,
+        1-based start) with one value per line. Infinite values, or values too large for decimals,
+        raise ValueError. Paths ending with .gz are gzip compressed.
+
+        Parameters:
+        ----------
+        paths : tuple of two paths (strings)
+            Output WIG files of the first (+) and second (-) strand.
+
+        input_array : numpy array, shape (2, len genome)
+
+        chrom : string
+            Chromosome name written in block headers.
+
+        decimals : int, 4 (default)
+            Decimal places kept in values.
+    """
+    for strand in [0,1]:
+        values = np.asarray(input_array[strand], dtype=np.float64)
+        valid = ~np.isnan(values)
+        block_starts = np.nonzero(valid & ~np.r_[False, valid[:-1]])[0]
+        block_ends = np.nonzero(valid & ~np.r_[valid[1:], False])[0] + 1
+        _checkdecimal(values[valid], decimals)
+        with _open(paths[strand], 'w') as f:
+            for left, right in zip(block_starts, block_ends):
+                f.write(('fixedStep chrom=%s start=%i step=1\n' % (chrom, left + 1)).encode('ascii'))
+                for a in range(left, right, 1000000):
+                    b = min(right, a + 1000000)
+                    f.write(_joincolumns(_decimalcolumns(values[a:b], decimals) + [_constcolumn('\n', b - a)]))
+
+@profiled()
+def readwig(paths, genome_len, chrom=None, fill_value=np.nan, dtype=np.float64):
+    """ Reads a pair of strand-split WIG files (fixedStep and variableStep blocks) into a
+        genome-shaped array.
+
+        Parameters:
+        ----------
+        paths : tuple of two paths (strings)
+            WIG files of the first (+) and second (-) strand, optionally gzip compressed (.gz).
+
+        genome_len : int
+            Length of the output.
+
+        chrom : None (default) or string
+            If given, only blocks of this chromosome are read.
+
+        fill_value : scalar, np.nan (default)
+            Value of positions not covered by any block.
+
+        dtype : numpy data type, np.float64 (default)
+
+        Returns:
+        ----------
+        out : numpy array, shape (2, genome_len)
+    """
+    out = np.full((2, genome_len), fill_value, dtype=dtype)
+    for strand, path in enumerate(paths):
+        text = _readtext(path)
+        # alternating block header lines and block bodies, parsed one block at a time
+        parts = re.split(r'(?m)^((?:fixedStep|variableStep)[^\n]*)\n', text)
+        for header, body in zip(parts[1::2], parts[2::2]):
+            params = dict(p.split('=') for p in header.split()[1:])
+            if chrom is not None and params.get('chrom') != chrom:
+                continue
+            span = int(params.get('span', 1))
+            if header.startswith('fixedStep'):
+                values = np.fromstring(body, sep=' ')
+                positions = int(params['start']) - 1 + np.arange(values.shape[0]) * int(params.get('step', 1))
+            else:
+                records = np.fromstring(body, sep=' ').reshape(-1,2)
+                positions, values = records[:,0].astype(np.int64) - 1, records[:,1]
+            for offset in range(span):
+                in_genome = positions + offset < genome_len
+                out[strand, positions[in_genome] + offset] = values[in_genome]
+    return out
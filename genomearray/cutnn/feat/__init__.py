@@ -1 +1,3 @@
-from _feature_functions import buildbinaryfeatures, randomregionsampler, ntfeatures, targetregionfeatures, regionlistfeatures
\ No newline at end of file
+from _feature_functions import buildbinaryfeatures, randomregionsampler, ntfeatures, targetregionfeatures, regionlistfeatures
+from _feature_store import FeatureStore
+from _kmer_functions import genomekmercodes, kmerfeatures
\ No newline at end of file
@@ -1,11 +1,15 @@
 import numpy as np
+from multiprocessing import Pool, cpu_count
+from multiprocessing.sharedctypes import RawArray
 import genomearray as ga
+from genomearray.core.instrument import profiled
 
+@profiled()
 def buildbinaryfeatures(positivefunc, positivekwargs,
                         negativefunc, negativekwargs,
                         negsamplerfunc, negsamplerkwargs,
                         featuregen,  featuregenkwargs,
-                        verbose=False, random_seed=None):
+                        verbose=False, random_seed=None, store_path=None, store_chunk=10000):
     # to enable reproducibility, allow insert of a random-seed
     np.random.seed(random_seed)
     # get locations of events using the positive feature function
@@ -20,6 +24,11 @@ def buildbinaryfeatures(positivefunc, positivekwargs,
     negative_events  = negsamplerfunc(negative_regions, positive_events, **negsamplerkwargs)
     if verbose == True:
         print '...converted into %i negative events.' % negative_events.shape[0]
+    if store_path is not None: # write features to disk in chunks of events rather than holding them in memory
+        feature_out = _storebinaryfeatures(store_path, store_chunk, positive_events, negative_events,
+                                           featuregen, featuregenkwargs)
+        shuffle_order = np.random.choice(np.arange(len(feature_out[2])), size=len(feature_out[2]), replace=False)
+        return feature_out, shuffle_order, positive_events, negative_events
     # make features from provided positions
     positive_features = featuregen(positive_events, **featuregenkwargs)
     negative_features = featuregen(negative_events, **featuregenkwargs)
@@ -36,6 +45,22 @@ def buildbinaryfeatures(positivefunc, positivekwargs,
     feature_out = [features, feature_labels, feature_weights]
     return feature_out, shuffle_order, positive_events, negative_events
 
+def _storebinaryfeatures(store_path, store_chunk, positive_events, negative_events, featuregen, featuregenkwargs):
+    store = ga.cutnn.feat.FeatureStore(store_path, mode='w')
+    sample_counts = []
+    for events, label in [(positive_events, [0,1]), (negative_events, [1,0])]:
+        n_samples = 0
+        for chunk_start in range(0, len(events), store_chunk):
+            chunk_features = featuregen(events[chunk_start:chunk_start+store_chunk], **featuregenkwargs)
+            chunk_len = len(chunk_features[0])
+            n_samples += store.append(chunk_features, labels=np.zeros((chunk_len,2), dtype=np.int8)+label)
+        sample_counts.append(n_samples)
+    # as for in-memory features, positive samples are weighted 1, negative samples for equality
+    store.close(weights=np.r_[np.ones(sample_counts[0]),
+                              np.zeros(sample_counts[1])+sample_counts[0]/float(sample_counts[1])].astype(np.float16))
+    return store
+
+@profiled(items=len)
 def randomregionsampler(negative_mask, positive_positions, n_samples=None, buffer_size=None):
     negative_mask = negative_mask.copy()
     # subtract all regions generated from positive_positions +/- buffer_size
@@ -72,9 +97,10 @@ def randomregionsampler(negative_mask, positive_positions, n_samples=None, buffe
         sampled += 1
     return np.asarray(sample_positions)
 
+@profiled(items='positions')
 def ntfeatures(positions, regions=None, genome=None,
                           array_types=None, offset_terms=None,
-                          additional_data_arrays=[], output_positions=False):
+                          additional_data_arrays=[], output_positions=False, ragged=False):
     # generate out arrays for each of the messages
     out_arrays = [[] for i in range(len(array_types))]
     included_positions = []
@@ -119,11 +145,14 @@ def ntfeatures(positions, regions=None, genome=None,
             for a in additional_data_arrays:
                 concat_input.append(np.reshape(ga.genomeslice(a, r_strand, left, right-1),(-1,1)))
             out_arrays[i].append(np.concatenate(concat_input, axis=1))
+    if ragged: # pack each array type into a single contiguous buffer
+        out_arrays = [ga.RaggedArray.fromlist(a) for a in out_arrays]
     if output_positions:
         return out_arrays, np.asarray(included_positions)
     else:
         return out_arrays
 
+@profiled()
 def targetregionfeatures(target_region, sampling_step, ntfeatures_kwargs):
     # get positions for sampling
     strand, left, right = target_region
@@ -134,16 +163,82 @@ def targetregionfeatures(target_region, sampling_step, ntfeatures_kwargs):
     sample_features, sample_positions = ga.cutnn.feat.ntfeatures(sample_positions, **ntfeatures_kwargs)
     return sample_positions, sample_features
 
-def regionlistfeatures(region_list, sampling_step, ntfeatures_kwargs):
-    # do target region
+@profiled(items='region_list')
+def regionlistfeatures(region_list, sampling_step, ntfeatures_kwargs, store_path=None, workers=None):
+    # do target region, in a pool of worker processes if workers > 1 (-1 uses all cores)
+    if workers == -1:
+        workers = cpu_count()
+    if workers is not None and workers > 1:
+        region_results = _parallelregionfeatures(region_list, sampling_step, ntfeatures_kwargs, workers)
+    else:
+        region_results = (ga.cutnn.feat.targetregionfeatures(target_region, sampling_step, ntfeatures_kwargs)
+                          for target_region in region_list)
     positions_list = []
     features_list = []
-    for target_region in region_list:
-        positions, features = ga.cutnn.feat.targetregionfeatures(target_region, sampling_step, ntfeatures_kwargs)
+    if store_path is not None: # append features of each target region to an on-disk store
+        store = ga.cutnn.feat.FeatureStore(store_path, mode='w')
+    for positions, features in region_results:
         positions_list.append(positions)
-        features_list.append(features)
+        if store_path is not None:
+            store.append(features)
+        else:
+            features_list.append(features)
     sample_positions = np.concatenate(positions_list,0)
-    sample_features = []
+    if store_path is not None:
+        store.close()
+        return sample_positions, store
+    return sample_positions, _concatfeatures(features_list)
+
+def _concatfeatures(features_list):
+    # one concatenation per feature of the features of several regions (in order), empty ones skipped
+    out_features = []
     for i in range(len(features_list[0])):
-        sample_features.append(np.concatenate([f[i] for f in features_list],0))
-    return sample_positions, sample_features
+        region_arrays = [np.asarray(f[i]) for f in features_list if len(f[i]) > 0]
+        out_features.append(np.concatenate(region_arrays, 0) if len(region_arrays) > 0 else np.asarray([]))
+    return out_features
+
+_region_worker_state = {} # arguments of regionlistfeatures process pool workers
+
+def _sharedarray(array):
+    # copy an array into shared memory, returns the shared buffer and a numpy view onto it
+    array = np.ascontiguousarray(array)
+    shared_buffer = RawArray('b', max(1, array.nbytes))
+    shared_array = np.frombuffer(shared_buffer, dtype=array.dtype, count=array.size).reshape(array.shape)
+    shared_array[:] = array
+    return shared_buffer, shared_array
+
+def _initregionworker(sampling_step, ntfeatures_kwargs, shared_buffers, shared_specs):
+    # attach to shared additional_data_arrays without copying
+    ntfeatures_kwargs = ntfeatures_kwargs.copy()
+    ntfeatures_kwargs['additional_data_arrays'] = [np.frombuffer(b, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+                                                   for b, (dtype, shape) in zip(shared_buffers, shared_specs)]
+    _region_worker_state['sampling_step'] = sampling_step
+    _region_worker_state['ntfeatures_kwargs'] = ntfeatures_kwargs
+
+def _regionworker(target_regions):
+    # features of a contiguous chunk of target regions, concatenated so that each chunk is returned
+    # as one array per feature (one pickle round trip per chunk rather than per region)
+    results = [ga.cutnn.feat.targetregionfeatures(target_region, _region_worker_state['sampling_step'],
+                                                  _region_worker_state['ntfeatures_kwargs'])
+               for target_region in target_regions]
+    return np.concatenate([r[0] for r in results], 0), _concatfeatures([r[1] for r in results])
+
+def _parallelregionfeatures(region_list, sampling_step, ntfeatures_kwargs, workers):
+    # additional data arrays are placed once in shared memory, the genome and remaining kwargs are
+    # inherited by the forked workers
+    ntfeatures_kwargs = ntfeatures_kwargs.copy()
+    shared_buffers, shared_specs = [], []
+    for a in ntfeatures_kwargs.pop('additional_data_arrays', []):
+        shared_buffer, shared_array = _sharedarray(a)
+        shared_buffers.append(shared_buffer)
+        shared_specs.append((shared_array.dtype, shared_array.shape))
+    pool = Pool(workers, initializer=_initregionworker,
+                initargs=(sampling_step, ntfeatures_kwargs, shared_buffers, shared_specs))
+    region_list = list(region_list)
+    chunk_size = max(1, len(region_list) // (workers*4))
+    try:
+        # imap preserves input order, results of each chunk of regions are consumed as they arrive
+        for result in pool.imap(_regionworker, [region_list[a:a+chunk_size] for a in range(0, len(region_list), chunk_size)]):
+            yield result
+    finally:
+        pool.terminate()
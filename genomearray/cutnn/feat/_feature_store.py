@@ -0,0 +1,104 @@
+import os
+import json
+import numpy as np
+
+class FeatureStore():
+    """ Disk-backed features in the [x, labels, sample_weights] form used by batchiter and fitmodel.
+
+        Each input of x is stored as its own contiguous raw binary file which is appended to as
+        features are generated and memory-mapped once the store is closed, so feature sets larger
+        than RAM can be built and trained on. Labels and sample weights are small and kept as .npy
+        files. Indexing the store (store[0][input_i][batch_i], store[1][batch_i], ...) behaves like
+        the in-memory feature list.
+
+        Parameters:
+        ----------
+        path : path to store directory (string)
+            Created if mode is 'w'.
+
+        mode : 'r' (default) or 'w'
+            'r' opens an existing store read-only. 'w' creates a new (empty) store for appending;
+            call close once all features have been appended to make it readable.
+
+    """
+    def append(self, x, labels=None, weights=None):
+        """ Append a block of samples: x is a list of arrays (one per input), all of equal length.
+            Returns the number of samples appended. """
+        if self.mode != 'w':
+            raise IOError('FeatureStore is not open for writing.')
+        x = [np.asarray(a) for a in x]
+        n_samples = len(x[0])
+        if n_samples == 0:
+            return 0
+        if self.meta['inputs'] is None: # the first block defines the per-sample shape and dtype of each input
+            self.meta['inputs'] = [{'shape' : list(a.shape[1:]), 'dtype' : a.dtype.str} for a in x]
+        for input_i, a in enumerate(x):
+            if list(a.shape[1:]) != self.meta['inputs'][input_i]['shape']:
+                raise ValueError('sample shape of input %i does not match the store.' % input_i)
+            with open(self._inputpath(input_i), 'ab') as f:
+                np.ascontiguousarray(a, dtype=self.meta['inputs'][input_i]['dtype']).tofile(f)
+        if labels is not None:
+            self._labels.append(np.asarray(labels))
+        if weights is not None:
+            self._weights.append(np.asarray(weights))
+        self.meta['n_samples'] += n_samples
+        return n_samples
+
+    def close(self, weights=None):
+        """ Finish writing, optionally replacing all sample weights, and reopen the store read-only. """
+        if self.mode != 'w':
+            return
+        if len(self._labels) > 0:
+            np.save(os.path.join(self.path, 'labels.npy'), np.concatenate(self._labels, 0))
+        if weights is not None:
+            np.save(os.path.join(self.path, 'weights.npy'), np.asarray(weights))
+        elif len(self._weights) > 0:
+            np.save(os.path.join(self.path, 'weights.npy'), np.concatenate(self._weights, 0))
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+        self._open()
+
+    def _inputpath(self, input_i):
+        return os.path.join(self.path, 'input_%i.dat' % input_i)
+
+    def _open(self):
+        with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.mode = 'r'
+        self.x = []
+        for input_i, input_meta in enumerate(self.meta['inputs'] or []):
+            shape = tuple([self.meta['n_samples']] + input_meta['shape'])
+            if self.meta['n_samples'] == 0:
+                self.x.append(np.empty(shape, dtype=input_meta['dtype']))
+            else:
+                self.x.append(np.memmap(self._inputpath(input_i), dtype=input_meta['dtype'], mode='r', shape=shape))
+        self.labels, self.weights = None, None
+        if os.path.exists(os.path.join(self.path, 'labels.npy')):
+            self.labels = np.load(os.path.join(self.path, 'labels.npy'))
+        if os.path.exists(os.path.join(self.path, 'weights.npy')):
+            self.weights = np.load(os.path.join(self.path, 'weights.npy'))
+
+    def __getitem__(self, i):
+        return [self.x, self.labels, self.weights][i]
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter([self.x, self.labels, self.weights])
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        if mode == 'w':
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for f in os.listdir(path): # remove any previous store in this directory
+                if f.startswith('input_') or f in ('labels.npy', 'weights.npy', 'meta.json'):
+                    os.remove(os.path.join(path, f))
+            self.mode = 'w'
+            self.meta = {'n_samples' : 0, 'inputs' : None}
+            self._labels, self._weights = [], []
+        elif mode == 'r':
+            self._open()
+        else:
+            raise ValueError("mode must be 'r' or 'w'.")
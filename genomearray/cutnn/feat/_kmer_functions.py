@@ -0,0 +1,105 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+import genomearray as ga
+from genomearray.core.instrument import profiled
+
+@profiled()
+def genomekmercodes(genome, k):
+    """ Integer codes of the k-mer read 5' -> 3' from every position of both strands.
+
+        k-mers are encoded 2 bits per nt (A,T,G,C -> 0,1,2,3, 5' nt most significant) in k
+        vectorized shift passes over the whole genome. On the second strand the k-mer at a
+        position is read leftwards on the complement, i.e. in its own 5' -> 3' direction. Positions
+        where a k-mer would run off the genome or covers an unknown nucleotide are -1.
+
+        Parameters:
+        ----------
+        genome : Bio SeqRecord (or any object with a .seq attribute) or DNA string
+            Genome to encode.
+
+        k : int
+            k-mer length.
+
+        Returns:
+        ----------
+        kmer_codes : numpy array, shape (2, len genome)
+            Genome-shaped array of k-mer codes in [0, 4**k).
+    """
+    sequence = genome.seq if hasattr(genome, 'seq') else genome
+    nt_codes = ga.core.seqindex.encodesequence(sequence)
+    forward = ga.core.seqindex.kmercodes(nt_codes, k)
+    # complement is code ^ 1, unknown nucleotides stay negative
+    reverse = ga.core.seqindex.kmercodes((nt_codes ^ 1)[::-1], k)[::-1]
+    return np.asarray([forward, reverse])
+
+@profiled(items='positions')
+def kmerfeatures(positions, kmer_codes=None, genome=None, k=3, five=50, three=50,
+                 normalize=False, sparse=False, ntfeatures_kwargs=None):
+    """ k-mer count vectors of windows around positions, for use as a feature generator.
+
+        Windows are defined as in extractntonehot (five nt 5' of the position, position included,
+        and three nt 3' of it) and only k-mers lying entirely inside the window are counted.
+        Windows are gathered from precomputed genome-wide k-mer codes with windowslice, then
+        counted with a single bincount (or into a sparse matrix).
+
+        Parameters:
+        ----------
+        positions : array-like, shape (n positions, 2)
+            Strand and genomic position of each window.
+
+        kmer_codes : None (default) or numpy array, shape (2, len genome)
+            Output of genomekmercodes. Pass this when generating features repeatedly, otherwise it
+            is recomputed from genome on every call.
+
+        genome : None (default) or Bio SeqRecord
+            Used to compute kmer_codes if they are not provided.
+
+        k : int, 3 (default)
+            k-mer length, must match kmer_codes if provided.
+
+        five, three : int, 50 (default)
+            Window length 5' (position included) and 3' of position.
+
+        normalize : False (default) or True
+            If True, counts are divided by the number of k-mers in the window.
+
+        sparse : False (default) or True
+            If True, a scipy.sparse csr_matrix is returned in place of a dense array, useful for
+            large k.
+
+        ntfeatures_kwargs : None (default) or dict
+            If given, ntfeatures is run first (with output_positions) and the k-mer counts of the
+            positions it keeps are appended as an extra input, so this function can directly
+            replace ntfeatures as the featuregen of buildbinaryfeatures.
+
+        Returns:
+        ----------
+        features : list of numpy arrays
+            [counts] with counts of shape (n positions, 4**k), or ntfeatures inputs + [counts].
+    """
+    if kmer_codes is None:
+        kmer_codes = genomekmercodes(genome, k)
+    features = []
+    if ntfeatures_kwargs is not None:
+        ntfeatures_kwargs = ntfeatures_kwargs.copy()
+        ntfeatures_kwargs['output_positions'] = True
+        features, positions = ga.cutnn.feat.ntfeatures(positions, **ntfeatures_kwargs)
+    positions = np.asarray(positions).reshape(-1,2)
+    n_kmers = 4**k
+    # codes of the k-mers starting at each window offset, 5' -> 3'; -1 off the genome edges
+    window_codes = ga.windowslice(positions, kmer_codes, five, three - k + 1, fill_value=-1)
+    rows, codes = np.nonzero(window_codes >= 0)
+    codes = window_codes[rows, codes]
+    if sparse:
+        counts = coo_matrix((np.ones(codes.shape[0], dtype=np.float32), (rows, codes)),
+                            shape=(positions.shape[0], n_kmers)).tocsr()
+    else:
+        counts = np.bincount(rows*n_kmers + codes, minlength=positions.shape[0]*n_kmers)
+        counts = counts.reshape(positions.shape[0], n_kmers).astype(np.float32)
+    if normalize:
+        totals = np.maximum(1, np.sum(window_codes >= 0, axis=1)).astype(np.float32)
+        if sparse:
+            counts = counts.multiply(1. / totals.reshape(-1,1)).tocsr()
+        else:
+            counts /= totals.reshape(-1,1)
+    return list(features) + [counts]
@@ -1,3 +1,3 @@
-from _input_functions import randshuffle, datasplitter, batchiter
+from _input_functions import randshuffle, datasplitter, batchiter, prefetchiter
 from _training_functions import fitmodel
-from _prediction_functions import mappredictions, rawpredictions
\ No newline at end of file
+from _prediction_functions import mappredictions, rawpredictions, streampredictions
\ No newline at end of file
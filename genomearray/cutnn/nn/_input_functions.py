@@ -1,8 +1,13 @@
 import numpy as np
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
-def randshuffle(shuffle_order, features):
-    """ Return a new shuffle order without altering or looking at features. """
-    return np.random.choice(shuffle_order, size=len(shuffle_order), replace=False)
+def randshuffle(shuffle_order, features, random_state=None):
+    """ Return a new shuffle order without altering or looking at features. Draws from random_state
+    (a numpy RandomState) if given, otherwise from the global numpy random state. """
+    random_state = np.random if random_state is None else random_state
+    return random_state.choice(shuffle_order, size=len(shuffle_order), replace=False)
 
 def datasplitter(input_i, data_split):
     if callable(data_split): # if data split is a function
@@ -23,9 +28,16 @@ def batchiter(features, shuffle_order, batch_size=100, mode=None,
               shuffle_parameters={}, # additional kwargs to pass to shuffle function
               data_modification=lambda x:x, # placeholder function with no modification to data
               single_cycle = False,
+              sort_batches = False, # sort indices within each batch, for sequential reads from a FeatureStore
               ):
     """ For data handling, choose from train, test or validation.
     Features must be in the form of a list: [x, labels, sample_weights]."""
+    for batch_i in _batchindices(features, shuffle_order, batch_size, mode, data_split,
+                                 shuffle_function, shuffle_parameters, single_cycle, sort_batches):
+        yield _assemblebatch(features, batch_i, data_modification) # output batch
+
+def _batchindices(features, shuffle_order, batch_size, mode, data_split,
+                  shuffle_function, shuffle_parameters, single_cycle, sort_batches=False):
     # split the features using the shuffle order
     train_i, validate_i, test_i = datasplitter(shuffle_order, data_split)
     while True: # data yielding loop to run until generator is no longer needed
@@ -41,13 +53,72 @@ def batchiter(features, shuffle_order, batch_size=100, mode=None,
         # internal for loop generates batch sized pieces of single epochs of data with shuffling (above) in between
         for batch_start in range(len(input_order)/batch_size):
             batch_i = input_order[batch_start*batch_size:batch_start*batch_size+batch_size]
-            x = [] # for storage of current x (input features)
-            for input_i in range(len(features[0])): # for multiple input NNs, iterate across inputs
-                # append this batch (batch_i) of this input (input_i) of features (features[0])
-                # data is also run through a user-defined modification function
-                x.append(data_modification(features[0][input_i][batch_i]))
-            y = features[1][batch_i] # data labels can accessed directly
-            w = features[2][batch_i] # sample weights can be accessed directly
-            yield x, y, w # output batch
+            if sort_batches: # batch membership is unchanged, only the order of reads within the batch
+                batch_i = np.sort(batch_i)
+            yield batch_i
         if single_cycle: # break the while loop if only a single cycle through the data is desired
-            break
\ No newline at end of file
+            break
+
+def _assemblebatch(features, batch_i, data_modification):
+    x = [] # for storage of current x (input features)
+    for input_i in range(len(features[0])): # for multiple input NNs, iterate across inputs
+        # append this batch (batch_i) of this input (input_i) of features (features[0])
+        # data is also run through a user-defined modification function
+        x.append(data_modification(features[0][input_i][batch_i]))
+    y = features[1][batch_i] # data labels can accessed directly
+    w = features[2][batch_i] # sample weights can be accessed directly
+    return x, y, w
+
+_prefetch_state = {} # features and data_modification of prefetchiter process pool workers
+
+def _initprefetchworker(features, data_modification):
+    # workers are forked, so features are inherited rather than pickled
+    _prefetch_state['features'] = features
+    _prefetch_state['data_modification'] = data_modification
+
+def _prefetchbatch(batch_i):
+    return _assemblebatch(_prefetch_state['features'], batch_i, _prefetch_state['data_modification'])
+
+def prefetchiter(features, shuffle_order, batch_size=100, mode=None,
+                 data_split=(6,2,2), split_parameters={},
+                 shuffle_function=lambda shuffle_order, features, **kwargs: shuffle_order,
+                 shuffle_parameters={},
+                 data_modification=lambda x:x,
+                 single_cycle = False,
+                 sort_batches = False,
+                 prefetch=4, # maximum number of batches assembled ahead of consumption
+                 workers=2, # number of threads or processes assembling batches
+                 pool='thread', # 'thread' or 'process'
+                 random_seed=None,
+                 ):
+    """ Drop-in replacement for batchiter which assembles batches in the background.
+
+    Batch indices are generated exactly as in batchiter (same split, shuffling and epochs), but
+    indexing of features and data_modification run in a pool of workers, up to prefetch batches
+    ahead of the consumer, so batch assembly overlaps with model compute. Batches are always
+    yielded in order and shuffling runs in the calling thread, so output is deterministic given
+    random_seed: each iterator then passes its own np.random.RandomState(random_seed) to
+    shuffle_function as the random_state keyword argument (as accepted by randshuffle), leaving the
+    global numpy random state untouched. With pool='process', workers are forked (features are
+    inherited, not copied), which suits CPU-heavy data_modification functions that hold the GIL."""
+    if random_seed is not None:
+        shuffle_parameters = dict(shuffle_parameters, random_state=np.random.RandomState(random_seed))
+    if pool == 'thread':
+        worker_pool = ThreadPool(workers)
+        submit = lambda batch_i: worker_pool.apply_async(_assemblebatch, (features, batch_i, data_modification))
+    elif pool == 'process':
+        worker_pool = Pool(workers, initializer=_initprefetchworker, initargs=(features, data_modification))
+        submit = lambda batch_i: worker_pool.apply_async(_prefetchbatch, (batch_i,))
+    else:
+        raise ValueError("pool must be 'thread' or 'process'.")
+    pending = deque() # bounded queue of batches being assembled, in order of consumption
+    try:
+        for batch_i in _batchindices(features, shuffle_order, batch_size, mode, data_split,
+                                     shuffle_function, shuffle_parameters, single_cycle, sort_batches):
+            pending.append(submit(batch_i))
+            if len(pending) > prefetch:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+    finally:
+        worker_pool.terminate()
\ No newline at end of file
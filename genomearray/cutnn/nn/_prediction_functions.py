@@ -1,6 +1,9 @@
+import time
 import numpy as np
 import genomearray as ga
+from genomearray.core.instrument import profiled
 
+@profiled(items='positions')
 def mappredictions(model, positions, features, genome_length):
     # use the model and features to generate predictions
     predictions = model.predict(np.asarray(features[0]))
@@ -10,8 +13,45 @@ def mappredictions(model, positions, features, genome_length):
     prediction_map[tuple(np.asarray(positions).T)] = positive_rate
     return prediction_map
 
+@profiled()
 def rawpredictions(model, features):
     # use the model and features to generate predictions
     predictions = model.predict(np.asarray(features[0]))
     positive_rate = predictions[:,1]
-    return positive_rate
\ No newline at end of file
+    return positive_rate
+
+@profiled(items='region_list')
+def streampredictions(model, region_list, sampling_step, ntfeatures_kwargs, genome_length,
+                      chunk_size=10000, out_path=None, dtype=np.float64, verbose=False):
+    """ Genome-scale equivalent of mappredictions which never holds more than chunk_size features.
+
+    Positions are sampled across each target region as in targetregionfeatures, features are
+    generated chunk_size positions at a time with ntfeatures and positive rates are written
+    straight into a preallocated (2, genome_length) map (np.nan where nothing was predicted). If
+    out_path is given, the map is a .npy memmap on disk rather than an in-memory array."""
+    if out_path is None:
+        prediction_map = np.zeros((2,genome_length), dtype=dtype) + np.nan
+    else:
+        prediction_map = np.lib.format.open_memmap(out_path, mode='w+', dtype=dtype, shape=(2,genome_length))
+        prediction_map[:] = np.nan
+    ntfeatures_kwargs = ntfeatures_kwargs.copy()
+    ntfeatures_kwargs['output_positions'] = True
+    n_predicted = 0
+    start_time = time.time()
+    for strand, left, right in region_list:
+        sample_bp_positions = np.arange(left, right, sampling_step)
+        for chunk_start in range(0, sample_bp_positions.shape[0], chunk_size):
+            chunk_bp_positions = sample_bp_positions[chunk_start:chunk_start+chunk_size]
+            chunk_positions = np.asarray([np.zeros(chunk_bp_positions.shape[0])+strand, chunk_bp_positions]).astype(int).T
+            features, included_positions = ga.cutnn.feat.ntfeatures(chunk_positions, **ntfeatures_kwargs)
+            if included_positions.shape[0] == 0:
+                continue
+            predictions = model.predict(np.asarray(features[0]))
+            prediction_map[tuple(included_positions.T)] = predictions[:,1]
+            n_predicted += included_positions.shape[0]
+    if out_path is not None:
+        prediction_map.flush()
+    if verbose == True:
+        elapsed = time.time() - start_time
+        print('predicted %i positions in %.1f s (%.0f positions / s).' % (n_predicted, elapsed, n_predicted / max(elapsed, 1e-9)))
+    return prediction_map
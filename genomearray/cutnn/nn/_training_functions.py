@@ -1,23 +1,29 @@
+import numpy as np
 import genomearray as ga
-from sklearn.metrics import roc_auc_score
+from genomearray.core.instrument import profiled
 
 
+@profiled()
 def fitmodel(model, features, shuffle_order, batch_size=100, max_epochs=100, data_split=(6,2,2),
-             keras_callbacks=None, verbose=True, save_path=None):
-    # make generators
-    trainiter = ga.cutnn.nn.batchiter(features, shuffle_order, data_split=data_split,
-                          batch_size=batch_size, mode='train', shuffle_function=ga.cutnn.nn.randshuffle)
-    validiter = ga.cutnn.nn.batchiter(features, shuffle_order, data_split=data_split,
-                          batch_size=batch_size, mode='validate')
-    testiter  = ga.cutnn.nn.batchiter(features, shuffle_order, data_split=data_split,
-                          batch_size=batch_size, mode='test')
-    # get step counts using the additional single_cycle arg
-    train_steps    = len(list(ga.cutnn.nn.batchiter(features, shuffle_order, data_split=data_split,
-                                              batch_size=batch_size, mode='train', single_cycle = True)))
-    validate_steps = len(list(ga.cutnn.nn.batchiter(features, shuffle_order, data_split=data_split,
-                                              batch_size=batch_size, mode='validate', single_cycle = True)))
-    test_steps     = len(list(ga.cutnn.nn.batchiter(features, shuffle_order, data_split=data_split,
-                                              batch_size=batch_size, mode='test', single_cycle = True)))
+             keras_callbacks=None, verbose=True, save_path=None, prefetch_kwargs=None):
+    # make generators, batches are assembled in the background if prefetch_kwargs are given
+    if prefetch_kwargs is None:
+        dataiter = ga.cutnn.nn.batchiter
+    else:
+        dataiter = lambda *args, **kwargs: ga.cutnn.nn.prefetchiter(*args, **dict(kwargs, **prefetch_kwargs))
+    # reads from an on-disk FeatureStore are kept sequential within each batch
+    sort_batches = isinstance(features, ga.cutnn.feat.FeatureStore)
+    trainiter = dataiter(features, shuffle_order, data_split=data_split, sort_batches=sort_batches,
+                         batch_size=batch_size, mode='train', shuffle_function=ga.cutnn.nn.randshuffle)
+    validiter = dataiter(features, shuffle_order, data_split=data_split, sort_batches=sort_batches,
+                         batch_size=batch_size, mode='validate')
+    testiter  = dataiter(features, shuffle_order, data_split=data_split, sort_batches=sort_batches,
+                         batch_size=batch_size, mode='test')
+    # get step counts from the size of each split (a single cycle yields only complete batches)
+    train_i, validate_i, test_i = ga.cutnn.nn.datasplitter(shuffle_order, data_split)
+    train_steps    = len(train_i) // batch_size
+    validate_steps = len(validate_i) // batch_size
+    test_steps     = len(test_i) // batch_size
     # fit the model
     model.fit_generator(trainiter, train_steps, epochs=max_epochs, verbose=verbose,
                         validation_data=validiter, validation_steps=validate_steps,
@@ -25,6 +31,9 @@ def fitmodel(model, features, shuffle_order, batch_size=100, max_epochs=100, dat
     # now load best model weights and run test data on it
     model.load_weights(save_path)
     y_predict = model.predict_generator(testiter, test_steps)
-    _, _, test_i = ga.cutnn.nn.datasplitter(shuffle_order, data_split)
-    y_true = features[1][test_i][:y_predict.shape[0]]
+    test_order = test_i[:test_steps*batch_size]
+    if sort_batches: # match the order in which sorted test batches were predicted
+        test_order = np.sort(test_order.reshape(test_steps, batch_size), axis=1).reshape(-1)
+    y_true = features[1][test_order][:y_predict.shape[0]]
+    from sklearn.metrics import roc_auc_score # imported on use, scikit-learn is slow to import
     return roc_auc_score(y_true, y_predict)
\ No newline at end of file
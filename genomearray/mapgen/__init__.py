@@ -1 +1 @@
-from _ntmap import mapfragdensity
\ No newline at end of file
+from _ntmap import mapfragdensity, addfragdensity, mapcohort
\ No newline at end of file
@@ -1,7 +1,11 @@
+import traceback
+import multiprocessing
 import numpy as np
 import pysam
+from genomearray.core.instrument import profiled
 
-def mapfragdensity(path_to_bam, min_mapq=2, refseq_index=0, dtype=np.uint32):
+@profiled()
+def mapfragdensity(path_to_bam, min_mapq=2, refseq_index=0, dtype=np.uint32, out=None):
     """ Given a paired-end, dUTP RNA-seq experiment, map fragment density at a single nt resolution.
 
         Function accepts an indexed bam file and uses pysam to iterate across all fragments. For
@@ -26,6 +30,10 @@ def mapfragdensity(path_to_bam, min_mapq=2, refseq_index=0, dtype=np.uint32):
         dtype : numpy data type, default np.uint32
             Data type of output numpy array.
 
+        out : None (default) or numpy array, shape (2, reference sequence length)
+            If given, counts are added to out (e.g. a view into a GenomeArray buffer) in place of
+            a newly allocated array, and out is returned. dtype is then ignored.
+
         Returns:
         ----------
         density_array : numpy array
@@ -38,7 +46,12 @@ def mapfragdensity(path_to_bam, min_mapq=2, refseq_index=0, dtype=np.uint32):
                 yield read
     # prepare the output array and load the experiment
     bam = pysam.Samfile(path_to_bam, "rb") # load the bam file
-    density_array = np.zeros((2,bam.lengths[refseq_index]), dtype)
+    if out is None:
+        density_array = np.zeros((2,bam.lengths[refseq_index]), dtype)
+    elif out.shape[:2] != (2,bam.lengths[refseq_index]):
+        raise ValueError('out must have shape (2, %i) for reference %s.' % (bam.lengths[refseq_index], bam.references[refseq_index]))
+    else:
+        density_array = out
     # load and filter the reads and add them to the density array
     filtered_reads = filterReads(bam.fetch(bam.references[refseq_index]))
     for read in filtered_reads:
@@ -46,4 +59,118 @@ def mapfragdensity(path_to_bam, min_mapq=2, refseq_index=0, dtype=np.uint32):
             density_array[1,read.pos:read.pos+np.abs(read.template_length)] += 1
         else: # maps to the plus strand
             density_array[0,read.pos:read.pos+np.abs(read.template_length)] += 1
-    return density_array
\ No newline at end of file
+    return density_array
+
+@profiled()
+def addfragdensity(path_to_bam, density_array, min_mapq=2, refseq_index=0):
+    """ Add the fragments of a new bam file (e.g. a top-up sequencing run) onto an existing fragment
+        density array, in place, as if mapfragdensity had been run over the merged bam file.
+
+        The reference sequence length must match density_array. For integer arrays, headroom is
+        checked before mapping: if the largest existing count plus the number of mapped reads on
+        the reference (an upper bound on the added depth) fits in the dtype, counts are added in
+        place directly; otherwise the new fragments are mapped into a separate int64 array and the
+        exact sum is checked.
+
+        Parameters:
+        ----------
+        path_to_bam : path to bam file (string)
+            Must be an indexed bam file.
+
+        density_array : numpy array, shape (2, reference sequence length)
+            Existing fragment density, e.g. from mapfragdensity or np.load(..., mmap_mode='r+').
+
+        min_mapq : mapping quality required for a read to be mapped (int), default 2
+
+        refseq_index : index of reference sequence (int), default 0
+
+        Returns:
+        ----------
+        density_array : numpy array
+            The input array, with the new fragment counts added.
+
+    """
+    bam = pysam.Samfile(path_to_bam, "rb")
+    reference, reference_len = bam.references[refseq_index], bam.lengths[refseq_index]
+    index_stats = dict((s.contig, s.mapped) for s in bam.get_index_statistics())
+    bam.close()
+    if density_array.shape[:2] != (2, reference_len):
+        raise ValueError('density_array must have shape (2, %i) for reference %s, got %s.' % (reference_len, reference, str(density_array.shape)))
+    if density_array.dtype.kind not in 'iu': # float arrays have no fixed headroom
+        return mapfragdensity(path_to_bam, min_mapq=min_mapq, refseq_index=refseq_index, out=density_array)
+    dtype_max = np.iinfo(density_array.dtype).max
+    existing_max = int(np.max(density_array)) if density_array.size > 0 else 0
+    if existing_max + index_stats.get(reference, 0) <= dtype_max:
+        return mapfragdensity(path_to_bam, min_mapq=min_mapq, refseq_index=refseq_index, out=density_array)
+    added = mapfragdensity(path_to_bam, min_mapq=min_mapq, refseq_index=refseq_index, dtype=np.int64)
+    if np.max(added + density_array) > dtype_max:
+        raise ValueError('adding %s overflows dtype %s of density_array, convert it to a wider dtype first.' % (path_to_bam, density_array.dtype))
+    density_array += added.astype(density_array.dtype)
+    return density_array
+
+
+def _mapsample(args):
+    # mapfragdensity of one sample in a worker process; exceptions are returned, not raised, so that
+    # one failing sample does not stop the cohort
+    path_to_bam, out_path, kwargs = args
+    try:
+        density_array = mapfragdensity(path_to_bam, **kwargs)
+        if out_path is None:
+            return True, density_array
+        np.save(out_path, density_array)
+        return True, out_path
+    except Exception:
+        return False, traceback.format_exc()
+
+@profiled(items='paths_to_bams')
+def mapcohort(paths_to_bams, out_paths=None, workers=None, min_mapq=2, refseq_index=0, dtype=np.uint32):
+    """ Map the fragment density (see mapfragdensity) of many bam files in a pool of processes.
+
+        Each sample is mapped in its own worker process (a new process per sample, so memory is
+        returned after every sample). A sample which raises is recorded in failures and does not
+        affect the other samples. If out_paths are given, each worker saves its density with
+        np.save, so arrays are not sent back to the calling process; the saved files can then be
+        loaded concurrently with loadarrays.
+
+        Parameters:
+        ----------
+        paths_to_bams : list of paths to bam files
+            Must be indexed bam files.
+
+        out_paths : None (default) or list of paths to .npy files, one per bam file
+            If given, densities are saved here rather than returned.
+
+        workers : None (default) or int
+            Number of worker processes. If None, the number of cpus.
+
+        min_mapq, refseq_index, dtype : see mapfragdensity
+
+        Returns:
+        ----------
+        results : list, one per bam file
+            Density array (or out path) of each sample, None for failed samples.
+
+        failures : dict
+            {path to bam : traceback string} of failed samples.
+
+    """
+    if out_paths is not None and len(out_paths) != len(paths_to_bams):
+        raise ValueError('one out path is required per bam file.')
+    kwargs = {'min_mapq' : min_mapq, 'refseq_index' : refseq_index, 'dtype' : dtype}
+    tasks = [(path, None if out_paths is None else out_paths[i], kwargs) for i, path in enumerate(paths_to_bams)]
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    if workers <= 1:
+        outcomes = [_mapsample(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(min(workers, len(tasks)), maxtasksperchild=1)
+        try:
+            outcomes = pool.map(_mapsample, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    results, failures = [], {}
+    for path, (succeeded, value) in zip(paths_to_bams, outcomes):
+        results.append(value if succeeded else None)
+        if not succeeded:
+            failures[path] = value
+    return results, failures
@@ -1,4 +1,6 @@
 import numpy as np
+from genomearray.core.instrument import profiled
+from genomearray.core.budget import withinbudget, requirebudget, budgetchunklen
 
 def _vectorslope(y_vectors):
     """ Accepts an array of arrays and calculates least squares slope. """
@@ -16,12 +18,28 @@ def _vectorrollingslope(input_array, n_positions):
     out = _vectorslope(np.asarray(rolled_array))[n_positions-1:]
     return out
 
+def _chunkedrollingslope(input_array, n_positions):
+    # _vectorrollingslope within the memory budget: slopes of each chunk are computed from the chunk
+    # plus a halo of the n_positions - 1 following positions, which gives identical values
+    bytes_per_position = 4*8*n_positions # rolled array and the temporaries of _vectorslope
+    if withinbudget(bytes_per_position*(input_array.shape[0] + n_positions)):
+        return _vectorrollingslope(input_array, n_positions)
+    chunk_len = budgetchunklen(bytes_per_position, halo=2*(n_positions-1), description='rollingslope chunk')
+    out = np.empty(input_array.shape[0])
+    for left in range(0, input_array.shape[0], chunk_len):
+        right = min(input_array.shape[0], left + chunk_len)
+        out[left:right] = _vectorrollingslope(input_array[left:right+n_positions-1], n_positions)[:right-left]
+    return out
+
+@profiled(items=lambda slopes: np.size(slopes))
 def rollingslope(input_array, slope_distance, slope_position):
     """ Returns the rolling least squares slope across the genome.
 
         The input_array is presumed to be shape (2, genome_length) and least squares slope is
         calculated across a distance of slope_distance. slope_position should be set to 5 or
         3, meaning slopes will stored to either the 5' or 3' end of the calculated region.
+        The rolled (slope_distance, genome_length) array is computed in chunks along the genome if
+        it exceeds the memory budget (see genomearray.setmemorybudget).
         
         Parameters:
         ----------
@@ -40,10 +58,11 @@ def rollingslope(input_array, slope_distance, slope_position):
             Slopes are stored at 5' or 3' ends of slope_distance. Positions for which slope
             could not be calculated are assigned np.nan as a placeholder to maintain input shape.
         """
-    # caculate slope for the positive strand
-    positive_slopes = _vectorrollingslope(input_array[0], slope_distance)
+    requirebudget(4*8*np.shape(input_array)[1], 'rollingslope output')
+    # caculate slope for the positive strand (in chunks if the rolled array exceeds the memory budget)
+    positive_slopes = _chunkedrollingslope(input_array[0], slope_distance)
     # calculate for the negative strand, reverse before calculation to preserve 5' -> 3' directionality
-    negative_slopes = _vectorrollingslope(np.flip(input_array[1],0), slope_distance)
+    negative_slopes = _chunkedrollingslope(np.flip(input_array[1],0), slope_distance)
     # if using a 3' slope, roll the array to account for this
     if slope_position == '3_prime':
         # positive_slopes = np.r_[np.zeros(slope_distance-1)+np.nan,positive_slopes[:-slope_distance+1]]
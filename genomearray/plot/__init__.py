@@ -1 +1,2 @@
-from _plotregion import RegionPlot, AlignmentPlot
\ No newline at end of file
+from _plotregion import RegionPlot, AlignmentPlot
+from _batch import rendergenes
\ No newline at end of file
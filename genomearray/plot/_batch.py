@@ -0,0 +1,140 @@
+import os
+import multiprocessing
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+import genomearray as ga
+from genomearray.core.instrument import profiled
+from _plotregion import RegionPlot
+
+# the spec of the running batch; set before the worker pool is forked so that workers inherit it
+# (and any in-memory arrays) without pickling
+_batch = {}
+
+def _opentrack(track):
+    # paths are opened read-only in each worker: .npy files memory-mapped, chunked stores and
+    # summary pyramids as their own objects; arrays are used as given
+    if not isinstance(track, str):
+        return track
+    if ga.ischunked(track):
+        return ga.ChunkedArray(track)
+    if track.endswith('.pyramid.npz'):
+        return ga.loadpyramid(track)
+    return np.load(track, mmap_mode='r')
+
+def _openspec(spec):
+    opened = dict(spec)
+    for key in ['tracks', 'regions', 'positions']:
+        opened[key] = [dict(item) for item in spec.get(key, [])]
+        for item in opened[key]:
+            for array_key in ['data', 'y_array', 'pyramid']:
+                if item.get(array_key) is not None:
+                    item[array_key] = _opentrack(item[array_key])
+    opened['motifs'] = [dict(item) for item in spec.get('motifs', [])]
+    for item in opened['motifs']:
+        if isinstance(item.get('motif_index'), str):
+            item['motif_index'] = ga.loadmotifindex(item['motif_index'])
+    return opened
+
+def _drawgene(region_plot, spec, gene):
+    region_plot.reset()
+    region_plot.setPosition_gene(gene, **spec.get('position', {}))
+    for item in spec['tracks']:
+        region_plot.plotLine(item['axis'], item['data'], pyramid=item.get('pyramid'), **item.get('kwargs', {}))
+    for item in spec['regions']:
+        region_plot.plotRegions(item['axis'], item['regions'], item['y_array'], pyramid=item.get('pyramid'),
+                                **item.get('kwargs', {}))
+    for item in spec['positions']:
+        region_plot.plotPositions(item['axis'], item['positions'], item['y_array'], **item.get('kwargs', {}))
+    for item in spec['motifs']:
+        region_plot.markSeq(item['motif'], None, motif_index=item['motif_index'], **item.get('kwargs', {}))
+    region_plot.ax_data[0][0].set_title(gene)
+
+def _renderchunk(task):
+    # render a list of genes with one reused RegionPlot on the headless Agg backend, to one pdf or
+    # to one png per gene; only run in a worker process, as switching the pyplot backend closes
+    # every open figure
+    genes, out_path = task
+    plt.switch_backend('agg')
+    spec = _openspec(_batch['spec'])
+    region_plot = RegionPlot(np.asarray(spec['gene_names']), np.asarray(spec['gene_regions']), spec['n_axes'],
+                             True, spec.get('figsize', (8, 2 + 2*spec['n_axes'])))
+    written = []
+    try:
+        if out_path.endswith('.pdf'):
+            with PdfPages(out_path) as pdf:
+                for gene in genes:
+                    _drawgene(region_plot, spec, gene)
+                    pdf.savefig(region_plot.figure)
+            written.append(out_path)
+        else:
+            for gene in genes:
+                _drawgene(region_plot, spec, gene)
+                written.append(os.path.join(out_path, '%s.png' % gene))
+                region_plot.figure.savefig(written[-1], dpi=spec.get('dpi', 100))
+    finally:
+        plt.close(region_plot.figure)
+    return written
+
+@profiled(items='genes')
+def rendergenes(genes, spec, out_path, workers=None):
+    """ Render one RegionPlot panel per gene, on a pool of processes using the headless Agg backend.
+
+        Genes are split into one contiguous chunk per worker. Rendering always runs in forked
+        worker processes (a single one if workers is 1), so the pyplot backend and open figures
+        of the calling process are left untouched. Each worker builds a single
+        RegionPlot and reuses its figure and axes for every gene of its chunk (see
+        RegionPlot.reset), and opens track paths itself (.npy files memory-mapped), so data is
+        neither copied nor pickled per worker.
+
+        Parameters:
+        ----------
+        genes : list of gene names (str)
+            Genes to render, in page order; each must be in spec['gene_names'].
+
+        spec : dict
+            Plot specification with keys
+                'gene_names', 'gene_regions', 'n_axes' : as RegionPlot
+                'figsize' : optional, as RegionPlot
+                'position' : optional kwargs of RegionPlot.setPosition_gene (spacer, addl_5, addl_3)
+                'tracks' : list of {'axis', 'data', 'pyramid' (optional), 'kwargs' (optional)} for plotLine
+                'regions' : list of {'axis', 'regions', 'y_array', 'kwargs'} for plotRegions
+                'positions' : list of {'axis', 'positions', 'y_array', 'kwargs'} for plotPositions
+                'motifs' : list of {'motif', 'motif_index', 'kwargs'} for markSeq with a ga.MotifIndex
+                'dpi' : optional, png resolution
+            data, y_array and pyramid entries may be arrays or paths (.npy, chunked store or
+            .pyramid.npz); motif_index may be a MotifIndex or a path saved with savemotifindex.
+
+        out_path : path (string)
+            If it ends with .pdf, a multi-page pdf; with several workers, one pdf per worker named
+            out_path with .part<i> inserted before .pdf. Otherwise a directory receiving <gene>.png.
+
+        workers : None (default) or int
+            Worker processes. If None, the number of cpus.
+
+        Returns:
+        ----------
+        written : list of paths
+            Files written, in gene order.
+
+    """
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    workers = max(1, min(workers, len(genes)))
+    if not out_path.endswith('.pdf') and not os.path.isdir(out_path):
+        os.makedirs(out_path)
+    chunks = [list(c) for c in np.array_split(np.asarray(genes, dtype=object), workers) if len(c) > 0]
+    if out_path.endswith('.pdf') and len(chunks) > 1:
+        chunk_paths = ['%s.part%i.pdf' % (out_path[:-4], i) for i in range(len(chunks))]
+    else:
+        chunk_paths = [out_path] * len(chunks)
+    _batch['spec'] = spec
+    try:
+        pool = multiprocessing.Pool(len(chunks))
+        try:
+            written = pool.map(_renderchunk, list(zip(chunks, chunk_paths)), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _batch.pop('spec', None)
+    return [path for chunk_written in written for path in chunk_written]
@@ -4,6 +4,7 @@ import matplotlib.gridspec as gridspec
 from matplotlib.patches import Polygon
 import seaborn as sns
 import regex
+import genomearray as ga
 
 params = {'xtick.labelsize':13,
           'ytick.labelsize':13,
@@ -92,7 +93,13 @@ class RegionPlot():
         self._drawgenes()
 
     
-    def plotLine(self, axis_n = None, data = None, **kwargs):
+    def plotLine(self, axis_n = None, data = None, pyramid = None, **kwargs):
+        # with a ga.SummaryPyramid of data, wide windows plot binned means with a min / max envelope
+        if pyramid is not None:
+            factor = pyramid.factorfor(self.gright - self.gleft + 1, self._pixelwidth(axis_n))
+            if factor is not None:
+                self._plotbinned(axis_n, pyramid, factor, **kwargs)
+                return
         if self.top_positive:
             self.ax_data[0][axis_n].plot(self.xpos, data[0,self.gleft:self.gright+1], **kwargs)
             self.ax_data[0][axis_n].set_xlim(self.xpos[0],self.xpos[-1])
@@ -105,7 +112,22 @@ class RegionPlot():
             if self.single_strand is False:
                 self.ax_data[1][axis_n].plot(self.xpos, flip(data[0,self.gleft:self.gright+1],0), **kwargs)
                 self.ax_data[1][axis_n].set_xlim(self.xpos[0],self.xpos[-1])
-    
+
+    def _plotbinned(self, axis_n, pyramid, factor, **kwargs):
+        strands = [0, 1] if self.top_positive else [1, 0]
+        for ax_i in ([0] if self.single_strand else [0, 1]):
+            bin_starts, means, factor = pyramid.query(strands[ax_i], self.gleft, self.gright, 'mean', factor)
+            mins = pyramid.query(strands[ax_i], self.gleft, self.gright, 'min', factor)[1]
+            maxs = pyramid.query(strands[ax_i], self.gleft, self.gright, 'max', factor)[1]
+            bin_x = self._getxpos(bin_starts + (factor - 1) / 2.)
+            line = self.ax_data[ax_i][axis_n].plot(bin_x, means, **kwargs)[0]
+            self.ax_data[ax_i][axis_n].fill_between(bin_x, mins, maxs, color=line.get_color(), edgecolor='none', alpha=0.25)
+            self.ax_data[ax_i][axis_n].set_xlim(self.xpos[0],self.xpos[-1])
+
+    def _pixelwidth(self, axis_n):
+        # width of a data axis in display pixels
+        return int(self.ax_data[0][axis_n].get_window_extent().width)
+
     def plotPositions(self, axis_n = None, positions = None, y_array = None, **kwargs):
         positions = positions[(positions[:,1] <= self.gright) & (positions[:,1] >= self.gleft)]
         position_tuple = tuple(np.asarray(positions).T)
@@ -136,9 +158,19 @@ class RegionPlot():
                 self.ax_data[1][axis_n].scatter(scatter_xpos, scatter_yval, **kwargs)
                 self.ax_data[1][axis_n].set_xlim(self.xpos[0],self.xpos[-1])
     
-    def plotRegions(self, axis_n = None, regions = None, y_array = None, **kwargs):
+    def plotRegions(self, axis_n = None, regions = None, y_array = None, pyramid = None, **kwargs):
         overlapping_regions = regions[(regions[:,1] <= self.gright) &
                                       (regions[:,2] >= self.gleft)]
+        # fill under the on strand track, from binned means of a ga.SummaryPyramid of y_array if wide
+        fill_strand = 0 if self.top_positive else 1
+        factor = None if pyramid is None else pyramid.factorfor(self.gright - self.gleft + 1, self._pixelwidth(axis_n))
+        if factor is not None:
+            bin_starts, fill_y, factor = pyramid.query(fill_strand, self.gleft, self.gright, 'mean', factor)
+            fill_x = self._getxpos(bin_starts + (factor - 1) / 2.)
+        elif self.top_positive:
+            fill_x, fill_y = self.xpos, y_array[0,self.gleft:self.gright+1]
+        else:
+            fill_x, fill_y = self.xpos, np.flip(y_array[1,self.gleft:self.gright+1],0)
         if self.top_positive:
             for region in overlapping_regions:
                 strand, left, right = region
@@ -155,9 +187,9 @@ class RegionPlot():
                                                    self.ax_data[0][axis_n].get_ylim()[1],**kwargs)
                     self.ax_data[0][axis_n].set_ylim(ylims)
                     # fill between
-                    self.ax_data[0][axis_n].fill_between(self.xpos,y_array[0,self.gleft:self.gright+1],ylims[1],
-                                                         where=(self.xpos>=self._getxpos(left))&
-                                                               (self.xpos<=self._getxpos(right)),
+                    self.ax_data[0][axis_n].fill_between(fill_x,fill_y,ylims[1],
+                                                         where=(fill_x>=self._getxpos(left))&
+                                                               (fill_x<=self._getxpos(right)),
                                                          edgecolor='none',alpha=0.25,**kwargs)
                 if (strand == 1) and (self.single_strand == False):
                     pass # not implemented yet
@@ -177,20 +209,25 @@ class RegionPlot():
                                                    self.ax_data[0][axis_n].get_ylim()[1],**kwargs)
                     self.ax_data[0][axis_n].set_ylim(ylims)
                     # fill between
-                    self.ax_data[0][axis_n].fill_between(self.xpos,np.flip(y_array[1,self.gleft:self.gright+1],0),ylims[1],
-                                                         where=(self.xpos>=self._getxpos(left))&
-                                                               (self.xpos<=self._getxpos(right)),
+                    self.ax_data[0][axis_n].fill_between(fill_x,fill_y,ylims[1],
+                                                         where=(fill_x>=self._getxpos(left))&
+                                                               (fill_x<=self._getxpos(right)),
                                                          edgecolor='none',alpha=0.25,**kwargs)
                 if (strand == 1) and (self.single_strand == False):
                     pass # not implemented yet
 
-    def markSeq(self, regex_string, genome, offset=0, arrowprops=dict(arrowstyle='-|>',color='r',lw=0)):
-        forward = str(genome.seq[self.gleft:self.gright+1])
-        reverse = str(genome.seq[self.gleft:self.gright+1].reverse_complement())
-        # find instances in the forward direction (genomic coordinates)
-        fwd_marks = np.asarray([m.start() for m in regex.finditer(regex_string,forward,overlapped=True)])+self.gleft
-        # find instances in the reverse direction (genomic coordinates)
-        rev_marks = -1*np.asarray([m.start() for m in regex.finditer(regex_string,reverse,overlapped=True)])+self.gright
+    def markSeq(self, regex_string, genome, offset=0, arrowprops=dict(arrowstyle='-|>',color='r',lw=0), motif_index=None):
+        if motif_index is not None: # look up motif (IUPAC string, not a regex) in a prebuilt ga.MotifIndex
+            hits = ga.findmotif(motif_index, regex_string, self.gleft, self.gright)
+            fwd_marks = hits[hits[:,0] == 0,1]
+            rev_marks = hits[hits[:,0] == 1,1]
+        else:
+            forward = str(genome.seq[self.gleft:self.gright+1])
+            reverse = str(genome.seq[self.gleft:self.gright+1].reverse_complement())
+            # find instances in the forward direction (genomic coordinates)
+            fwd_marks = np.asarray([m.start() for m in regex.finditer(regex_string,forward,overlapped=True)])+self.gleft
+            # find instances in the reverse direction (genomic coordinates)
+            rev_marks = -1*np.asarray([m.start() for m in regex.finditer(regex_string,reverse,overlapped=True)])+self.gright
         # draw annotations
         if self.top_positive:
             for mark in fwd_marks:
@@ -202,6 +239,16 @@ class RegionPlot():
                 self.ax_gene[0].annotate('',[mark_x,.8],[mark_x,.7],arrowprops=arrowprops)
 
     
+    def reset(self):
+        # remove everything drawn on the axes (lines, fills, genes, marks) while keeping the figure,
+        # axes and their formatting, so one RegionPlot can be reused for many genes
+        for ax in self.ax_data[0] + self.ax_data[1] + self.ax_gene:
+            for artist in ax.lines[:] + ax.collections[:] + ax.patches[:] + ax.texts[:] + ax.artists[:]:
+                artist.remove()
+            ax.relim()
+            ax.set_autoscaley_on(True)
+        self.top_positive = None
+
     def _drawgenes(self):
         overlapping_regions = self.gene_regions[(self.gene_regions[:,1] <= self.gright) &
                                                 (self.gene_regions[:,2] >= self.gleft)]
@@ -1,7 +1,9 @@
 import numpy as np
 import pysam
+from genomearray.core.instrument import profiled
 
 
+@profiled(items=lambda counts: len(counts[3]))
 def mapregioncounts(path_to_bam, regions, mapq_cutoff=2, refseq_index=0):
     # regions must be in form [[strand, left, right], ....]
     # define a filter to only consider half of reads (left-most read)
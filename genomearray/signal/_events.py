@@ -3,7 +3,9 @@ from scipy.signal import argrelmax
 from scipy.signal import argrelmin
 from scipy.ndimage.filters import gaussian_filter1d
 import genomearray as ga
+from genomearray.core.instrument import profiled
 
+@profiled()
 def extrema(input_array, extrema_type = 'min', output_mask = None, smooth_sigma = None, search_nt = None):
     """ Detects and returns extrema positions in genome-shaped arrays.
 
@@ -72,6 +74,7 @@ def extrema(input_array, extrema_type = 'min', output_mask = None, smooth_sigma
         values = values[output_mask[tuple(extrema_pos)]]
     return positions, values
 
+@profiled(items='primary_pos')
 def eventdpos(primary_pos, secondary_pos, maximum_distance, direction='5_prime', collapse_regions=True):
     """ Finds regions based on primary_pos and secondary_pos arrays.
 
@@ -136,6 +139,7 @@ def eventdpos(primary_pos, secondary_pos, maximum_distance, direction='5_prime',
 
 
 
+@profiled(items='position_array')
 def eventdyperx(input_array, position_array, dy, maximum_distance, collapse_regions=True, return_positions=False):
     """ Finds regions based on shape of a peak or valley surrounding user-provided positions.
 
@@ -1,6 +1,8 @@
 import numpy as np
 import genomearray as ga
+from genomearray.core.instrument import profiled
 
+@profiled()
 def flatregions(input_array, slope_distance, slope_position, 
                 array_mask = None, lower_percentile = None, upper_percentile = None):
     """ Finds regions on an input_array with a relatively flat slope.
@@ -0,0 +1 @@
+from _synthetic import randomgenome, generegions, coveragetrack, fragmentbam
\ No newline at end of file
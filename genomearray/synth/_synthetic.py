@@ -0,0 +1,307 @@
+import os
+import numpy as np
+import pysam
+from scipy.ndimage.filters import gaussian_filter1d
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+# nucleotide codes follow the one-hot channel order (A,T,G,C), so complement(code) == code ^ 1
+_NT_BYTES = np.frombuffer(b'ATGC', dtype=np.uint8)
+
+def randomgenome(genome_len, gc_content=0.5, gc_amplitude=0., gc_period=100000, random_seed=None,
+                 record_id='synthetic', onehot=False):
+    """ Generates a seeded random genome, optionally with regionally varying GC content.
+
+        Nucleotides are drawn independently at every position: G or C with probability equal to the
+        local GC content, A or T otherwise. GC bias along the genome is introduced either by passing
+        a per-position GC content or by a sinusoidal variation of gc_amplitude around gc_content.
+
+        Parameters:
+        ----------
+        genome_len : int
+            Length of the generated genome.
+
+        gc_content : float or array-like of float, shape (genome_len,), 0.5 (default)
+            Mean (or per-position) probability of a G or C nucleotide.
+
+        gc_amplitude : float, 0. (default)
+            Amplitude of the sinusoidal variation of GC content along the genome.
+
+        gc_period : int, 100000 (default)
+            Period (nt) of the GC content variation.
+
+        random_seed : None (default) or int
+            Seed of the random state, identical seeds give identical genomes.
+
+        record_id : string, 'synthetic' (default)
+            id of the returned SeqRecord, used as reference name by fragmentbam.
+
+        onehot : False (default) or True
+            If True, the one-hot representation (as made by genometoonehot) is also returned. It is
+            built directly from the nucleotide codes rather than by parsing the sequence.
+
+        Returns:
+        ----------
+        genome : Bio SeqRecord
+            The generated genome.
+
+        genome_onehot : numpy array, shape (2, genome_len, 4)
+            Only returned if onehot is True.
+    """
+    random_state = np.random.RandomState(random_seed)
+    gc_content = np.asarray(gc_content, dtype=float)
+    if gc_amplitude != 0:
+        phase = random_state.uniform(0, 2*np.pi)
+        gc_content = gc_content + gc_amplitude*np.sin(2*np.pi*np.arange(genome_len)/float(gc_period) + phase)
+    gc_content = np.clip(gc_content, 0, 1)
+    is_gc = random_state.random_sample(genome_len) < gc_content
+    # A,T -> 0,1 and G,C -> 2,3
+    nt_codes = (2*is_gc + random_state.randint(0, 2, genome_len)).astype(np.uint8)
+    sequence = str(_NT_BYTES[nt_codes].tobytes().decode('ascii'))
+    genome = SeqRecord(Seq(sequence), id=record_id, name=record_id, description='synthetic genome')
+    if not onehot:
+        return genome
+    identity = np.eye(4, dtype=np.uint8)
+    # the second strand holds the complement of each position, read in genome orientation
+    return genome, np.asarray([identity[nt_codes], identity[nt_codes ^ 1]])
+
+def generegions(genome_len, n_genes, min_len=300, max_len=3000, random_seed=None):
+    """ Generates a table of non-overlapping gene regions on random strands.
+
+        Parameters:
+        ----------
+        genome_len : int
+            Length of the genome the genes are placed on.
+
+        n_genes : int
+            Number of genes.
+
+        min_len, max_len : int, 300 and 3000 (default)
+            Gene lengths are drawn uniformly from [min_len, max_len].
+
+        random_seed : None (default) or int
+            Seed of the random state.
+
+        Returns:
+        ----------
+        gene_names : list of strings
+            Gene names, in order of genomic position.
+
+        gene_regions : numpy array, shape (n_genes, 3)
+            [strand, left, right] (inclusive) of each gene, sorted by left position as expected by
+            mapregioncounts.
+    """
+    random_state = np.random.RandomState(random_seed)
+    lengths = random_state.randint(min_len, max_len+1, n_genes)
+    spare_nt = genome_len - np.sum(lengths)
+    if spare_nt < 0:
+        raise ValueError('%i genes of length %i-%i do not fit in the genome.' % (n_genes, min_len, max_len))
+    # split the spare nt into n_genes + 1 random intergenic gaps
+    gap_ends = np.sort(random_state.randint(0, spare_nt+1, n_genes))
+    lefts = gap_ends + np.r_[0, np.cumsum(lengths)[:-1]]
+    gene_regions = np.asarray([random_state.randint(0, 2, n_genes), lefts, lefts + lengths - 1]).T
+    gene_names = ['syn%05i' % i for i in range(n_genes)]
+    return gene_names, gene_regions
+
+def coveragetrack(genome_len, gene_regions=None, expression=None, background=1., n_peaks=100,
+                  n_valleys=100, event_width=5., random_seed=None, poisson=True):
+    """ Generates a genome-shaped coverage track with gene expression, peaks and valleys.
+
+        Coverage is the sum of a uniform background and a per-gene expression level on each gene's
+        strand. Peaks are added as gaussian bumps and valleys (e.g. cleavage sites) are cut into the
+        coverage as gaussian dips, at random positions. Counts are then optionally drawn from a
+        poisson distribution around the coverage.
+
+        Parameters:
+        ----------
+        genome_len : int
+            Length of the genome.
+
+        gene_regions : None (default) or array-like, shape (n genes, 3)
+            [strand, left, right] (inclusive) of expressed regions, e.g. from generegions.
+
+        expression : None (default) or array-like of float, shape (n genes,)
+            Mean coverage of each gene. If None, drawn from a lognormal distribution.
+
+        background : float, 1. (default)
+            Coverage outside of (and added to) genes.
+
+        n_peaks, n_valleys : int, 100 (default)
+            Number of peaks and valleys, split randomly between strands.
+
+        event_width : float, 5. (default)
+            Gaussian sigma (nt) of peaks and valleys.
+
+        random_seed : None (default) or int
+            Seed of the random state.
+
+        poisson : True (default) or False
+            If True, the returned track holds poisson counts, otherwise the expected coverage.
+
+        Returns:
+        ----------
+        track : numpy array, shape (2, genome_len)
+            Coverage track.
+
+        peak_positions : numpy array, shape (n_peaks, 2)
+            [strand, position] of each peak center.
+
+        valley_positions : numpy array, shape (n_valleys, 2)
+            [strand, position] of each valley center.
+    """
+    random_state = np.random.RandomState(random_seed)
+    # step changes at gene edges, integrated once with cumsum
+    steps = np.zeros((2, genome_len+1))
+    if gene_regions is not None and len(gene_regions) > 0:
+        gene_regions = np.asarray(gene_regions)
+        if expression is None:
+            expression = random_state.lognormal(2, 1, gene_regions.shape[0])
+        np.add.at(steps, (gene_regions[:,0], gene_regions[:,1]), expression)
+        np.add.at(steps, (gene_regions[:,0], gene_regions[:,2]+1), -np.asarray(expression))
+    coverage = background + np.cumsum(steps, axis=1)[:,:-1]
+    def eventpositions(n_events):
+        return np.asarray([random_state.randint(0, 2, n_events),
+                           random_state.randint(0, genome_len, n_events)]).T.reshape(-1,2)
+    def eventshape(positions):
+        # gaussians of unit height at each position
+        impulses = np.zeros((2, genome_len))
+        np.add.at(impulses, (positions[:,0], positions[:,1]), 1)
+        return gaussian_filter1d(impulses, event_width, axis=1) * np.sqrt(2*np.pi) * event_width
+    peak_positions, valley_positions = eventpositions(n_peaks), eventpositions(n_valleys)
+    # peak heights scale with the local coverage, valleys remove up to 90% of it
+    coverage += eventshape(peak_positions) * random_state.uniform(2, 10) * np.median(coverage)
+    coverage *= 1 - 0.9*np.clip(eventshape(valley_positions), 0, 1)
+    if poisson:
+        return random_state.poisson(coverage), peak_positions, valley_positions
+    return coverage, peak_positions, valley_positions
+
+def _samfragments(fragments, reference_names, read_len, mapq, first_id):
+    # two SAM lines per fragment; the left read points forward and is read1 for second strand
+    # fragments (dUTP libraries), the right read is reverse and carries the negative template length
+    ref_i, strand, left, frag_len = fragments.T
+    right_pos = left + frag_len - read_len
+    left_flags = np.where(strand == 1, 99, 163)
+    right_flags = np.where(strand == 1, 147, 83)
+    cigar = '%iM' % read_len
+    lines = []
+    for i in range(fragments.shape[0]):
+        name, ref = 'f%i' % (first_id + i), reference_names[ref_i[i]]
+        lines.append('%s\t%i\t%s\t%i\t%i\t%s\t=\t%i\t%i\t*\t*\n' % (name, left_flags[i], ref, left[i]+1, mapq,
+                     cigar, right_pos[i]+1, frag_len[i]))
+        lines.append('%s\t%i\t%s\t%i\t%i\t%s\t=\t%i\t%i\t*\t*\n' % (name, right_flags[i], ref, right_pos[i]+1, mapq,
+                     cigar, left[i]+1, -frag_len[i]))
+    return ''.join(lines)
+
+def fragmentbam(path, genome, n_fragments, gene_regions=None, expression=None, gene_fraction=0.9,
+                read_len=50, frag_mean=200, frag_sd=50, mapq=42, random_seed=None, chunk_size=1000000,
+                return_fragments=False):
+    """ Writes a sorted, indexed, paired-end dUTP RNA-seq bam file of synthetic fragments.
+
+        Fragments are written as proper read pairs in the orientation read by mapfragdensity,
+        mapregioncounts and countnormalization: the forward (left) read is read1 for fragments on
+        the second strand and read2 for fragments on the first strand. Fragments are generated and
+        written as uncompressed SAM in chunks of chunk_size, so memory stays bounded for tens of
+        millions of fragments, then sorted and indexed with pysam (samtools). Reads have no
+        sequence or qualities.
+
+        Parameters:
+        ----------
+        path : path to output bam file (string)
+            A temporary SAM file is written next to it and removed once sorted.
+
+        genome : Bio SeqRecord, int, or list of these
+            Reference sequence(s). Integers are taken as reference lengths and named 'chr%i'.
+
+        n_fragments : int
+            Total number of fragments written.
+
+        gene_regions : None (default) or array-like, shape (n genes, 3)
+            Regions of the first reference from which gene_fraction of fragments are sampled, on the
+            gene strand. The remaining fragments are placed uniformly on all references and strands.
+
+        expression : None (default) or array-like of float, shape (n genes,)
+            Relative expression of each gene. If None, drawn from a lognormal distribution.
+
+        gene_fraction : float, 0.9 (default)
+            Fraction of fragments sampled from genes, ignored if gene_regions is None.
+
+        read_len : int, 50 (default)
+            Length of each read. Fragments are at least read_len long.
+
+        frag_mean, frag_sd : float, 200 and 50 (default)
+            Mean and standard deviation of fragment lengths.
+
+        mapq : int, 42 (default)
+            Mapping quality of all reads.
+
+        random_seed : None (default) or int
+            Seed of the random state.
+
+        chunk_size : int, 1000000 (default)
+            Number of fragments generated and formatted at once.
+
+        return_fragments : False (default) or True
+            If True, the [reference index, strand, left, right] (inclusive) of every fragment are
+            returned, e.g. to check mapped densities. Only sensible for small n_fragments.
+
+        Returns:
+        ----------
+        path : string
+            Path of the indexed bam file.
+
+        fragments : numpy array, shape (n_fragments, 4)
+            Only returned if return_fragments is True.
+    """
+    random_state = np.random.RandomState(random_seed)
+    if not isinstance(genome, (list, tuple)):
+        genome = [genome]
+    reference_names, reference_lengths = [], []
+    for ref_i, reference in enumerate(genome):
+        if isinstance(reference, (int, np.integer)):
+            reference_names.append('chr%i' % ref_i)
+            reference_lengths.append(int(reference))
+        else:
+            reference_names.append(reference.id)
+            reference_lengths.append(len(reference))
+    reference_lengths = np.asarray(reference_lengths, dtype=np.int64)
+    if gene_regions is not None:
+        gene_regions = np.asarray(gene_regions)
+        if expression is None:
+            expression = random_state.lognormal(0, 1, gene_regions.shape[0])
+        gene_p = np.asarray(expression, dtype=float) * (gene_regions[:,2] - gene_regions[:,1] + 1)
+        gene_p /= np.sum(gene_p)
+    else:
+        gene_fraction = 0
+    sam_path = path + '.unsorted.sam'
+    all_fragments = []
+    with open(sam_path, 'w') as f:
+        f.write('@HD\tVN:1.6\tSO:unsorted\n')
+        for name, length in zip(reference_names, reference_lengths):
+            f.write('@SQ\tSN:%s\tLN:%i\n' % (name, length))
+        for first_id in range(0, n_fragments, chunk_size):
+            n_chunk = min(chunk_size, n_fragments - first_id)
+            frag_len = np.maximum(read_len, np.round(random_state.normal(frag_mean, frag_sd, n_chunk))).astype(np.int64)
+            # background fragments: reference proportional to length, uniform center and strand
+            ref_i = random_state.choice(len(reference_lengths), n_chunk, p=reference_lengths/float(np.sum(reference_lengths)))
+            strand = random_state.randint(0, 2, n_chunk)
+            center = (random_state.random_sample(n_chunk) * reference_lengths[ref_i]).astype(np.int64)
+            # gene fragments: gene by expression * length, uniform center within the gene
+            from_gene = random_state.random_sample(n_chunk) < gene_fraction
+            if np.any(from_gene):
+                gene_i = random_state.choice(gene_regions.shape[0], np.sum(from_gene), p=gene_p)
+                ref_i[from_gene] = 0
+                strand[from_gene] = gene_regions[gene_i,0]
+                gene_len = gene_regions[gene_i,2] - gene_regions[gene_i,1] + 1
+                center[from_gene] = gene_regions[gene_i,1] + (random_state.random_sample(gene_i.shape[0])*gene_len).astype(np.int64)
+            frag_len = np.minimum(frag_len, reference_lengths[ref_i])
+            left = np.clip(center - frag_len//2, 0, reference_lengths[ref_i] - frag_len)
+            fragments = np.asarray([ref_i, strand, left, frag_len]).T
+            f.write(_samfragments(fragments, reference_names, read_len, mapq, first_id))
+            if return_fragments:
+                all_fragments.append(np.asarray([ref_i, strand, left, left + frag_len - 1]).T)
+    pysam.sort('-o', path, sam_path)
+    pysam.index(path)
+    os.remove(sam_path)
+    if return_fragments:
+        return path, np.concatenate(all_fragments, 0) if len(all_fragments) > 0 else np.empty((0,4), dtype=int)
+    return path
@@ -0,0 +1,307 @@
+# genome-scale benchmarks of genomearray hot paths, run as a script:
+#   python benchmarks.py --scale 1 --out results.json
+#   python benchmarks.py --compare old_results.json new_results.json
+# each benchmark runs in its own forked process so that peak memory is measured independently
+import sys, os
+import json
+import time
+import argparse
+import shutil
+import tempfile
+import platform
+import subprocess
+import resource
+import multiprocessing
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import genomearray as ga
+
+GENOME_LEN  = 4600000  # E. coli sized genome
+N_REGIONS   = 100000
+N_FRAGMENTS = 10000000 # paired-end fragments in the synthetic bam
+
+BENCHMARKS = [] # (name, setup function) pairs, filled by the benchmark decorator
+
+def benchmark(name):
+    """ Register a benchmark. The decorated function takes scale and returns (run, n_items), where
+        run is a callable timed without arguments and n_items the number of items it processes, or
+        (run, n_items, cleanup) with cleanup called without arguments once timing is done (e.g. to
+        remove temporary files written by the setup). """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+def _warmup(function, *args, **kwargs):
+    # one small untimed call made by setups, so that lazily loaded submodules (see genomearray
+    # _LazyModule) and modules imported on use (e.g. scipy.signal) are not counted in the time and
+    # peak RSS of the timed call
+    function(*args, **kwargs)
+
+def _randomtrack(genome_len, random_state):
+    # smooth positive coverage-like track with peaks and valleys
+    steps = random_state.normal(0, 1, (2, genome_len))
+    return np.abs(np.cumsum(steps, axis=1)) + 1
+
+def _randomregions(n_regions, genome_len, random_state, max_len=1000):
+    lefts = random_state.randint(0, genome_len - max_len, n_regions)
+    return np.asarray([random_state.randint(0, 2, n_regions), lefts,
+                       lefts + random_state.randint(1, max_len, n_regions)]).T
+
+def _randompositions(n_positions, genome_len, random_state, buffer_nt=1000):
+    return np.asarray([random_state.randint(0, 2, n_positions),
+                       random_state.randint(buffer_nt, genome_len - buffer_nt, n_positions)]).T
+
+@benchmark('import')
+def _import(scale):
+    # import time of the package in a fresh interpreter, as paid by each short-lived worker
+    package_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    return (lambda: subprocess.check_call([sys.executable, '-c', 'import genomearray'], env=env)), 1
+
+@benchmark('regionfunc')
+def _regionfunc(scale):
+    rs = np.random.RandomState(0)
+    track = _randomtrack(int(GENOME_LEN*scale), rs)
+    regions = _randomregions(int(N_REGIONS*scale), track.shape[1], rs)
+    _warmup(ga.regionfunc, np.sum, regions[:10], track)
+    return (lambda: ga.regionfunc(np.sum, regions, track)), regions.shape[0]
+
+@benchmark('rollingslope')
+def _rollingslope(scale):
+    track = _randomtrack(int(GENOME_LEN*scale), np.random.RandomState(0))
+    _warmup(ga.ntmath.rollingslope, track[:,:1000], 20, '5_prime')
+    return (lambda: ga.ntmath.rollingslope(track, 20, '5_prime')), track.size
+
+@benchmark('extrema')
+def _extrema(scale):
+    track = _randomtrack(int(GENOME_LEN*scale), np.random.RandomState(0))
+    _warmup(ga.signal.extrema, track[:,:1000], 'min', smooth_sigma=5, search_nt=5)
+    return (lambda: ga.signal.extrema(track, 'min', smooth_sigma=5, search_nt=5)), track.size
+
+@benchmark('eventdpos')
+def _eventdpos(scale):
+    rs = np.random.RandomState(0)
+    primary = _randompositions(int(N_REGIONS*scale) // 10, int(GENOME_LEN*scale), rs)
+    secondary = _randompositions(int(N_REGIONS*scale), int(GENOME_LEN*scale), rs)
+    _warmup(ga.signal.eventdpos, primary[:5], secondary[:50], 50)
+    return (lambda: ga.signal.eventdpos(primary, secondary, 50)), primary.shape[0]
+
+@benchmark('eventdyperx')
+def _eventdyperx(scale):
+    rs = np.random.RandomState(0)
+    track = _randomtrack(int(GENOME_LEN*scale), rs)
+    positions = _randompositions(int(N_REGIONS*scale), track.shape[1], rs)
+    _warmup(ga.signal.eventdyperx, track, positions[:5], (2,2), (50,50))
+    return (lambda: ga.signal.eventdyperx(track, positions, (2,2), (50,50))), positions.shape[0]
+
+@benchmark('concatregions')
+def _concatregions(scale):
+    regions = _randomregions(int(N_REGIONS*scale), int(GENOME_LEN*scale), np.random.RandomState(0))
+    _warmup(ga.concatregions, regions[:10].copy())
+    return (lambda: ga.concatregions(regions.copy())), regions.shape[0]
+
+@benchmark('regionstomask')
+def _regionstomask(scale):
+    regions = _randomregions(int(N_REGIONS*scale), int(GENOME_LEN*scale), np.random.RandomState(0))
+    _warmup(ga.regionstomask, regions[:10], int(GENOME_LEN*scale))
+    return (lambda: ga.regionstomask(regions, int(GENOME_LEN*scale))), regions.shape[0]
+
+@benchmark('masktoregions')
+def _masktoregions(scale):
+    rs = np.random.RandomState(0)
+    mask = ga.regionstomask(_randomregions(int(N_REGIONS*scale), int(GENOME_LEN*scale), rs), int(GENOME_LEN*scale))
+    _warmup(ga.masktoregions, mask[:,:1000])
+    return (lambda: ga.masktoregions(mask)), mask.size
+
+@benchmark('randomregionsampler')
+def _randomregionsampler(scale):
+    rs = np.random.RandomState(0)
+    genome_len = int(GENOME_LEN*scale)
+    negative_mask = ga.regionstomask(_randomregions(int(N_REGIONS*scale) // 10, genome_len, rs), genome_len)
+    positives = _randompositions(int(N_REGIONS*scale) // 100, genome_len, rs)
+    n_samples = max(1, int(N_REGIONS*scale) // 100)
+    _warmup(ga.cutnn.feat.randomregionsampler, negative_mask, positives[:5], n_samples=1, buffer_size=50)
+    np.random.seed(0) # the sampler draws from the global random state
+    return (lambda: ga.cutnn.feat.randomregionsampler(negative_mask, positives, n_samples=n_samples,
+                                                      buffer_size=50)), n_samples
+
+@benchmark('ntfeatures')
+def _ntfeatures(scale):
+    rs = np.random.RandomState(0)
+    genome_len = int(GENOME_LEN*scale)
+    genome = ga.synth.randomgenome(genome_len, random_seed=0)
+    # non-overlapping gene regions tiling the genome
+    gene_lefts = np.arange(0, genome_len - 1000, 1000)
+    regions = np.asarray([gene_lefts // 1000 % 2, gene_lefts, gene_lefts + 899]).T
+    positions = _randompositions(int(N_REGIONS*scale) // 10, genome_len, rs)
+    kwargs = {'regions' : regions, 'genome' : genome, 'array_types' : ['centered'],
+              'offset_terms' : [(-50,50)], 'additional_data_arrays' : [_randomtrack(genome_len, rs)]}
+    _warmup(ga.cutnn.feat.ntfeatures, positions[:5], **kwargs)
+    return (lambda: ga.cutnn.feat.ntfeatures(positions, **kwargs)), positions.shape[0]
+
+@benchmark('getGenomeConvolution')
+def _getgenomeconvolution(scale):
+    rs = np.random.RandomState(0)
+    genome_len = int(GENOME_LEN*scale)
+    onehot = np.eye(4, dtype=np.uint8)[rs.randint(0, 4, (2, genome_len))]
+    pwm = rs.normal(0, 1, (4, 12))
+    _warmup(ga.getGenomeConvolution, onehot[:,:1000], pwm)
+    return (lambda: ga.getGenomeConvolution(onehot, pwm)), genome_len
+
+@benchmark('mediandensitynormalization')
+def _mediandensitynormalization(scale):
+    rs = np.random.RandomState(0)
+    samples = np.asarray([_randomtrack(int(GENOME_LEN*scale), rs) for i in range(4)])
+    regions = _randomregions(int(N_REGIONS*scale) // 25, samples.shape[2], rs)
+    _warmup(ga.mediandensitynormalization, samples[:,:,:2000], regions=_randomregions(5, 2000, rs, max_len=100), log2=True)
+    return (lambda: ga.mediandensitynormalization(samples, regions=regions, log2=True)), samples.size
+
+@benchmark('regionsumnormalization')
+def _regionsumnormalization(scale):
+    rs = np.random.RandomState(0)
+    samples = np.asarray([_randomtrack(int(GENOME_LEN*scale), rs) for i in range(4)])
+    regions = _randomregions(int(N_REGIONS*scale) // 25, samples.shape[2], rs)
+    _warmup(ga.core.saveload.regionsumnormalization, samples[:,:,:2000], regions=_randomregions(5, 2000, rs, max_len=100),
+            log2=True)
+    return (lambda: ga.core.saveload.regionsumnormalization(samples, regions=regions, log2=True)), samples.size
+
+@benchmark('countnormalization')
+def _countnormalization(scale):
+    rs = np.random.RandomState(0)
+    genome_len = int(GENOME_LEN*scale)
+    samples = np.asarray([_randomtrack(genome_len, rs) for i in range(4)])
+    # small synthetic bams (untimed), only their mapped read counts are used
+    bam_dir = tempfile.mkdtemp()
+    try:
+        bam_paths = [ga.synth.fragmentbam(os.path.join(bam_dir, 'sample%i.bam' % i), genome_len, 10000*(i + 1),
+                                          random_seed=i) for i in range(4)]
+    except Exception:
+        shutil.rmtree(bam_dir)
+        raise
+    _warmup(ga.countnormalization, samples[:,:,:1000], paths_to_bams=bam_paths, log2=True)
+    return ((lambda: ga.countnormalization(samples, paths_to_bams=bam_paths, log2=True)), samples.size,
+            (lambda: shutil.rmtree(bam_dir)))
+
+@benchmark('mapfragdensity')
+def _mapfragdensity(scale):
+    ga.mapgen.mapfragdensity # loads the submodule (and pysam) untimed
+    if BAM_PATH is not None:
+        return (lambda: ga.mapgen.mapfragdensity(BAM_PATH)), None
+    # no bam given, generate a synthetic one (untimed) with expressed genes
+    genome_len = int(GENOME_LEN*scale)
+    names, regions = ga.synth.generegions(genome_len, genome_len // 2000, random_seed=0)
+    bam_dir = tempfile.mkdtemp()
+    bam_path = os.path.join(bam_dir, 'synthetic.bam')
+    n_fragments = int(N_FRAGMENTS*scale)
+    try:
+        ga.synth.fragmentbam(bam_path, genome_len, n_fragments, gene_regions=regions, random_seed=0)
+    except Exception:
+        shutil.rmtree(bam_dir)
+        raise
+    return (lambda: ga.mapgen.mapfragdensity(bam_path)), n_fragments, (lambda: shutil.rmtree(bam_dir))
+
+BAM_PATH = None
+
+def _rssmb():
+    # (current, peak) RSS in MB, from /proc on linux; elsewhere only the peak is known and is used for both
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if line.startswith('Vm'))
+        return int(status['VmRSS'].split()[0]) / 1024., int(status['VmHWM'].split()[0]) / 1024.
+    # ru_maxrss is reported in kB on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.**2 if sys.platform == 'darwin' else 1024.)
+    return peak, peak
+
+def _resetpeakrss():
+    # on linux 4.0+ the peak RSS (VmHWM) is reset to the current RSS, so that setup allocations are not
+    # counted in the peak of the timed calls; elsewhere the peak is only measured above the setup peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+def _runone(setup, scale, repeats, result_queue):
+    try:
+        setup_output = setup(scale)
+        run, n_items = setup_output[:2]
+        cleanup = setup_output[2] if len(setup_output) > 2 else None
+        if run is None:
+            result_queue.put({'skipped' : True})
+            return
+        try:
+            setup_peak_rss = _rssmb()[1]
+            _resetpeakrss()
+            baseline_rss = _rssmb()[0] # taken after setup, just before the timed calls
+            times = []
+            for i in range(repeats):
+                start = time.time()
+                run()
+                times.append(time.time() - start)
+            peak_rss = _rssmb()[1]
+        finally:
+            if cleanup is not None:
+                cleanup()
+        # run_peak_rss_mb is the peak memory the timed calls add above the setup baseline
+        result_queue.put({'seconds' : min(times), 'seconds_all' : times, 'n_items' : n_items,
+                          'setup_peak_rss_mb' : setup_peak_rss, 'baseline_rss_mb' : baseline_rss,
+                          'peak_rss_mb' : peak_rss, 'run_peak_rss_mb' : max(0., peak_rss - baseline_rss)})
+    except Exception as e:
+        result_queue.put({'error' : '%s: %s' % (type(e).__name__, e)})
+
+def runbenchmarks(names=None, scale=1., repeats=1):
+    """ Run registered benchmarks (all if names is None), each in a fresh process. """
+    results = []
+    for name, setup in BENCHMARKS:
+        if names is not None and name not in names:
+            continue
+        result_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_runone, args=(setup, scale, repeats, result_queue))
+        process.start()
+        result = result_queue.get()
+        process.join()
+        result['name'] = name
+        results.append(result)
+        if 'seconds' in result:
+            print('%-28s %10.3f s %10.1f MB peak above setup' % (name, result['seconds'], result['run_peak_rss_mb']))
+        else:
+            print('%-28s %s' % (name, result.get('error', 'skipped')))
+    return {'meta' : {'python' : platform.python_version(), 'numpy' : np.__version__,
+                      'platform' : platform.platform(), 'scale' : scale, 'repeats' : repeats,
+                      'genome_len' : int(GENOME_LEN*scale), 'n_regions' : int(N_REGIONS*scale),
+                      'time' : time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results' : results}
+
+def compareresults(old_path, new_path):
+    """ Print time and memory ratios (new / old) of two benchmark JSON files. """
+    with open(old_path) as f:
+        old = dict((r['name'], r) for r in json.load(f)['results'])
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    for result in new:
+        if result['name'] in old and 'seconds' in result and 'seconds' in old[result['name']]:
+            previous = old[result['name']]
+            # files written before run_peak_rss_mb existed only have the peak including setup
+            memory_key = 'run_peak_rss_mb' if 'run_peak_rss_mb' in previous else 'peak_rss_mb'
+            print('%-28s time x%6.2f   peak memory x%6.2f' % (result['name'],
+                  result['seconds'] / max(previous['seconds'], 1e-9),
+                  result[memory_key] / max(previous[memory_key], 1e-9)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='genome-scale benchmarks of genomearray hot paths.')
+    parser.add_argument('--scale', type=float, default=1., help='multiplier on genome length and region counts.')
+    parser.add_argument('--repeats', type=int, default=1, help='timed repeats per benchmark, the fastest is reported.')
+    parser.add_argument('--only', default=None, help='comma separated benchmark names to run.')
+    parser.add_argument('--bam', default=None, help='indexed bam file for mapfragdensity, a synthetic one is generated if not given.')
+    parser.add_argument('--out', default=None, help='path of JSON output.')
+    parser.add_argument('--compare', nargs=2, default=None, metavar=('OLD', 'NEW'), help='compare two JSON outputs.')
+    args = parser.parse_args()
+    if args.compare is not None:
+        compareresults(*args.compare)
+        sys.exit(0)
+    BAM_PATH = args.bam
+    results = runbenchmarks(None if args.only is None else args.only.split(','), args.scale, args.repeats)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,5 +1,5 @@
 # code for local testing of genomearray code on laublab server
-import sys, os
+import sys, os, threading
 import numpy as np
 sys.path.append(os.path.relpath("/home/laublab/notebooks/dropbox_link/culviner/repositories/genomearray/"))
 import genomearray as ga
@@ -59,4 +59,398 @@ def test_pos_5to3wrt_addl():
 	assert output[0][0] == 0 and output[0][1] == 2 and output[1][0] == 2 and output[1][1] == 0 and output[1][0] == 2 and output[1][1] == 0
 	# check to ensure edges are properly handled
 	output = ga.regionfunc(lambda x: (x[0],x[-1]), input_regions, genome_data, addl_nt = (1,0), wrt = '5_to_3')
-	assert output[0][0] == 0 and output[0][1] == 1 and output[1][0] == 2 and output[1][1] == 1 and output[1][0] == 2 and output[1][1] == 1
\ No newline at end of file
+	assert output[0][0] == 0 and output[0][1] == 1 and output[1][0] == 2 and output[1][1] == 1 and output[1][0] == 2 and output[1][1] == 1
+
+# test ragged region slicing functionality
+
+def test_ragged_regionslice_matches_list():
+	genome_data = np.asarray([[0,1,2,3,4,5,6,7,8,9],
+			   			  [0,1,2,3,4,5,6,7,8,9]])
+	input_regions = np.asarray([[0,1,8],
+						  	    [1,1,8],
+						  	    [1,0,2],
+						  	    [0,9,9]])
+	for wrt in ['genome', '5_to_3']:
+		expected = ga.regionslice(input_regions, genome_data, addl_nt = (2,1), wrt = wrt)
+		output = ga.regionslice(input_regions, genome_data, addl_nt = (2,1), wrt = wrt, ragged = True)
+		assert len(output) == len(expected)
+		for o, e in zip(output, expected):
+			np.testing.assert_equal(o, e)
+
+def test_ragged_reductions_and_dense():
+	ragged = ga.RaggedArray(np.asarray([1,2,3,4,5,6]), [0,3,3,6], strands = [0,0,1], wrt = '5_to_3')
+	np.testing.assert_equal(ragged.sum(), [6,0,15])
+	np.testing.assert_equal(ragged.max(), [3,np.nan,6])
+	np.testing.assert_equal(ragged[2], [6,5,4])
+	np.testing.assert_equal(ragged.todense(2, fill_value = -1), [[1,2],[-1,-1],[6,5]])
+	np.testing.assert_equal(ragged.todense(4, fill_value = np.nan, align = '3_prime')[2], [np.nan,6,5,4])
+
+def test_ragged_saveload(tmpdir):
+	ragged = ga.regionslice(np.asarray([[0,1,3],[1,2,6]]), np.arange(20).reshape(2,10), ragged = True)
+	for path in [str(tmpdir.join('ragged.npz')), str(tmpdir.join('ragged'))]:
+		ga.saveragged(path, ragged)
+		loaded = ga.loadragged(path, mmap_mode = 'r')
+		for o, e in zip(loaded, ragged):
+			np.testing.assert_equal(o, e)
+
+# test fixed-width window gathering
+
+def test_windowslice_matches_extractntonehot():
+	onehot = np.random.RandomState(0).randint(0,2,(2,50,4)).astype(np.uint8)
+	positions = np.asarray([[0,10],[1,20],[1,31],[0,40]])
+	expected = ga.extractntonehot(onehot, positions, 5, 3)
+	output = ga.windowslice(positions, onehot, 5, 3)
+	assert output.shape == (4,8,4)
+	for o, e in zip(output, expected):
+		np.testing.assert_equal(o, e)
+	# evenly spaced windows on a single strand are returned as a view
+	positions = np.asarray([[1,p] for p in range(10,30,3)])
+	output = ga.windowslice(positions, onehot, 5, 3)
+	assert not output.flags.owndata
+	for o, e in zip(output, ga.extractntonehot(onehot, positions, 5, 3)):
+		np.testing.assert_equal(o, e)
+
+def test_windowslice_edges():
+	genome_data = np.asarray([[0,1,2,3,4,5,6,7,8,9],
+			   			  [0,1,2,3,4,5,6,7,8,9]]).astype(float)
+	output = ga.windowslice(np.asarray([[0,0],[1,9]]), genome_data, 2, 2, fill_value = np.nan)
+	np.testing.assert_equal(output, [[np.nan,np.nan,0,1],[np.nan,np.nan,9,8]])
+
+# test PWM bank scoring
+
+def test_bankconvolution_matches_genomeconvolution():
+	random_state = np.random.RandomState(0)
+	onehot = random_state.randint(0,2,(2,500,4)).astype(np.uint8)
+	pwms = [random_state.randn(4,m) for m in [6,9,2]]
+	output = ga.getBankConvolution(onehot, pwms, chunk_size = 77)
+	assert output.shape == (3,2,500)
+	for k, pwm in enumerate(pwms):
+		np.testing.assert_allclose(output[k], ga.getGenomeConvolution(onehot, pwm), atol = 1e-4)
+
+def test_motifhits_threshold_and_topk():
+	random_state = np.random.RandomState(0)
+	onehot = np.eye(4, dtype = np.uint8)[random_state.randint(0,4,(2,600))]
+	pwm = random_state.randn(4,6)
+	scores = ga.getGenomeConvolution(onehot, pwm)
+	scores[0,600-5:], scores[1,:5] = -np.inf, -np.inf # positions where the motif does not fit
+	positions, hit_scores = ga.getMotifHits(onehot, pwm, threshold = 1.5, chunk_size = 71)
+	np.testing.assert_equal(positions, np.argwhere(scores >= 1.5))
+	np.testing.assert_allclose(hit_scores, scores[scores >= 1.5], atol = 1e-4)
+	positions, hit_scores = ga.getMotifHits(onehot, pwm, top_k = 5, chunk_size = 71)
+	np.testing.assert_allclose(hit_scores, np.sort(scores.ravel())[::-1][:5], atol = 1e-4)
+
+def test_scorethreshold_zero_counts():
+	# frequencies (rows A,T,G,C) with zero counts, chosen so that every finite score is an integer
+	freq = np.asarray([[.5,.5,.125,.25],[.25,.5,.125,.25],[.25,0,.25,.25],[0,0,.5,.25]])
+	with np.errstate(divide = 'ignore'):
+		pwm = ga.getPositionWeightMatrix(freq, np.zeros((4,1)) + .25)
+	assert np.any(np.isneginf(pwm))
+	# exact scores of every sequence of equiprobable bases
+	sequence_scores = np.asarray([np.sum(pwm[list(bases), range(4)]) for bases in np.ndindex(4,4,4,4)])
+	for pvalue in [.05, .2]:
+		threshold = ga.getScoreThreshold(pwm, pvalue)
+		assert np.isfinite(threshold)
+		assert np.mean(sequence_scores >= threshold) <= pvalue < np.mean(sequence_scores >= threshold - 0.002) # a step of the default resolution lower
+
+def test_motifhits_zero_counts():
+	freq = np.asarray([[.5,.5,.125,.25],[.25,.5,.125,.25],[.25,0,.25,.25],[0,0,.5,.25]])
+	with np.errstate(divide = 'ignore'):
+		pwm = ga.getPositionWeightMatrix(freq, np.zeros((4,1)) + .25)
+	bases = np.random.RandomState(0).randint(0,4,(2,300))
+	onehot = np.eye(4, dtype = np.uint8)[bases]
+	# expected scores, -inf for windows using a zero frequency base
+	expected = np.zeros((2,300))
+	for strand, strand_bases in [(0, bases[0]), (1, bases[1][::-1])]:
+		strand_scores = [np.sum(pwm[strand_bases[i:i+4], range(4)]) for i in range(297)] + [0,0,0]
+		expected[strand] = strand_scores if strand == 0 else strand_scores[::-1]
+	output = ga.getBankConvolution(onehot, [pwm], chunk_size = 77)[0]
+	assert not np.any(np.isnan(output)) and np.any(np.isneginf(output)) and np.any(np.isfinite(output[output != 0]))
+	np.testing.assert_allclose(output, expected, atol = 1e-4)
+	positions, scores = ga.getMotifHits(onehot, pwm, threshold = 2)
+	assert positions.shape[0] == np.sum(expected >= 2) > 0
+	np.testing.assert_allclose(scores, expected[positions[:,0], positions[:,1]], atol = 1e-4)
+	assert ga.getMotifHits(onehot, pwm, top_k = 5)[0].shape[0] == 5
+	positions, scores = ga.getMotifHits(onehot, pwm, pvalue = .05)
+	assert positions.shape[0] > 0 and np.all(np.isfinite(scores))
+
+# test motif index search
+
+def test_findmotif_matches_scan():
+	sequence = ''.join(np.random.RandomState(0).choice(list('ATGC'), 5000))
+	complement = dict(zip('ATGC', 'TACG'))
+	motif_index = ga.MotifIndex(sequence, k = 5)
+	for motif in ['TTGACA', 'GAT', 'TTGNNNAC']:
+		left, right = 1000, 3000
+		hits = ga.findmotif(motif_index, motif, left, right)
+		m = len(motif)
+		def matches(s, pattern):
+			return all([p == 'N' or p == c for c, p in zip(s, pattern)])
+		rc_motif = ''.join([complement.get(c, c) for c in motif[::-1]])
+		fwd = [i for i in range(left, right-m+2) if matches(sequence[i:i+m], motif)]
+		rev = [i+m-1 for i in range(left, right-m+2) if matches(sequence[i:i+m], rc_motif)]
+		np.testing.assert_equal(hits[hits[:,0] == 0,1], fwd)
+		np.testing.assert_equal(hits[hits[:,0] == 1,1], rev)
+
+# test profiling : calls, items and nesting are recorded only while enabled
+
+def test_profiling_records_calls():
+	test_array = np.arange(40).reshape(2,20)
+	regions = np.asarray([[0,0,4],[1,5,9],[0,10,19]])
+	ga.regionfunc(np.sum, regions, test_array) # not recorded
+	with ga.profiling():
+		for i in range(3):
+			ga.regionfunc(np.sum, regions, test_array)
+		ga.regionfunc(np.sum, regions = regions[:1], input_array = test_array)
+	stats = ga.profilestats()
+	assert stats['core.slicing.regionfunc']['calls'] == 4
+	assert stats['core.slicing.regionfunc']['items'] == 10
+	ga.regionfunc(np.sum, regions, test_array) # disabled again on exit
+	assert ga.profilestats()['core.slicing.regionfunc']['calls'] == 4
+	assert 'core.slicing.regionfunc' in ga.profilereport()
+	# without tracemalloc only the growth of the RSS high-water mark is measured, and labelled so
+	assert ('RSS grow MB' in ga.profilereport()) == (ga.core.instrument.tracemalloc is None)
+
+# test lazy submodules : importing genomearray does not load heavy third-party packages
+
+def test_lazy_import():
+	import subprocess
+	package_dir = os.path.dirname(os.path.dirname(os.path.abspath(ga.__file__)))
+	code = ('import sys; import genomearray as ga; '
+	        'heavy = [m for m in ["pysam", "scipy", "matplotlib", "seaborn", "regex", "sklearn"] if m in sys.modules]; '
+	        'assert heavy == [], heavy; '
+	        'assert callable(ga.ntmath.rollingslope); assert "genomearray.ntmath" in sys.modules; '
+	        'assert "pysam" not in sys.modules')
+	env = dict(os.environ, PYTHONPATH = package_dir)
+	subprocess.check_call([sys.executable, '-c', code], env = env)
+
+# test multi-replicon genome arrays : region translation, boundary guards and bam mapping
+
+def test_genomearray_regions():
+	genome_array = ga.GenomeArray.fromlist([np.arange(20).reshape(2,10), np.arange(100,112).reshape(2,6)], names = ['chr', 'plasmid'])
+	regions = np.asarray([[0,0,2,4],[1,1,0,5],[1,0,3,3]])
+	np.testing.assert_equal(genome_array.toglobal(regions), [[0,2,4],[1,10,15],[0,13,13]])
+	np.testing.assert_equal(genome_array.tolocal(genome_array.toglobal(regions)), regions)
+	# additional nt are clipped at replicon edges
+	slices = genome_array.regionfunc(lambda x: x.tolist(), regions, addl_nt = (2,3))
+	assert slices == [[0,1,2,3,4,5,6,7], [111,110,109,108,107,106], [101,102,103,104,105]]
+	for bad_regions, function in [([[0,8,11]], genome_array.tolocal), ([[1,0,0,6]], genome_array.toglobal)]:
+		try:
+			function(bad_regions)
+			assert False
+		except ValueError:
+			pass
+	guarded = genome_array.guardboundaries(genome_array.values.copy(), 2)
+	assert np.all(np.isnan(guarded[:,8:12])) and not np.any(np.isnan(guarded[:,:8]))
+
+def test_genomearray_frombam(tmpdir):
+	path = ga.synth.fragmentbam(str(tmpdir.join('replicons.bam')), [ga.synth.randomgenome(3000, record_id = 'chr'), 1500], 500, random_seed = 0)
+	genome_array = ga.GenomeArray.frombam(path)
+	assert genome_array.names == ['chr', 'chr1']
+	for replicon_i in range(2):
+		np.testing.assert_equal(genome_array.replicon(replicon_i), ga.mapgen.mapfragdensity(path, refseq_index = replicon_i))
+	ga.savegenomearray(str(tmpdir.join('store')), genome_array)
+	loaded = ga.loadgenomearray(str(tmpdir.join('store')), mmap_mode = 'r')
+	np.testing.assert_equal(loaded.values, genome_array.values)
+	np.testing.assert_equal(loaded.offsets, genome_array.offsets)
+
+# test chunked stores : region reads and full loads match the stored array
+
+def test_chunked_roundtrip(tmpdir):
+	test_array = np.random.RandomState(0).randint(0, 100, (2,1000)).astype(np.uint32)
+	path = str(tmpdir.join('chunked'))
+	ga.savechunked(path, test_array, chunk_len = 64, workers = 2)
+	assert ga.ischunked(path)
+	chunked = ga.ChunkedArray(path, cache_chunks = 4, workers = 2)
+	assert chunked.shape == test_array.shape
+	np.testing.assert_equal(np.asarray(chunked), test_array)
+	chunked.close()
+	n_threads = threading.active_count()
+	np.testing.assert_equal(ga.loadarrays([path, path]), np.asarray([test_array, test_array]))
+	np.testing.assert_equal(chunked.read(100, 120), test_array[:,100:121])
+	np.testing.assert_equal(chunked.read(100, 150), test_array[:,100:151]) # two chunks, one cached
+	assert threading.active_count() == n_threads # one-shot loads and small reads start no threads
+	np.testing.assert_equal(chunked.read(workers = 3), test_array)
+	chunked.close()
+	assert threading.active_count() == n_threads # closing stops the pool threads
+	for key in [(1, slice(10, 300)), (0, 999), (slice(None), [3, 500, 7]), (1, slice(500, 10, -3)), (0, slice(10, 5))]:
+		np.testing.assert_equal(chunked[key], test_array[key])
+	regions = np.asarray([[0,0,63],[1,60,70],[0,100,900],[1,990,999]])
+	assert ga.regionfunc(np.sum, regions, chunked) == ga.regionfunc(np.sum, regions, test_array)
+
+# test run-length encoded tracks against dense arrays
+
+def test_rletrack_matches_dense(tmpdir):
+	random_state = np.random.RandomState(0)
+	dense_a = random_state.randint(0, 3, (2,50)).astype(float)
+	dense_a[random_state.rand(2,50) < 0.2] = np.nan
+	dense_b = random_state.randint(0, 3, (2,50))
+	rle_a, rle_b = ga.RLETrack.fromdense(dense_a), ga.RLETrack.fromdense(dense_b)
+	np.testing.assert_equal(rle_a.todense(), dense_a)
+	np.testing.assert_equal((rle_a*2 - rle_b).todense(), dense_a*2 - dense_b)
+	np.testing.assert_equal((rle_b > 1).todense(), dense_b > 1)
+	regions = np.c_[random_state.randint(0,2,20), np.sort(random_state.randint(0,50,(20,2)), axis = 1)]
+	np.testing.assert_allclose(rle_a.regionsum(regions), ga.regionfunc(np.sum, regions, dense_a))
+	np.testing.assert_allclose(rle_a.regionsum(regions, skipna = True), ga.regionfunc(np.nansum, regions, dense_a))
+	np.testing.assert_allclose(rle_a.regionmean(regions), ga.regionfunc(np.mean, regions, dense_a))
+	np.testing.assert_equal(rle_b.regionsum(regions), ga.regionfunc(np.sum, regions, dense_b))
+	np.testing.assert_equal(rle_b.toregions(), ga.masktoregions(dense_b > 0))
+	np.testing.assert_equal(ga.RLETrack.fromregions(regions, 50).todense(), ga.regionstomask(regions, 50))
+	empty = ga.RLETrack.fromregions(np.empty((0,3), dtype = int), 50)
+	assert empty.toregions().shape == (0,3) and rle_b.toregions(value = 7).shape == (0,3)
+	ga.saverle(str(tmpdir.join('track.npz')), rle_a)
+	np.testing.assert_equal(ga.loadrle(str(tmpdir.join('track.npz'))).todense(), dense_a)
+	# log2 of zero coverage gives -inf runs, which only affect the regions overlapping them
+	with np.errstate(divide = 'ignore'):
+		log2_dense = np.log2(dense_b.astype(float) * 4)
+	log2_dense[1, 30] = np.inf
+	log2_rle = ga.RLETrack.fromdense(log2_dense)
+	assert np.any(np.isfinite(log2_rle.regionmean(regions))) and np.any(np.isneginf(log2_rle.regionmean(regions)))
+	with np.errstate(invalid = 'ignore'):
+		for function, rle_function in [(np.sum, log2_rle.regionsum), (np.mean, log2_rle.regionmean), (np.nansum, lambda r: log2_rle.regionsum(r, skipna = True))]:
+			np.testing.assert_equal(rle_function(regions), ga.regionfunc(function, regions, log2_dense))
+		inf_regions = np.asarray([[1,28,32],[1,32,35]])
+		np.testing.assert_equal(log2_rle.regionmean(inf_regions), ga.regionfunc(np.mean, inf_regions, log2_dense))
+
+def test_bedgraph_wig_roundtrip(tmpdir):
+	random_state = np.random.RandomState(0)
+	track = np.round(random_state.rand(2,200)*4 - 1, 2)
+	track[:, 20:60] = 0
+	track[0, 100:110] = 1.5
+	paths = (str(tmpdir.join('plus.bedgraph')), str(tmpdir.join('minus.bedgraph.gz')))
+	ga.writebedgraph(paths, track, 'chr', negative_minus = True)
+	np.testing.assert_allclose(ga.readbedgraph(paths, 200, negative_minus = True), track)
+	with open(paths[0]) as f:
+		assert f.readline().split('\t')[0] == 'chr' and len(f.readlines()) < 200
+	track[1, 150:] = np.nan
+	wig_paths = (str(tmpdir.join('plus.wig')), str(tmpdir.join('minus.wig.gz')))
+	ga.writewig(wig_paths, track, 'chr')
+	np.testing.assert_allclose(ga.readwig(wig_paths, 200), track)
+	# values that cannot be written as fixed-point text raise rather than overflow
+	for bad_value in [np.inf, -np.inf, 1e20]:
+		track[0, 5] = bad_value
+		for writer, writer_paths in [(ga.writebedgraph, paths), (ga.writewig, wig_paths)]:
+			try:
+				writer(writer_paths, track, 'chr')
+				assert False
+			except ValueError:
+				pass
+
+# test incremental accumulation : topped-up density and cached size factors match a full recompute
+
+def test_incremental_density_and_sizefactors(tmpdir):
+	genome = ga.synth.randomgenome(2000, random_seed = 0)
+	paths = [ga.synth.fragmentbam(str(tmpdir.join('run%i.bam' % i)), genome, 300, random_seed = i) for i in range(3)]
+	density = ga.mapgen.mapfragdensity(paths[0])
+	ga.mapgen.addfragdensity(paths[1], density)
+	np.testing.assert_equal(density, ga.mapgen.mapfragdensity(paths[0]) + ga.mapgen.mapfragdensity(paths[1]))
+	try:
+		ga.mapgen.addfragdensity(paths[2], np.zeros((2,1000), dtype = np.uint32))
+		assert False
+	except ValueError:
+		pass
+	try:
+		ga.mapgen.addfragdensity(paths[2], np.full((2,2000), 250, dtype = np.uint8))
+		assert False
+	except ValueError:
+		pass
+	samples = np.asarray([ga.mapgen.mapfragdensity(path) for path in paths])
+	regions = np.asarray([[0,100,500],[1,600,1200],[0,1300,1900]])
+	cache = ga.CohortSizeFactors('median', regions)
+	for i, sample in enumerate(samples):
+		cache.addsample('s%i' % i, sample)
+	np.testing.assert_allclose(cache.normalize(samples[1], 's1', log2 = True),
+							   ga.mediandensitynormalization(samples, regions = regions, log2 = True)[1])
+	ga.savesizefactors(str(tmpdir.join('factors.npz')), cache)
+	loaded = ga.loadsizefactors(str(tmpdir.join('factors.npz')))
+	np.testing.assert_allclose(loaded.sizefactors(), cache.sizefactors())
+	counts = ga.CohortSizeFactors('count')
+	for i, path in enumerate(paths):
+		counts.addsample('s%i' % i, paths_to_bams = [path])
+	np.testing.assert_allclose(counts.normalize(samples[2], 's2', log2 = False),
+							   ga.countnormalization(samples, paths, log2 = False)[2])
+
+# test cohort mapping and threaded loading : failures are isolated, loaded stacks match
+
+def test_mapcohort_loadarrays(tmpdir):
+	genome = ga.synth.randomgenome(2000, random_seed = 0)
+	paths = [ga.synth.fragmentbam(str(tmpdir.join('s%i.bam' % i)), genome, 200, random_seed = i) for i in range(3)]
+	out_paths = [str(tmpdir.join('s%i.npy' % i)) for i in range(4)]
+	results, failures = ga.mapgen.mapcohort(paths + [str(tmpdir.join('missing.bam'))], out_paths, workers = 2)
+	assert results[:3] == out_paths[:3] and results[3] is None and list(failures) == [str(tmpdir.join('missing.bam'))]
+	expected = np.asarray([ga.mapgen.mapfragdensity(path) for path in paths])
+	loaded = ga.loadarrays(out_paths[:3], workers = 3)
+	assert loaded.dtype == np.uint32
+	np.testing.assert_equal(loaded, expected)
+	loaded2d = ga.loadarrays2d([out_paths[:2], out_paths[2:3]], workers = 3)
+	np.testing.assert_equal(loaded2d[1][0], expected[2])
+
+# test summary pyramids : binned statistics match direct reductions, levels built from each other
+
+def test_summary_pyramid(tmpdir):
+	track = np.random.RandomState(0).poisson(3, (2,2345)).astype(float)
+	track[1, 100:250] = np.nan
+	pyramid = ga.SummaryPyramid.fromarray(track, factors = (10, 100, 300), block_len = 1000)
+	padded = np.concatenate([track, np.full((2,55), np.nan)], 1).reshape(2, -1, 100)
+	np.testing.assert_allclose(pyramid.level('sum', 100), np.nansum(padded, axis = 2))
+	np.testing.assert_allclose(pyramid.level('max', 100)[0, :-1], np.max(padded[0, :-1], axis = 1))
+	assert np.isnan(pyramid.level('mean', 10)[1, 15])
+	bin_starts, values, factor = pyramid.query(0, 450, 1999, 'min', min_bins = 10)
+	assert factor == 100 and bin_starts[0] == 400 and bin_starts[-1] == 1900
+	np.testing.assert_allclose(values, np.min(track[0, 400:2000].reshape(-1,100), axis = 1))
+	assert pyramid.levels[300]['count'][0, -1] == 2345 - 7*300
+	ga.savepyramid(str(tmpdir.join('track.pyramid.npz')), pyramid)
+	loaded = ga.loadpyramid(str(tmpdir.join('track.pyramid.npz')))
+	np.testing.assert_allclose(loaded.level('mean', 300), pyramid.level('mean', 300))
+
+# test parallel regionfunc : thread and process pools match the serial loop, including NaN on exception
+
+def _firstoverthree(x):
+	return x[np.nonzero(x > 3)[0][0]] # raises IndexError if no value is over 3
+
+def test_regionfunc_parallel():
+	random_state = np.random.RandomState(0)
+	genome_data = random_state.randint(0, 5, (2,500))
+	lefts = random_state.randint(0,495,200)
+	regions = np.c_[random_state.randint(0,2,200), lefts, lefts + random_state.randint(0,5,200)]
+	serial = ga.regionfunc(_firstoverthree, regions, genome_data, addl_nt = (1,2))
+	assert np.any(np.isnan(serial))
+	for pool in ['thread', 'process']:
+		parallel = ga.regionfunc(_firstoverthree, regions, genome_data, addl_nt = (1,2), workers = 3, chunk_size = 17, pool = pool)
+		np.testing.assert_equal(parallel, serial)
+	slices = ga.regionslice(regions, genome_data, wrt = 'genome', workers = 2)
+	for s, expected in zip(slices, ga.regionslice(regions, genome_data, wrt = 'genome')):
+		np.testing.assert_equal(s, expected)
+
+# test memory budget : chunked fallbacks match the unbudgeted results, oversize allocations raise
+
+def test_memory_budget():
+	random_state = np.random.RandomState(0)
+	track = random_state.poisson(5, (2,3000)).astype(float)
+	samples = random_state.poisson(5, (3,2,3000))
+	regions = np.asarray([[0,10,500],[1,600,2000],[0,2100,2900]])
+	onehot = ga.dnatoonehot(''.join(random_state.choice(list('ATGC'), 3000)))
+	onehot = np.asarray([onehot, onehot[::-1]])
+	pwm = random_state.rand(4,8)
+	slopes = ga.ntmath.rollingslope(track, 50, '3_prime')
+	convolution = ga.getGenomeConvolution(onehot, pwm)
+	normalized = ga.mediandensitynormalization(samples, regions = regions, log2 = True)
+	with ga.memorybudget('300K'):
+		assert ga.getmemorybudget() == 300*1024
+		np.testing.assert_equal(ga.ntmath.rollingslope(track, 50, '3_prime'), slopes)
+		np.testing.assert_allclose(ga.getGenomeConvolution(onehot, pwm), convolution)
+		np.testing.assert_allclose(ga.mediandensitynormalization(samples, regions = regions, log2 = True), normalized)
+		try:
+			ga.regionstomask(regions, 10**6)
+			assert False
+		except ga.MemoryBudgetError as e:
+			assert isinstance(e, MemoryError) and e.estimate == 2*10**6
+	assert ga.getmemorybudget() is None
+
+# test region splitting : remainders are split around windows, blocks concatenate to the full output
+
+def test_splitregions_blocks():
+	regions = np.asarray([[0,0,24],[1,100,104],[1,200,231]])
+	windows = ga.splitregions(regions, 10, 5)
+	np.testing.assert_equal(windows, [[0,0,9],[0,5,14],[0,10,19],[0,15,24],[1,201,210],[1,206,215],[1,211,220],[1,216,225],[1,221,230]])
+	np.testing.assert_equal(np.concatenate(list(ga.itersplitregions(regions, 10, 5, block_size = 3))), windows)
+	assert ga.splitregions(regions[1:2], 10, 5).shape == (0,3)
@@ -0,0 +1,121 @@
+# code for local testing of genomearray code on laublab server
+import sys, os
+import numpy as np
+sys.path.append(os.path.relpath("/home/laublab/notebooks/dropbox_link/culviner/repositories/genomearray/"))
+import genomearray as ga
+
+# test batch generation : prefetchiter should yield the same batches as batchiter
+
+features = [[np.arange(200).reshape(100,2), np.arange(100)*10], 
+            np.asarray([np.arange(100) % 2, 1 - np.arange(100) % 2]).T,
+            np.ones(100)]
+shuffle_order = np.random.RandomState(0).permutation(100)
+
+def _takebatches(iterator, n_batches):
+    return [next(iterator) for i in range(n_batches)]
+
+def _assertbatchesequal(batches, expected):
+    assert len(batches) == len(expected)
+    for (x, y, w), (ex, ey, ew) in zip(batches, expected):
+        for xi, exi in zip(x, ex):
+            np.testing.assert_equal(xi, exi)
+        np.testing.assert_equal(y, ey)
+        np.testing.assert_equal(w, ew)
+
+def test_prefetchiter_single_cycle():
+    for pool in ['thread', 'process']:
+        expected = list(ga.cutnn.nn.batchiter(features, shuffle_order, batch_size=7, mode='train',
+                                              data_modification=lambda x: x*2, single_cycle=True))
+        batches = list(ga.cutnn.nn.prefetchiter(features, shuffle_order, batch_size=7, mode='train',
+                                                data_modification=lambda x: x*2, single_cycle=True,
+                                                pool=pool, prefetch=3))
+        _assertbatchesequal(batches, expected)
+
+def test_prefetchiter_seeded_shuffle():
+    expected = _takebatches(ga.cutnn.nn.batchiter(features, shuffle_order, batch_size=20, mode='train',
+                                                  shuffle_function=ga.cutnn.nn.randshuffle,
+                                                  shuffle_parameters={'random_state' : np.random.RandomState(5)}), 9)
+    global_state = np.random.get_state()[1].copy()
+    # two iterators with the same seed, consumed in alternation, do not disturb each other
+    iterators = [ga.cutnn.nn.prefetchiter(features, shuffle_order, batch_size=20, mode='train',
+                                          shuffle_function=ga.cutnn.nn.randshuffle, random_seed=5) for i in range(2)]
+    batches = [[next(iterator) for iterator in iterators] for i in range(9)]
+    for i in range(2):
+        _assertbatchesequal([pair[i] for pair in batches], expected)
+    np.testing.assert_equal(np.random.get_state()[1], global_state)
+
+# test on-disk feature store
+
+def test_featurestore_roundtrip(tmpdir):
+    store = ga.cutnn.feat.FeatureStore(str(tmpdir.join('store')), mode='w')
+    for chunk_start in range(0, 100, 30):
+        chunk = slice(chunk_start, chunk_start+30)
+        store.append([features[0][0][chunk], features[0][1][chunk]], labels=features[1][chunk])
+    store.close(weights=features[2])
+    store = ga.cutnn.feat.FeatureStore(str(tmpdir.join('store')))
+    for stored, expected in zip(store[0], features[0]):
+        np.testing.assert_equal(stored, expected)
+    np.testing.assert_equal(store[1], features[1])
+    batches = list(ga.cutnn.nn.batchiter(store, shuffle_order, batch_size=7, mode='train',
+                                         single_cycle=True, sort_batches=True))
+    for x, y, w in batches:
+        np.testing.assert_equal(x[1] // 10 % 2, y[:,0])
+
+# test streaming prediction against in-memory prediction
+
+class _SumModel():
+    # stand-in for a keras model, the 'positive rate' is the sum of each feature
+    def predict(self, x):
+        x = np.asarray(x).reshape(len(x), -1).sum(axis=1)
+        return np.asarray([-x, x]).T
+
+def test_streampredictions_matches_mappredictions():
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+    random_state = np.random.RandomState(0)
+    genome = SeqRecord(Seq(''.join(random_state.choice(list('ATGC'), 300))))
+    regions = np.asarray([[0,20,120],[1,150,280]])
+    ntfeatures_kwargs = {'regions' : regions, 'genome' : genome,
+                         'array_types' : ['centered'], 'offset_terms' : [(-5,5)],
+                         'additional_data_arrays' : [random_state.rand(2,300)]}
+    positions, region_features = ga.cutnn.feat.regionlistfeatures(regions, 3, ntfeatures_kwargs)
+    expected = ga.cutnn.nn.mappredictions(_SumModel(), positions, region_features, 300)
+    output = ga.cutnn.nn.streampredictions(_SumModel(), regions, 3, ntfeatures_kwargs, 300, chunk_size=7)
+    np.testing.assert_allclose(output, expected)
+
+def test_regionlistfeatures_parallel():
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+    random_state = np.random.RandomState(1)
+    genome = SeqRecord(Seq(''.join(random_state.choice(list('ATGC'), 500))))
+    regions = np.asarray([[0,20,120],[1,150,280],[0,300,480]])
+    ntfeatures_kwargs = {'regions' : regions, 'genome' : genome,
+                         'array_types' : ['centered', 'centered'], 'offset_terms' : [(-5,5), (-2,3)],
+                         'additional_data_arrays' : [random_state.rand(2,500), random_state.rand(2,500)]}
+    target_regions = np.tile(regions, (6,1)) # several regions per worker chunk
+    expected_positions, expected = ga.cutnn.feat.regionlistfeatures(target_regions, 4, ntfeatures_kwargs)
+    positions, output = ga.cutnn.feat.regionlistfeatures(target_regions, 4, ntfeatures_kwargs, workers=2)
+    np.testing.assert_equal(positions, expected_positions)
+    for o, e in zip(output, expected):
+        np.testing.assert_equal(o, e)
+
+# test k-mer count features
+
+def test_kmerfeatures_counts():
+    sequence = ''.join(np.random.RandomState(0).choice(list('ATGC'), 200))
+    complement = dict(zip('ATGC', 'TACG'))
+    kmer_codes = ga.cutnn.feat.genomekmercodes(sequence, 2)
+    positions = np.asarray([[0,50],[1,120],[0,3]])
+    counts = ga.cutnn.feat.kmerfeatures(positions, kmer_codes=kmer_codes, k=2, five=10, three=6)[0]
+    sparse_counts = ga.cutnn.feat.kmerfeatures(positions, kmer_codes=kmer_codes, k=2, five=10, three=6, sparse=True)[0]
+    np.testing.assert_equal(sparse_counts.toarray(), counts)
+    code = dict(zip('ATGC', range(4)))
+    for (strand, pos), window_counts in zip(positions, counts):
+        if strand == 0:
+            window = sequence[max(0,pos-10):pos+6]
+        else:
+            window = ''.join([complement[c] for c in sequence[pos-5:pos+11][::-1]])
+        expected = np.zeros(16)
+        for i in range(len(window)-1):
+            expected[code[window[i]]*4 + code[window[i+1]]] += 1
+        np.testing.assert_equal(window_counts, expected)
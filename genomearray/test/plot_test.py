@@ -0,0 +1,27 @@
+# code for local testing of genomearray code on laublab server
+import sys, os
+import numpy as np
+import matplotlib.pyplot as plt
+sys.path.append(os.path.relpath("/home/laublab/notebooks/dropbox_link/culviner/repositories/genomearray/"))
+import genomearray as ga
+
+# test batch rendering : pdf pages and png files are written for every gene, in gene order
+
+def test_rendergenes(tmpdir):
+    genome = ga.synth.randomgenome(5000, random_seed=0)
+    gene_names, gene_regions = ga.synth.generegions(5000, 4, max_len=800, random_seed=0)
+    track = ga.synth.coveragetrack(5000, gene_regions, random_seed=0)[0]
+    np.save(str(tmpdir.join('track.npy')), track)
+    spec = {'gene_names' : gene_names, 'gene_regions' : gene_regions, 'n_axes' : 2,
+            'tracks' : [{'axis' : 0, 'data' : str(tmpdir.join('track.npy'))}],
+            'regions' : [{'axis' : 1, 'regions' : gene_regions, 'y_array' : track}],
+            'motifs' : [{'motif' : 'TATAAT', 'motif_index' : ga.MotifIndex(genome)}]}
+    written = ga.plot.rendergenes(list(gene_names), spec, str(tmpdir.join('genes.pdf')), workers=2)
+    assert written == [str(tmpdir.join('genes.part0.pdf')), str(tmpdir.join('genes.part1.pdf'))]
+    plt.switch_backend('agg') # the caller's figure needs no display
+    open_figure = plt.figure() # figures of the calling process are left open
+    written = ga.plot.rendergenes(list(gene_names[:2]), spec, str(tmpdir.join('png')), workers=1)
+    assert written == [str(tmpdir.join('png', '%s.png' % name)) for name in gene_names[:2]]
+    assert plt.fignum_exists(open_figure.number)
+    plt.close(open_figure)
+    assert all(os.path.getsize(path) > 0 for path in written)
@@ -0,0 +1,50 @@
+# code for local testing of genomearray code on laublab server
+import sys, os
+import numpy as np
+sys.path.append(os.path.relpath("/home/laublab/notebooks/dropbox_link/culviner/repositories/genomearray/"))
+import genomearray as ga
+
+# test synthetic genomes : seeded, GC biased, and one-hot identical to genometoonehot
+
+def test_randomgenome_seeded_onehot():
+    genome, onehot = ga.synth.randomgenome(2000, gc_amplitude=0.2, gc_period=500, random_seed=1, onehot=True)
+    assert str(genome.seq) == str(ga.synth.randomgenome(2000, gc_amplitude=0.2, gc_period=500, random_seed=1).seq)
+    np.testing.assert_equal(onehot, ga.genometoonehot(genome))
+
+def test_randomgenome_gc_content():
+    genome = ga.synth.randomgenome(20000, gc_content=0.7, random_seed=0)
+    sequence = str(genome.seq)
+    assert abs((sequence.count('G') + sequence.count('C')) / 20000. - 0.7) < 0.02
+
+# test gene regions and coverage tracks
+
+def test_generegions_sorted_nonoverlapping():
+    names, regions = ga.synth.generegions(100000, 40, random_seed=2)
+    assert len(names) == regions.shape[0] == 40
+    assert np.all(regions[1:,1] > regions[:-1,2])
+    assert regions[0,1] >= 0 and regions[-1,2] < 100000
+
+def test_coveragetrack_genes():
+    regions = np.asarray([[0, 100, 199], [1, 500, 599]])
+    track, peaks, valleys = ga.synth.coveragetrack(1000, regions, expression=[10, 20], background=1.,
+                                                   n_peaks=0, n_valleys=0, poisson=False)
+    expected = np.ones((2,1000))
+    expected[0,100:200] += 10
+    expected[1,500:600] += 20
+    np.testing.assert_allclose(track, expected)
+
+# test bam generation : mapped density matches the generated fragments
+
+def test_fragmentbam_mapfragdensity(tmpdir):
+    genome = ga.synth.randomgenome(5000, random_seed=1)
+    names, regions = ga.synth.generegions(5000, 4, max_len=800, random_seed=2)
+    path, fragments = ga.synth.fragmentbam(str(tmpdir.join('synthetic.bam')), genome, 500, gene_regions=regions,
+                                           random_seed=3, chunk_size=200, return_fragments=True)
+    expected = np.zeros((2,5000))
+    for ref_i, strand, left, right in fragments:
+        expected[strand,left:right+1] += 1
+    np.testing.assert_equal(ga.mapgen.mapfragdensity(path), expected)
+    counts = ga.regmath.mapregioncounts(path, regions)[0]
+    for region_i, (strand, left, right) in enumerate(regions):
+        overlapping = (fragments[:,1] == strand) & (fragments[:,3] >= left) & (fragments[:,2] <= right)
+        assert counts[region_i] == np.sum(overlapping)